@@ -1,91 +1,438 @@
+import re
 import json
-import time
+import random
+import asyncio
 import logging
-from google.genai import types
-from config import client, GEMINI_MODEL
+from config import (
+    GEMINI_API_KEY, GEMINI_MODEL, GEMINI_RPM, GEMINI_TPM, GEMINI_CONCURRENCY, GEMINI_MAX_ATTEMPTS,
+    GEMINI_OUTPUT_TOKENS, PROMPT_TOKEN_BUDGET, GEMINI_BATCH_MAX_SIZE, GEMINI_BATCH_TOKEN_BUDGET
+)
+import metrics
+from ratelimit import RateLimiter
+from models import UNKNOWN_TITLE
+from verdict_cache import VerdictCache, verdict_key
 
+DEAL_TYPES = ["BAD DEAL", "NORMAL DEAL", "GREAT DEAL", "BARGAIN"]
 
-def check_bargain_gemini(title, price, year, url, details):
-    """Ocenia opłacalność ogłoszenia przy użyciu Gemini API."""
-    if not client:
-        return "NORMAL DEAL", "Brak klucza GEMINI_API_KEY."
-
-    if "Nieznany pojazd" in title:
-        return "NORMAL DEAL", "Nie można przeanalizować - brak tytułu z serwisu."
-
-    desc_cropped = details['description'][:2500] if details['description'] else "Brak opisu"
-    params_cropped = details['parameters'][:2500] if details['parameters'] else "Brak parametrów"
-    highlights_cropped = details.get('highlights', '')[:1000] if details.get('highlights') else "Brak wyróżnionych parametrów"
-
-    prompt = f"""
-    Jesteś wybitnym ekspertem polskiego rynku motocyklowego (Otomoto/OLX) oraz doświadczonym handlarzem (flipperem).
-    Twoim zadaniem jest ocena opłacalności zakupu tego motocykla w celu dalszej odsprzedaży z zyskiem.
-
-    DANE OGŁOSZENIA:
-    Tytuł: {title}
-    Rocznik pojazdu: {year}
-    Cena: {price}
-    Link: {url}
-
-    NAJWAŻNIEJSZE PARAMETRY (HIGHLIGHT):
-    {highlights_cropped}
-
-    SZCZEGÓŁOWE PARAMETRY I WYPOSAŻENIE MOTOCYKLA:
-    {params_cropped}
-
-    OPIS SPRZEDAJĄCEGO:
-    {desc_cropped}
-
-    Instrukcje analizy:
-    1. Oceń REALNĄ WARTOŚĆ RYNKOWĄ na podstawie parametrów (rocznik: {year}, przebieg, pojemność, moc, stan).
-    2.  - ROK PRODUKCJI: {year}
-       - PRZEBIEG (ile km przejechał)
-       - POJEMNOŚĆ SILNIKA (cm³)
-       - MOC (KM/kW)
-       - MODEL motocykla (marka i model)
-       - CZY JEST USZKODZONY (uszkodzony/bezwypadkowy/stan)
-    2. Zwróć szczególną uwagę na mankamenty (np. uszkodzony silnik, rysa, brak dokumentów, sprowadzony do opłat).
-    3. Kategorie oceny:
-       - BARGAIN: Cena 30%+ poniżej rynku. Potężny potencjał zysku.
-       - GREAT DEAL: Cena 15-20% poniżej rynku.
-       - NORMAL DEAL: Cena rynkowa.
-       - BAD DEAL: Za drogi lub koszty napraw przewyższają sens zakupu.
-
-    WAŻNE: Pole "analysis" MUSI mieć MAKSYMALNIE 6 krótkich zdań. Napisz zwięźle:
-    model/rocznik/przebieg, wartość rynkowa vs cena, ewentualne ryzyka, werdykt.
-    Bez rozpisywania się. Krótko i na temat.
-
-    Odpowiedz w formacie JSON z polami "deal_type" oraz "analysis".
+RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+
+_client = None
+_verdict_cache = None
+_evaluator = None
+
+
+def get_client():
+    """Klient Gemini tworzony przy pierwszym użyciu (import google.genai trwa długo) albo None bez klucza."""
+    global _client
+    if _client is None and GEMINI_API_KEY:
+        from google import genai
+        _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+
+def get_verdict_cache():
+    """Zwraca współdzielony cache werdyktów (tworzony przy pierwszym użyciu)."""
+    global _verdict_cache
+    if _verdict_cache is None:
+        _verdict_cache = VerdictCache()
+    return _verdict_cache
+
+
+SYSTEM_INSTRUCTION = """Jesteś wybitnym ekspertem polskiego rynku motocyklowego (Otomoto/OLX) oraz doświadczonym handlarzem (flipperem).
+Twoim zadaniem jest ocena opłacalności zakupu motocykla z ogłoszenia w celu dalszej odsprzedaży z zyskiem.
+
+Instrukcje analizy:
+1. Oceń REALNĄ WARTOŚĆ RYNKOWĄ na podstawie parametrów: rok produkcji, przebieg (km), pojemność silnika (cm³),
+   moc (KM/kW), marka i model, stan (uszkodzony/bezwypadkowy).
+2. Zwróć szczególną uwagę na mankamenty (np. uszkodzony silnik, rysa, brak dokumentów, sprowadzony do opłat).
+3. Kategorie oceny:
+   - BARGAIN: Cena 30%+ poniżej rynku. Potężny potencjał zysku.
+   - GREAT DEAL: Cena 15-20% poniżej rynku.
+   - NORMAL DEAL: Cena rynkowa.
+   - BAD DEAL: Za drogi lub koszty napraw przewyższają sens zakupu.
+
+WAŻNE: Pole "analysis" MUSI mieć MAKSYMALNIE 6 krótkich zdań. Napisz zwięźle:
+model/rocznik/przebieg, wartość rynkowa vs cena, ewentualne ryzyka, werdykt.
+Bez rozpisywania się. Krótko i na temat.
+
+Odpowiedz w formacie JSON z polami "deal_type" oraz "analysis"."""
+
+BATCH_SYSTEM_INSTRUCTION = SYSTEM_INSTRUCTION + """
+
+Otrzymasz kilka ogłoszeń oznaczonych "### OGŁOSZENIE id=...". Oceń każde osobno i odpowiedz tablicą JSON
+z jednym obiektem na ogłoszenie: "id" (dokładnie jak w nagłówku), "deal_type" oraz "analysis"."""
+
+# Schemat jako słownik - SDK Gemini zamienia go sam, a moduł nie musi importować google.genai
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "STRING"},
+            "deal_type": {"type": "STRING", "enum": DEAL_TYPES},
+            "analysis": {"type": "STRING"},
+        },
+        "required": ["id", "deal_type", "analysis"],
+    },
+}
+
+EQUIPMENT_MARKER = "--- SZCZEGÓŁY I WYPOSAŻENIE ---"
+
+
+def estimate_tokens(text):
+    """Przybliżona liczba tokenów (ok. 4 znaki na token)."""
+    return len(text) // 4 + 1
+
+
+def _normalize(line):
+    return " ".join(str(line).split())
+
+
+def _compact_parameters(details):
+    """Scala highlights i parametry w listę "klucz: wartość" bez powtórzeń.
+
+    Zwraca (parametry, wyposażenie). Wartości z highlights, które już są
+    w parametrach (np. "2016" obok "Rok produkcji: 2016"), są pomijane.
+    """
+    params, equipment = [], []
+    seen = set()
+    target = params
+    lines = [*details.parameters.splitlines(), None, *details.highlights.splitlines()]
+    for line in lines:
+        if line is None:
+            target = params
+            continue
+        line = _normalize(line)
+        if line == EQUIPMENT_MARKER:
+            target = equipment
+            continue
+        value = None
+        if ':' in line:
+            label, value = line.split(':', 1)
+            value = value.strip()
+            line = f"{label.strip()}: {value}" if value else ''
+        key = line.casefold()
+        if not key or key in seen:
+            continue
+        # Sama wartość też jest kluczem, żeby pominąć jej powtórzenie w highlights
+        seen.update((key, value.casefold()) if value else (key,))
+        target.append(line)
+    return params, equipment
+
+
+def _compact_description(description):
+    lines = []
+    for line in str(description or '').splitlines():
+        line = _normalize(line)
+        if line and line not in lines:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _fit(lines, budget):
+    """Bierze całe linie, dopóki mieszczą się w budżecie tokenów; ostatnią ewentualnie skraca."""
+    kept = []
+    for line in lines:
+        cost = estimate_tokens(line)
+        if cost <= budget:
+            kept.append(line)
+            budget -= cost
+            continue
+        if budget >= 20:
+            kept.append(line[:budget * 4].rsplit(' ', 1)[0] + " …")
+        break
+    return kept
+
+
+def build_prompt(title, price, year, details, budget=PROMPT_TOKEN_BUDGET):
+    """Buduje zwięzłą część promptu z danymi ogłoszenia (instrukcje są w SYSTEM_INSTRUCTION).
+
+    Sekcje są odduplikowane i mieszczą się w `budget` tokenów: najpierw
+    parametry, potem opis, na końcu wyposażenie.
     """
+    header = f"Tytuł: {title}\nRocznik: {year}\nCena: {price}"
+    params, equipment = _compact_parameters(details)
+    description = _compact_description(details.description)
+
+    remaining = budget - estimate_tokens(header)
+    sections = {}
+    for name, lines in (("PARAMETRY", params), ("OPIS SPRZEDAJĄCEGO", description.splitlines()),
+                        ("WYPOSAŻENIE", equipment)):
+        sections[name] = _fit(lines, max(remaining, 0))
+        remaining -= sum(estimate_tokens(line) for line in sections[name])
+
+    parts = [header]
+    parts.append("PARAMETRY:\n" + ("\n".join(sections["PARAMETRY"]) or "Brak parametrów"))
+    if sections["WYPOSAŻENIE"]:
+        parts.append("WYPOSAŻENIE:\n" + "\n".join(sections["WYPOSAŻENIE"]))
+    parts.append("OPIS SPRZEDAJĄCEGO:\n" + ("\n".join(sections["OPIS SPRZEDAJĄCEGO"]) or "Brak opisu"))
+    return "\n\n".join(parts)
+
+
+def _listing_prompt(listing, details):
+    return build_prompt(listing.title, listing.price_text, listing.year_text, details)
+
+
+def parse_verdict(text):
+    """Zamienia odpowiedź JSON modelu na (deal_type, analysis)."""
+    data = json.loads(text.strip())
+    deal_type = str(data.get("deal_type", "NORMAL DEAL")).upper()
+    if deal_type not in DEAL_TYPES:
+        deal_type = "NORMAL DEAL"
+    return deal_type, data.get("analysis", "Brak dokładnej analizy.")
+
 
-    for attempt in range(3):
+def _is_rate_limited(error):
+    if getattr(error, 'code', None) == 429:
+        return True
+    error_str = str(error)
+    return "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "Resource" in error_str
+
+
+def _retry_hint(error):
+    """Czas oczekiwania (s) podany przez serwer w błędzie 429, jeśli jest."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('retry-after') or headers.get('Retry-After')
+    if retry_after:
         try:
-            response = client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                )
+            return float(retry_after)
+        except ValueError:
+            pass
+    match = RETRY_DELAY_RE.search(str(getattr(error, 'details', '') or error))
+    return float(match.group(1)) if match else None
+
+
+def _log_usage(response):
+    """Loguje zużycie tokenów zwrócone przez API (jeśli jest)."""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    if prompt_tokens is None:
+        return
+    output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+    cached_tokens = getattr(usage, 'cached_content_token_count', None) or 0
+    metrics.inc('gemini_prompt_tokens_total', prompt_tokens)
+    metrics.inc('gemini_output_tokens_total', output_tokens)
+    logging.info(f"Gemini: {prompt_tokens} tokenów promptu ({cached_tokens} z cache), {output_tokens} odpowiedzi")
+
+
+def parse_batch_verdicts(text, ids):
+    """Zamienia odpowiedź wsadową (tablica JSON) na {id: (deal_type, analysis)}.
+
+    Zwraca tylko poprawne pozycje o znanych `ids` - brakujące lub błędne
+    trzeba ocenić osobno. Zniekształcona odpowiedź daje {} zamiast wyjątku:
+    ponowienie całej paczki zwykle kończy się tak samo, więc wszystkie pozycje
+    od razu przechodzą do oceny pojedynczej.
+    """
+    try:
+        data = json.loads((text or '').strip())
+    except json.JSONDecodeError as e:
+        logging.warning(f"Niepoprawny JSON w odpowiedzi wsadowej Gemini: {e}")
+        return {}
+    if not isinstance(data, list):
+        logging.warning("Odpowiedź wsadowa Gemini nie jest tablicą JSON")
+        return {}
+    verdicts = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        item_id = str(item.get("id", ""))
+        deal_type = str(item.get("deal_type", "")).upper()
+        analysis = item.get("analysis")
+        if item_id in ids and deal_type in DEAL_TYPES and isinstance(analysis, str) and analysis.strip():
+            verdicts[item_id] = (deal_type, analysis.strip())
+    return verdicts
+
+
+class GeminiEvaluator:
+    """Asynchroniczna ocena ogłoszeń przez Gemini z limitem RPM/TPM.
+
+    Kilka ocen może trwać równolegle (`concurrency`); nadmiar czeka w kolejce
+    limitera. Na 429 limiter wstrzymuje wszystkie zapytania na czas podany przez
+    serwer (lub wykładniczy backoff z jitterem), a pozostała część bota działa dalej.
+    `evaluate_batch` ocenia kilka ogłoszeń jednym zapytaniem.
+    """
+
+    def __init__(self, client=None, model=GEMINI_MODEL, limiter=None, concurrency=GEMINI_CONCURRENCY,
+                 max_attempts=GEMINI_MAX_ATTEMPTS, cache=None, batch_max_size=GEMINI_BATCH_MAX_SIZE,
+                 batch_token_budget=GEMINI_BATCH_TOKEN_BUDGET):
+        self.client = client or get_client()
+        self.model = model
+        self.limiter = limiter or RateLimiter(GEMINI_RPM, GEMINI_TPM)
+        self.max_attempts = max_attempts
+        self.cache = cache
+        self.rate_limited = 0
+        self.batch_max_size = batch_max_size
+        self.batch_token_budget = batch_token_budget
+        # Aktualny limit wielkości paczki: rośnie po pełnych odpowiedziach, maleje po niepełnych
+        self.batch_size = batch_max_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _generate(self, prompt, parse, system_instruction=SYSTEM_INSTRUCTION, expected_outputs=1,
+                        response_schema=None):
+        from google.genai import types
+
+        estimated_tokens = (estimate_tokens(system_instruction) + estimate_tokens(prompt)
+                            + GEMINI_OUTPUT_TOKENS * expected_outputs)
+        await self.limiter.acquire(estimated_tokens)
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                response_mime_type="application/json",
+                response_schema=response_schema,
+            )
+        )
+        _log_usage(response)
+        return parse(response.text)
+
+    async def _generate_with_retries(self, prompt, parse, **kwargs):
+        """Wywołuje Gemini z ponawianiem po błędach i 429. Zwraca wynik `parse` albo None."""
+        async with self._semaphore:
+            for attempt in range(self.max_attempts):
+                try:
+                    return await self._generate(prompt, parse, **kwargs)
+
+                except (KeyboardInterrupt, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    backoff = min(5 * 2 ** attempt, 120) * random.uniform(0.5, 1.5)
+                    if _is_rate_limited(e):
+                        self.rate_limited += 1
+                        metrics.inc('gemini_rate_limited_total')
+                        hint = _retry_hint(e)
+                        wait = hint * random.uniform(1.0, 1.2) if hint else backoff
+                        self.limiter.pause(wait)
+                        logging.warning(
+                            f"Limit Gemini API! Wstrzymanie zapytań na {wait:.0f}s... "
+                            f"(próba {attempt+1}/{self.max_attempts})"
+                        )
+                    else:
+                        logging.error(f"Błąd Gemini API (próba {attempt+1}/{self.max_attempts}): {e}")
+                        await asyncio.sleep(backoff)
+        return None
+
+    def _precheck(self, listing, details):
+        """Werdykt bez pytania Gemini (brak klucza, brak tytułu, cache) albo (None, klucz cache)."""
+        if not self.client:
+            return ("NORMAL DEAL", "Brak klucza GEMINI_API_KEY."), None
+
+        if not listing.title or listing.title == UNKNOWN_TITLE:
+            return ("NORMAL DEAL", "Nie można przeanalizować - brak tytułu z serwisu."), None
+
+        cache = self.cache or get_verdict_cache()
+        cache_key = verdict_key(listing.title, listing.price_text, listing.year_text, details)
+        cached = cache.get(cache_key)
+        cache.log_stats()
+        metrics.inc('verdict_cache_hits_total' if cached else 'verdict_cache_misses_total')
+        if cached:
+            logging.info(f"Werdykt z cache (repost lub duplikat): {listing.title} [{cached[0]}]")
+        return cached, cache_key
+
+    async def _evaluate_uncached(self, listing, details, cache_key):
+        prompt = _listing_prompt(listing, details)
+        verdict = await self._generate_with_retries(prompt, parse_verdict)
+        if verdict is None:
+            return "NORMAL DEAL", "Nie udało się zweryfikować przez AI."
+        (self.cache or get_verdict_cache()).put(cache_key, *verdict)
+        return verdict
+
+    async def evaluate(self, listing, details):
+        """Ocenia opłacalność ogłoszenia (`Listing`, `ListingDetails`). Zwraca (deal_type, analysis)."""
+        verdict, cache_key = self._precheck(listing, details)
+        if verdict:
+            return verdict
+        return await self._evaluate_uncached(listing, details, cache_key)
+
+    def _split_batches(self, items):
+        """Dzieli ogłoszenia na paczki mieszczące się w budżecie tokenów i aktualnym limicie wielkości."""
+        batches, current, tokens = [], [], 0
+        for item in items:
+            cost = estimate_tokens(item['prompt'])
+            if current and (len(current) >= self.batch_size or tokens + cost > self.batch_token_budget):
+                batches.append(current)
+                current, tokens = [], 0
+            current.append(item)
+            tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _evaluate_chunk(self, chunk):
+        ids = [item['id'] for item in chunk]
+        prompt = "\n\n".join(f"### OGŁOSZENIE id={item['id']}\n{item['prompt']}" for item in chunk)
+        verdicts = await self._generate_with_retries(
+            prompt, lambda text: parse_batch_verdicts(text, set(ids)),
+            system_instruction=BATCH_SYSTEM_INSTRUCTION, expected_outputs=len(chunk),
+            response_schema=BATCH_RESPONSE_SCHEMA,
+        ) or {}
+
+        if len(verdicts) == len(chunk):
+            self.batch_size = min(self.batch_max_size, self.batch_size + 1)
+        else:
+            self.batch_size = max(1, min(self.batch_size, len(chunk) // 2))
+            metrics.inc('gemini_batch_fallbacks_total', len(chunk) - len(verdicts))
+            logging.warning(
+                f"Gemini zwróciło {len(verdicts)}/{len(chunk)} poprawnych ocen - reszta osobno "
+                f"(paczka zmniejszona do {self.batch_size})"
             )
-            text = response.text.strip()
-            data = json.loads(text)
-
-            deal_type = data.get("deal_type", "NORMAL DEAL").upper()
-            if deal_type not in ["BAD DEAL", "NORMAL DEAL", "GREAT DEAL", "BARGAIN"]:
-                deal_type = "NORMAL DEAL"
-
-            return deal_type, data.get("analysis", "Brak dokładnej analizy.")
-
-        except KeyboardInterrupt:
-            raise
-        except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "Resource" in error_str:
-                wait = 30 * (attempt + 1)
-                logging.warning(f"Limit Gemini API! Oczekiwanie {wait}s... (próba {attempt+1}/3)")
-                time.sleep(wait)
+        return verdicts
+
+    async def evaluate_batch(self, listings):
+        """Ocenia wiele ogłoszeń jak najmniejszą liczbą zapytań.
+
+        `listings` to pary (`Listing`, `ListingDetails`).
+        Zwraca {id: (deal_type, analysis)}. Pozycje brakujące lub błędne
+        w odpowiedzi wsadowej są oceniane pojedynczo.
+        """
+        results, pending = {}, []
+        for listing, details in listings:
+            item_id = str(listing.id)
+            verdict, cache_key = self._precheck(listing, details)
+            if verdict:
+                results[item_id] = verdict
+                continue
+            pending.append({'id': item_id, 'listing': listing, 'details': details,
+                            'prompt': _listing_prompt(listing, details), 'cache_key': cache_key})
+
+        # Pojedyncze ogłoszenie nie potrzebuje paczki
+        chunks = []
+        if len(pending) > 1:
+            chunks = await asyncio.gather(*(self._evaluate_chunk(chunk) for chunk in self._split_batches(pending)))
+        cache = self.cache or get_verdict_cache()
+        retry = []
+        for item in pending:
+            verdict = next((c[item['id']] for c in chunks if item['id'] in c), None)
+            if verdict:
+                cache.put(item['cache_key'], *verdict)
+                results[item['id']] = verdict
             else:
-                logging.error(f"Błąd Gemini API (próba {attempt+1}/3): {e}")
-                time.sleep(5)
+                retry.append(item)
+
+        singles = await asyncio.gather(*(
+            self._evaluate_uncached(i['listing'], i['details'], i['cache_key']) for i in retry
+        ))
+        for item, verdict in zip(retry, singles):
+            results[item['id']] = verdict
+        return results
+
+
+def get_evaluator():
+    """Zwraca współdzielony evaluator Gemini."""
+    global _evaluator
+    if _evaluator is None:
+        _evaluator = GeminiEvaluator()
+    return _evaluator
+
+
+@metrics.timed('gemini_seconds')
+async def check_bargain_gemini(listing, details):
+    """Ocenia opłacalność ogłoszenia przy użyciu Gemini API."""
+    return await get_evaluator().evaluate(listing, details)
+
 
-    return "NORMAL DEAL", "Nie udało się zweryfikować przez AI."
+@metrics.timed('gemini_batch_seconds')
+async def check_bargains_gemini(listings):
+    """Ocenia kilka par (listing, details) naraz. Zwraca {id: (deal_type, analysis)}."""
+    return await get_evaluator().evaluate_batch(listings)
@@ -0,0 +1,824 @@
+"""Benchmark offline całej ścieżki bota - bez Otomoto, Gemini i Discorda.
+
+Strony z `benchmark_fixtures/` są serwowane z lokalnego serwera HTTP (adresy
+otomoto.pl są podmieniane na serwer lokalny). Dołączone fixtures są syntetyczne:
+wygenerowane w układzie stron Otomoto (artykuły, etykiety, `__NEXT_DATA__`),
+z losowymi zestawami rocznika, pojemności i mocy oraz wypełniaczami `ooa-filler-N`
+dla realistycznego rozmiaru - `--record URL` zastępuje je prawdziwymi stronami.
+Gemini zastępuje
+deterministyczny fałszywy klient z zadanym opóźnieniem i odsetkiem 429,
+a powiadomienia trafiają do fałszywego webhooka Discorda na tym samym serwerze.
+
+Wynik (percentyle opóźnień etapów, ogłoszenia/s, szczytowe RSS) trafia do pliku
+JSON. Z `--check` benchmark kończy się kodem 1, jeśli któryś etap jest wolniejszy
+od zapisanego baseline'u o więcej niż `--tolerance` albo nie ma go po jednej ze
+stron (np. baseline nagrany bez Chromium). Baseline zależy od maszyny, więc nie
+ma go w repozytorium - zapisz własny przez `--save-baseline` na maszynie, na
+której będziesz porównywać zmiany.
+
+    python benchmark.py                        # raport do benchmark_report.json
+    python benchmark.py --check                # porównanie z baseline'em
+    python benchmark.py --save-baseline        # nowy baseline
+    python benchmark.py --record URL           # nagranie nowych fixtures z Otomoto
+    python benchmark.py --parity               # ekstrakcja w Chromium vs `__NEXT_DATA__`
+    python benchmark.py --workers 3            # 3 procesy `--worker --once`, jeden zabity w trakcie oceny
+"""
+import os
+import re
+import sys
+import json
+import zlib
+import time
+import random
+import asyncio
+import logging
+import sqlite3
+import resource
+import calendar
+import argparse
+import dataclasses
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+import analyzer
+from analyzer import GeminiEvaluator, check_bargain_gemini, check_bargains_gemini
+from browser import BrowserSession
+from config import GEMINI_BATCH_MAX_SIZE
+from database import STAGE_DONE
+from http_fetcher import fetch_html, parse_results_html, parse_details_html
+from models import Listing
+from notifier import DiscordNotifier, build_embed
+from ratelimit import RateLimiter
+from scraper import ARTICLE_SELECTOR, _ARTICLES_JS, extract_from_otomoto, extract_listing_details, parse_raw_article
+from verdict_cache import VerdictCache
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "benchmark_fixtures"
+BASELINE_PATH = FIXTURES_DIR / "baseline.json"
+REPORT_PATH = "benchmark_report.json"
+ORIGIN = "https://www.otomoto.pl"
+BATCH_ID_RE = re.compile(r"### OGŁOSZENIE id=(\S+)")
+CREATED_AT_RE = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ")
+LISTING_ID_RE = re.compile(r"(?<!\d)612000(\d)(\d{3})(?!\d)")   # ID ogłoszeń w dołączonych fixtures
+SHARD_RE = re.compile(r"[?&]shard=(\d)")
+NOISE_MS = 10.0         # różnice p95 mniejsze niż tyle ms nie są regresją
+MIN_WALL_S = 1.0        # przepustowość porównywana tylko dla etapów trwających co najmniej tyle
+STARTUP_RUNS = 5        # ile razy mierzyć import w świeżym interpreterze
+STARTUP_TARGET_MS = 150.0  # cel p50 dla `import cli` - komendy bez sieci mają startować od razu
+# Biblioteki importowane dopiero przez komendy, które ich potrzebują
+LAZY_MODULES = ("playwright", "google.genai", "requests")
+# Pola, które ekstrakcja w przeglądarce musi odczytać tak samo jak `__NEXT_DATA__`
+# (bez `is_today` - fixtures mają stałe daty - i bez pojemności i mocy,
+# których nie ma w etykietach na liście wyników)
+PARITY_FIELDS = ("title", "url", "price", "currency", "year", "mileage")
+LABEL_SELECTORS = ('[data-testid="ad-labels"]', '[data-id="ad-labels"]', '.ad-labels', '[data-testid="listing-ad-labels"]')
+_STARTUP_PROBE = (
+    "import sys, json, time; started = time.perf_counter(); import {module}; "
+    "print(json.dumps([time.perf_counter() - started, [m for m in {lazy!r} if m in sys.modules]]))"
+)
+
+
+# --- Lokalny serwer: strony Otomoto i webhook Discorda ---
+
+def _refresh_dates(page):
+    """Przesuwa daty dodania tak, by najnowsze ogłoszenie było sprzed chwili (jak świeżo nagrana strona)."""
+    stamps = CREATED_AT_RE.findall(page)
+    if not stamps:
+        return page
+    shift = time.time() - calendar.timegm(time.strptime(max(stamps), "%Y-%m-%dT%H:%M:%SZ")) - 60
+    return CREATED_AT_RE.sub(
+        lambda m: time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(
+            calendar.timegm(time.strptime(m.group(0), "%Y-%m-%dT%H:%M:%SZ")) + shift
+        )),
+        page
+    )
+
+
+def _shard_ids(page, shard):
+    return LISTING_ID_RE.sub(lambda m: f"612000{int(m.group(1)) + shard}{m.group(2)}", page)
+
+
+class FixtureServer:
+    """Serwer HTTP w osobnym wątku, serwujący nagrane strony i udający webhook Discorda."""
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, webhook_429_rate=0.0, seed=0):
+        self.results = _refresh_dates((fixtures_dir / "results.html").read_text(encoding="utf-8"))
+        self.details = [p.read_text(encoding="utf-8") for p in sorted(fixtures_dir.glob("detail*.html"))]
+        self.webhook_429_rate = webhook_429_rate
+        self.webhook_posts = 0
+        self.webhook_embeds = 0
+        self.webhook_urls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if "/oferta/" in self.path:
+                    page = server.details[zlib.crc32(self.path.encode()) % len(server.details)]
+                else:
+                    shard = SHARD_RE.search(self.path)
+                    page = _shard_ids(server.results, int(shard.group(1))) if shard else server.results
+                self._reply(200, page.replace(ORIGIN, server.base_url).encode("utf-8"))
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    limited = server._random.random() < server.webhook_429_rate
+                    if not limited:
+                        server.webhook_posts += 1
+                        server.webhook_embeds += len(payload.get("embeds", []))
+                        server.webhook_urls.update(embed.get("url") for embed in payload.get("embeds", []))
+                if limited:
+                    body = json.dumps({"message": "You are being rate limited.", "retry_after": 0.05}).encode()
+                    self._reply(429, body, "application/json", {"Retry-After": "1"})
+                else:
+                    self._reply(204)
+
+        return Handler
+
+    @property
+    def results_url(self):
+        return f"{self.base_url}/motocykle-i-quady/motocykle?search%5Border%5D=created_at_first%3Adesc"
+
+    def search_url(self, shard):
+        """Osobne wyszukiwanie: ta sama strona wyników z innymi ID ogłoszeń (shard 0-9)."""
+        return f"{self.results_url}&shard={shard}"
+
+    @property
+    def webhook_url(self):
+        return f"{self.base_url}/api/webhooks/1/benchmark"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# --- Fałszywy klient Gemini ---
+
+class FakeRateLimitError(Exception):
+    code = 429
+
+
+class FakeGeminiClient:
+    """Udaje `genai.Client`: stałe opóźnienie, deterministyczne werdykty i losowe (z ziarnem) 429."""
+
+    def __init__(self, latency=0.2, rate_429=0.0, retry_delay=0.1, seed=0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_delay = retry_delay
+        self.calls = 0
+        self._random = random.Random(seed)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self.generate_content))
+
+    @staticmethod
+    def _verdict(text):
+        return analyzer.DEAL_TYPES[sum(map(ord, str(text))) % len(analyzer.DEAL_TYPES)]
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.rate_429:
+            raise FakeRateLimitError(
+                f"429 RESOURCE_EXHAUSTED {{'retryDelay': '{self.retry_delay}s'}}"
+            )
+        if getattr(config, "response_schema", None) is not None:
+            # Zapytanie wsadowe - jedna ocena na każdy nagłówek ogłoszenia
+            text = json.dumps([
+                {"id": item_id, "deal_type": self._verdict(item_id), "analysis": "Ocena testowa benchmarku."}
+                for item_id in BATCH_ID_RE.findall(str(contents))
+            ])
+        else:
+            text = json.dumps({"deal_type": self._verdict(contents), "analysis": "Ocena testowa benchmarku."})
+        usage = SimpleNamespace(prompt_token_count=len(str(contents)) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+# --- Pomiary ---
+
+class Stage:
+    """Zbiera czasy pojedynczych operacji i liczbę przetworzonych ogłoszeń etapu."""
+
+    def __init__(self):
+        self.latencies = []
+        self.items = 0
+        self.wall = 0.0
+
+    def summary(self):
+        ms = np.asarray(self.latencies) * 1000
+        return {
+            "count": len(ms),
+            "items": self.items,
+            "wall_s": round(self.wall, 4),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "items_per_s": round(self.items / self.wall, 2) if self.wall else None,
+        }
+
+
+def bench_http(server, iterations):
+    """Pobranie i sparsowanie stron wyników oraz szczegółów ścieżką HTTP."""
+    results, details = Stage(), Stage()
+    urls = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        listings = parse_results_html(fetch_html(server.results_url)) or []
+        results.latencies.append(time.perf_counter() - t)
+        results.items += len(listings)
+        urls = [l.url for l in listings]
+    results.wall = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for url in (urls * iterations)[:iterations * 4]:
+        t = time.perf_counter()
+        if parse_details_html(fetch_html(url)):
+            details.items += 1
+        details.latencies.append(time.perf_counter() - t)
+    details.wall = time.perf_counter() - started
+    return {"results_http": results, "details_http": details}
+
+
+async def bench_browser(server, iterations):
+    """`extract_from_otomoto` i `extract_listing_details` w prawdziwym Chromium."""
+    results, details = Stage(), Stage()
+    browser = BrowserSession()
+    try:
+        urls = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t = time.perf_counter()
+            async with browser.page() as page:
+                await page.goto(server.results_url, wait_until="domcontentloaded")
+                listings = await extract_from_otomoto(page)
+            results.latencies.append(time.perf_counter() - t)
+            results.items += len(listings)
+            urls = [l.url for l in listings]
+        results.wall = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for url in (urls * iterations)[:iterations]:
+            t = time.perf_counter()
+            async with browser.page() as page:
+                found = await extract_listing_details(None, url, page=page)
+            details.latencies.append(time.perf_counter() - t)
+            details.items += bool(found.parameters)
+        details.wall = time.perf_counter() - started
+    finally:
+        await browser.close()
+    return {"results_browser": results, "details_browser": details}
+
+
+def parity_mismatches(listings, reference, fields, source):
+    """Rozbieżności pól między ogłoszeniami z `_ARTICLES_JS` a tymi samymi ogłoszeniami z innej ścieżki."""
+    mismatches = []
+    by_id = {l.id: l for l in reference}
+    for listing in listings:
+        expected = by_id.get(listing.id)
+        if expected is None:
+            mismatches.append(f"{listing.id}: brak w ścieżce {source}")
+            continue
+        for field in fields:
+            if getattr(listing, field) != getattr(expected, field):
+                mismatches.append(
+                    f"{listing.id}.{field}: _ARTICLES_JS {getattr(listing, field)!r} != {source} {getattr(expected, field)!r}"
+                )
+    found = {l.id for l in listings}
+    mismatches += [f"{listing_id}: brak w _ARTICLES_JS" for listing_id in by_id.keys() - found]
+    return mismatches
+
+
+async def locator_articles(page):
+    """Surowe dane artykułów zebrane osobnymi wywołaniami locatorów, jak przed `_ARTICLES_JS`."""
+    async def first_text(scope, selector):
+        elem = scope.locator(selector).first
+        return (await elem.inner_text()).strip() if await elem.count() > 0 else None
+
+    async def first_attribute(scope, selector, *names):
+        elem = scope.locator(selector).first
+        if await elem.count() == 0:
+            return ""
+        for name in names:
+            value = await elem.get_attribute(name)
+            if value:
+                return value
+        return ""
+
+    raw_articles = []
+    for article in await page.locator(ARTICLE_SELECTOR).all():
+        title = await first_text(article, 'h1 a, h2 a, h6 a, h2')
+        price = ""
+        for selector in ("h3:has-text('PLN')", "h3:has-text('EUR')", "span:has-text('PLN')", "h3"):
+            price = await first_text(article, selector)
+            if price is not None:
+                break
+        raw_articles.append({
+            "id": await article.get_attribute("data-id") or await article.get_attribute("id") or "",
+            "text": await article.inner_text(),
+            "title": title or "",
+            "has_title": title is not None,
+            "url": await first_attribute(article, "a", "href"),
+            "price": price or "",
+            "labels": [(await label.inner_text()).strip()
+                       for label in await article.locator('[data-testid="ad-labels"]').all()],
+            "label_containers": [await first_text(article, selector) or "" for selector in LABEL_SELECTORS],
+            "image_url": await first_attribute(article, "img", "src", "data-src"),
+        })
+    return raw_articles
+
+
+async def check_parity(server):
+    """Test zgodności ekstrakcji wyników w Chromium na fixtures.
+
+    `_ARTICLES_JS` + `parse_raw_article` musi dać to samo co ekstrakcja
+    locatorami (wszystkie pola) i co `__NEXT_DATA__` ze ścieżki HTTP (pola
+    z PARITY_FIELDS - ustrukturyzowane liczby łapią błędy parsowania etykiet).
+    """
+    browser = BrowserSession()
+    try:
+        async with browser.page() as page:
+            await page.goto(server.results_url, wait_until="domcontentloaded")
+            evaluated = await page.evaluate(_ARTICLES_JS, ARTICLE_SELECTOR)
+            located = await locator_articles(page)
+    finally:
+        await browser.close()
+
+    listings = [listing for listing in map(parse_raw_article, evaluated) if listing]
+    http_listings = parse_results_html(fetch_html(server.results_url)) or []
+    if not listings or not http_listings:
+        return [f"brak ogłoszeń: _ARTICLES_JS {len(listings)}, HTTP {len(http_listings)}"]
+    return (
+        parity_mismatches(listings, [l for l in map(parse_raw_article, located) if l],
+                          [f.name for f in dataclasses.fields(Listing)], "locatory")
+        + parity_mismatches(listings, http_listings, PARITY_FIELDS, "HTTP")
+    )
+
+
+async def bench_gemini(server, db_path, count, latency, rate_429, seed):
+    """`check_bargain_gemini` z fałszywym klientem (każde ogłoszenie inne - bez trafień w cache)."""
+    stage = Stage()
+    fake = FakeGeminiClient(latency=latency, rate_429=rate_429, seed=seed)
+    analyzer._evaluator = GeminiEvaluator(
+        client=fake, limiter=RateLimiter(rpm=100000, tpm=10 ** 9), cache=VerdictCache(path=db_path)
+    )
+    detail = parse_details_html(server.details[0].replace(ORIGIN, server.base_url))
+
+    async def one(i):
+        t = time.perf_counter()
+        listing = Listing(id=str(i), title=f"Honda CBR 600RR #{i}", url=f"{ORIGIN}/{i}",
+                          price=(30000 + i) * 100, currency='PLN', year=2016)
+        await check_bargain_gemini(listing, detail)
+        stage.latencies.append(time.perf_counter() - t)
+        stage.items += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    stage.wall = time.perf_counter() - started
+    single_calls = fake.calls
+
+    # To samo wsadowo: paczki jak w etapie analizy potoku
+    batch = Stage()
+
+    async def many(start):
+        t = time.perf_counter()
+        listings = [(Listing(id=str(i), title=f"Yamaha MT-07 #{i}", url=f"{ORIGIN}/{i}",
+                             price=(30000 + i) * 100, currency='PLN', year=2016), detail)
+                    for i in range(start, min(start + GEMINI_BATCH_MAX_SIZE, count))]
+        await check_bargains_gemini(listings)
+        batch.latencies.extend([time.perf_counter() - t] * len(listings))
+        batch.items += len(listings)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(many(start) for start in range(0, count, GEMINI_BATCH_MAX_SIZE)))
+    batch.wall = time.perf_counter() - started
+
+    rate_limited = analyzer._evaluator.rate_limited
+    analyzer._evaluator = None
+    return {"gemini": stage, "gemini_batch": batch}, {
+        "gemini_calls": single_calls, "gemini_batch_calls": fake.calls - single_calls,
+        "gemini_rate_limited": rate_limited,
+    }
+
+
+async def bench_discord(server, db_path, count):
+    """Dostarczenie powiadomień przez kolejkę `DiscordNotifier` do fałszywego webhooka."""
+    stage = Stage()
+    notifier = DiscordNotifier(webhook_url=server.webhook_url, path=db_path, batch_window=0)
+    for i in range(count):
+        embed = build_embed(f"Honda CBR 600RR #{i}", "30 000 PLN", "2016", f"{ORIGIN}/{i}", "", "GREAT DEAL",
+                            "Ocena testowa benchmarku.")
+        notifier.enqueue(embed, key=f"benchmark:{i}")
+    flush_started = time.time()
+    started = time.perf_counter()
+    await notifier.flush()
+    stage.wall = time.perf_counter() - started
+    # Czas od rozpoczęcia wysyłki do dostarczenia (bez czasu samego kolejkowania)
+    rows = notifier.conn.execute(
+        'SELECT delivered_at - ? FROM discord_outbox WHERE delivered_at IS NOT NULL AND error IS NULL',
+        (flush_started,)
+    ).fetchall()
+    stage.latencies = [row[0] for row in rows]
+    stage.items = len(rows)
+    notifier.conn.close()
+    return {"discord": stage}, {"discord_messages": notifier.sent_messages,
+                                "discord_rate_limited": notifier.rate_limited}
+
+
+def bench_startup(runs=STARTUP_RUNS):
+    """Czas importu `cli` (start komend) i `pipeline` (start skanu) w świeżym interpreterze."""
+    stages, eager = {}, {}
+    for module in ("cli", "pipeline"):
+        stage = Stage()
+        started = time.perf_counter()
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE.format(module=module, lazy=LAZY_MODULES)],
+                cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True
+            ).stdout
+            seconds, loaded = json.loads(output.splitlines()[-1])
+            stage.latencies.append(seconds)
+            stage.items += 1
+        stage.wall = time.perf_counter() - started
+        stages[f"startup_{module}"] = stage
+        eager[module] = loaded
+    return stages, eager
+
+
+def peak_rss_mb():
+    """Szczytowe RSS procesu i procesów potomnych (Chromium) w MB."""
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+async def run_benchmark(args):
+    stages, counters, skipped, parity = {}, {}, {}, []
+    with FixtureServer(webhook_429_rate=args.webhook_429_rate, seed=args.seed) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "benchmark.db")
+
+        startup, eager_imports = await asyncio.to_thread(bench_startup)
+        stages.update(startup)
+        stages.update(await asyncio.to_thread(bench_http, server, args.iterations))
+
+        if args.no_browser:
+            skipped["browser"] = "wyłączone (--no-browser)"
+        else:
+            try:
+                stages.update(await bench_browser(server, args.iterations))
+                parity = await check_parity(server)
+            except Exception as e:
+                logging.warning(f"Pominięto etapy przeglądarki: {e}")
+                skipped["browser"] = str(e).splitlines()[0]
+
+        gemini, extra = await bench_gemini(server, db_path, args.gemini_count, args.gemini_latency,
+                                           args.gemini_429_rate, args.seed)
+        stages.update(gemini)
+        counters.update(extra)
+
+        discord, extra = await bench_discord(server, db_path, args.discord_count)
+        stages.update(discord)
+        counters.update(extra, webhook_posts=server.webhook_posts, webhook_embeds=server.webhook_embeds)
+
+    rss, children_rss = peak_rss_mb()
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("check", "save_baseline", "record", "output", "baseline")},
+        "stages": {name: stage.summary() for name, stage in stages.items() if stage.latencies},
+        "counters": counters,
+        "eager_imports": eager_imports,
+        "skipped": skipped,
+        "parity": parity,
+        "peak_rss_mb": rss,
+        "peak_children_rss_mb": children_rss,
+    }
+
+
+def compare(report, baseline, tolerance, noise_ms=NOISE_MS):
+    """Zwraca listę regresji względem baseline'u (wolniejsze p95, mniejsza przepustowość, większe RSS).
+
+    Różnice poniżej `noise_ms` i przepustowość etapów trwających krócej niż
+    MIN_WALL_S sekund są pomijane - przy pomiarach rzędu milisekund to szum.
+    Etap obecny tylko w raporcie albo tylko w baseline'ie też jest błędem -
+    inaczej nienagrany (np. pominięty bez Chromium) etap nigdy nie byłby sprawdzany.
+    """
+    regressions = []
+    for name in sorted(report["stages"].keys() - baseline.get("stages", {}).keys()):
+        regressions.append(f"{name}: brak w baseline'ie - nagraj go ponownie przez --save-baseline")
+    for name, base in baseline.get("stages", {}).items():
+        current = report["stages"].get(name)
+        if not current:
+            regressions.append(f"{name}: brak w raporcie (pominięty: {', '.join(report['skipped']) or 'brak pomiarów'})")
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance) + noise_ms:
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f} ms > {base['p95_ms']:.1f} ms")
+        if (base.get("items_per_s") and min(base["wall_s"], current["wall_s"]) >= MIN_WALL_S
+                and (current["items_per_s"] or 0) < base["items_per_s"] * (1 - tolerance)):
+            regressions.append(f"{name}: {current['items_per_s']}/s < {base['items_per_s']}/s")
+    if report["peak_rss_mb"] > baseline.get("peak_rss_mb", float("inf")) * (1 + tolerance):
+        regressions.append(f"RSS {report['peak_rss_mb']} MB > {baseline['peak_rss_mb']} MB")
+    return regressions
+
+
+def startup_problems(report, target_ms=STARTUP_TARGET_MS):
+    """Przekroczony cel startu i ciężkie biblioteki importowane bez potrzeby (niezależnie od baseline'u)."""
+    problems = []
+    startup = report["stages"].get("startup_cli")
+    if startup and startup["p50_ms"] > target_ms:
+        problems.append(f"startup_cli: p50 {startup['p50_ms']:.1f} ms > cel {target_ms:.0f} ms")
+    for module, loaded in report.get("eager_imports", {}).items():
+        if loaded:
+            problems.append(f"import {module} ładuje od razu: {', '.join(loaded)}")
+    return problems
+
+
+# --- Kilka workerów na wspólnej bazie ---
+
+class RecordingEvaluator(GeminiEvaluator):
+    """Dopisuje do wspólnego pliku, które ogłoszenia worker zaczął i skończył oceniać."""
+
+    def __init__(self, log_path, worker_id, **kwargs):
+        super().__init__(**kwargs)
+        self.log_path = log_path
+        self.worker_id = worker_id
+
+    def _record(self, event, ids):
+        with open(self.log_path, "a", encoding="utf-8") as log:
+            log.write("".join(f"{event} {self.worker_id} {listing_id}\n" for listing_id in ids))
+
+    async def evaluate_batch(self, listings):
+        self._record("start", [str(listing.id) for listing, _ in listings])
+        verdicts = await super().evaluate_batch(listings)
+        self._record("done", verdicts)
+        return verdicts
+
+
+def run_worker_child(spec):
+    """Proces workera dla `check_workers`: jeden cykl `--worker --once` z fałszywym Gemini i webhookiem."""
+    import pipeline
+    import scraper
+    from database import init_db
+    from workers import Worker
+
+    logging.getLogger().setLevel(logging.INFO)
+    # Wszystkie shardy mają te same teksty - bez wyceny i wykrywania repostów każde ogłoszenie idzie do oceny
+    pipeline.VALUATION_ENABLED = False
+    pipeline.DEDUP_ENABLED = False
+    pipeline.PAGINATION_MAX_PAGES = 1
+    pipeline.MONITORED_URLS = spec["urls"]
+    scraper.DETAIL_DELAY_RANGE = (0, 0)
+    analyzer._evaluator = RecordingEvaluator(
+        spec["log"], spec["id"], client=FakeGeminiClient(latency=spec["gemini_latency"]),
+        limiter=RateLimiter(rpm=100000, tpm=10 ** 9), cache=VerdictCache(path=spec["db"])
+    )
+
+    async def run():
+        store = init_db(path=spec["db"])
+        browser = BrowserSession()
+        worker = Worker(store, spec["id"], urls=spec["urls"])
+        worker.register()
+        try:
+            bot = pipeline.Pipeline(store, browser, worker=worker)
+            bot.notifier.webhook_url = spec["webhook"]
+            await bot.run(once=True)
+        finally:
+            worker.unregister()
+            await browser.close()
+            store.close()
+
+    asyncio.run(run())
+
+
+def _read_events(log_path):
+    events = Counter()
+    if os.path.exists(log_path):
+        with open(log_path, encoding="utf-8") as log:
+            events.update(tuple(line.split()) for line in log if line.strip())
+    return events
+
+
+def check_workers(count=3, shards=4, timeout=120):
+    """Kilka procesów `--worker --once` na jednej bazie; jeden zostaje zabity w trakcie oceny paczki.
+
+    1. Wolny worker skanuje połowę wyszukiwań i ginie (SIGKILL) w trakcie
+       zapytania do Gemini, trzymając dzierżawy swoich ogłoszeń.
+    2. Jego heartbeat i dzierżawy są postarzane (jak po WORKER_TTL i LEASE_TTL),
+       po czym `count` workerów naraz przejmuje porzucone ogłoszenia i skanuje
+       wszystkie wyszukiwania (jedno z nich pokrywa się z innym).
+    3. Jeszcze jeden worker domyka to, czego nikt nie objął w wyścigu rejestracji.
+
+    Zwraca listę problemów: ocena albo powiadomienie więcej niż raz, ogłoszenie
+    nieprzetworzone albo ocenione bez powiadomienia o okazji.
+    """
+    from database import init_db
+
+    problems = []
+    with FixtureServer() as server, tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "workers.db")
+        log_path = os.path.join(tmp, "analyzed.log")
+        urls = [server.search_url(shard) for shard in range(shards)]
+        urls.append(server.search_url(1) + "&overlap=1")
+        first_urls = urls[:shards // 2]
+
+        store = init_db(path=db_path)
+        for url in urls:
+            # Wyszukiwania już obserwowane - bez rozgrzewki wszystkie ogłoszenia idą do oceny
+            store.update_watermark(url, [])
+        store.close()
+
+        def spawn(worker_id, worker_urls, latency):
+            spec = {"id": worker_id, "urls": worker_urls, "db": db_path, "log": log_path,
+                    "webhook": server.webhook_url, "gemini_latency": latency}
+            output = open(os.path.join(tmp, f"{worker_id}.log"), "w", encoding="utf-8")
+            return subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), "--worker-child", json.dumps(spec)],
+                cwd=Path(__file__).resolve().parent, stdout=output, stderr=subprocess.STDOUT
+            )
+
+        def wait_all(processes):
+            for worker_id, process in processes.items():
+                try:
+                    if process.wait(timeout) != 0:
+                        problems.append(f"{worker_id}: kod wyjścia {process.returncode}")
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    problems.append(f"{worker_id}: nie skończył w {timeout} s")
+
+        victim = spawn("worker-killed", first_urls, latency=timeout)
+        deadline = time.time() + timeout
+        while not any(key[:2] == ("start", "worker-killed") for key in _read_events(log_path)):
+            if victim.poll() is not None or time.time() > deadline:
+                break
+            time.sleep(0.1)
+        victim.kill()
+        victim.wait()
+        if not any(key[:2] == ("start", "worker-killed") for key in _read_events(log_path)):
+            problems.append("worker-killed nie doszedł do oceny - test przerwania nic nie sprawdził")
+
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute('UPDATE workers SET heartbeat_at = 0 WHERE worker_id = ?', ("worker-killed",))
+            orphans = conn.execute(
+                'UPDATE listings SET lease_expires = 0 WHERE lease_owner = ? RETURNING id', ("worker-killed",)
+            ).fetchall()
+        conn.close()
+
+        wait_all({f"worker-{i}": spawn(f"worker-{i}", urls, latency=0.05) for i in range(1, count + 1)})
+        wait_all({"worker-sweep": spawn("worker-sweep", urls, latency=0.05)})
+
+        events = _read_events(log_path)
+        done = Counter()
+        for (event, _, listing_id), times in events.items():
+            if event == "done":
+                done[listing_id] += times
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute('SELECT id, url, stage, deal_type FROM listings').fetchall()
+        conn.close()
+
+    expected_listings = shards * len(parse_results_html(server.results) or [])
+    if len(rows) != expected_listings:
+        problems.append(f"w bazie {len(rows)} ogłoszeń, oczekiwano {expected_listings}")
+    problems += [f"{listing_id}: ocenione {times} razy" for listing_id, times in done.items() if times > 1]
+    for listing_id, url, stage, deal_type in rows:
+        if stage not in (None, STAGE_DONE):
+            problems.append(f"{listing_id}: utknęło na etapie {stage}")
+        if (deal_type is not None) != (listing_id in done):
+            problems.append(f"{listing_id}: werdykt {deal_type!r}, ocen {done[listing_id]}")
+    bargains = {url for _, url, _, deal_type in rows if deal_type in ("GREAT DEAL", "BARGAIN")}
+    problems += [f"{url}: {server.webhook_urls[url]} powiadomień" for url in bargains if server.webhook_urls[url] != 1]
+    problems += [f"{url}: powiadomienie bez okazji" for url in server.webhook_urls.keys() - bargains]
+    print(f"Workery: {len(rows)} ogłoszeń, {len(done)} ocen, {len(orphans)} przejętych po zabitym workerze, "
+          f"{sum(server.webhook_urls.values())} powiadomień")
+    return problems
+
+
+def record(url, fixtures_dir=FIXTURES_DIR, detail_count=3):
+    """Nagrywa stronę wyników i kilka stron ogłoszeń jako nowe fixtures."""
+    page_html = fetch_html(url)
+    listings = parse_results_html(page_html) if page_html else None
+    if not listings:
+        logging.error(f"Nie udało się pobrać strony wyników do nagrania: {url}")
+        return False
+    (fixtures_dir / "results.html").write_text(page_html, encoding="utf-8")
+    saved = 0
+    for listing in listings:
+        detail_html = fetch_html(listing.url)
+        if detail_html and parse_details_html(detail_html):
+            saved += 1
+            (fixtures_dir / f"detail_{saved}.html").write_text(detail_html, encoding="utf-8")
+            if saved >= detail_count:
+                break
+    logging.info(f"Nagrano stronę wyników ({len(listings)} ogłoszeń) i {saved} stron szczegółów")
+    return saved > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline: fixtures, fałszywe Gemini i Discord.")
+    parser.add_argument('--iterations', type=int, default=20, help="powtórzenia etapów stron (domyślnie %(default)s)")
+    parser.add_argument('--no-browser', action='store_true', help="pomiń etapy w Chromium")
+    parser.add_argument('--gemini-count', type=int, default=50, help="liczba ocen Gemini")
+    parser.add_argument('--gemini-latency', type=float, default=0.2, help="opóźnienie fałszywego Gemini (s)")
+    parser.add_argument('--gemini-429-rate', type=float, default=0.1, help="odsetek odpowiedzi 429 z Gemini")
+    parser.add_argument('--discord-count', type=int, default=40, help="liczba powiadomień Discord")
+    parser.add_argument('--webhook-429-rate', type=float, default=0.1, help="odsetek odpowiedzi 429 z webhooka")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=REPORT_PATH, help="plik z raportem JSON (domyślnie %(default)s)")
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--tolerance', type=float, default=0.25, help="dopuszczalne pogorszenie (domyślnie 25%%)")
+    parser.add_argument('--check', action='store_true', help="zakończ kodem 1 przy regresji względem baseline'u")
+    parser.add_argument('--save-baseline', action='store_true', help="zapisz wynik jako nowy baseline")
+    parser.add_argument('--record', metavar='URL', help="nagraj nowe fixtures z podanego wyszukiwania")
+    parser.add_argument('--parity', action='store_true',
+                        help="tylko porównaj ekstrakcję w Chromium ze ścieżką HTTP na fixtures")
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help="tylko test N workerów na wspólnej bazie (każde ogłoszenie ocenione i wysłane raz)")
+    parser.add_argument('--worker-child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.worker_child:
+        run_worker_child(json.loads(args.worker_child))
+        return
+    if args.record:
+        sys.exit(0 if record(args.record) else 1)
+    if args.workers:
+        problems = check_workers(args.workers)
+        for problem in problems:
+            print(f"BŁĄD: {problem}")
+        sys.exit(1 if problems else 0)
+    if args.parity:
+        with FixtureServer() as server:
+            try:
+                mismatches = asyncio.run(check_parity(server))
+            except Exception as e:
+                sys.exit(f"Nie można uruchomić Chromium: {str(e).splitlines()[0]}")
+        for mismatch in mismatches:
+            print(f"ROZBIEŻNOŚĆ: {mismatch}")
+        print("Ekstrakcja w przeglądarce zgodna ze ścieżką HTTP" if not mismatches else
+              f"{len(mismatches)} rozbieżności")
+        sys.exit(1 if mismatches else 0)
+
+    random.seed(args.seed)
+    report = asyncio.run(run_benchmark(args))
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    for name, stage in report["stages"].items():
+        print(f"{name:<16} p50 {stage['p50_ms']:8.1f} ms | p95 {stage['p95_ms']:8.1f} ms | "
+              f"{stage['items_per_s'] or 0:8.1f} ogł./s")
+    for name, reason in report["skipped"].items():
+        print(f"{name:<16} pominięto: {reason}")
+    for mismatch in report["parity"]:
+        print(f"ROZBIEŻNOŚĆ: {mismatch}")
+    print(f"Szczytowe RSS: {report['peak_rss_mb']} MB (Chromium: {report['peak_children_rss_mb']} MB)")
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Zapisano baseline: {args.baseline}")
+    elif args.check:
+        if not Path(args.baseline).exists():
+            print(f"Brak baseline'u: {args.baseline} (uruchom z --save-baseline)")
+            sys.exit(1)
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("settings") != report["settings"]:
+            print("Uwaga: baseline powstał z innymi ustawieniami benchmarku - wyniki mogą być nieporównywalne")
+        regressions = compare(report, baseline, args.tolerance) + startup_problems(report) + report["parity"]
+        for regression in regressions:
+            print(f"REGRESJA: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import metrics
+from config import (
+    USER_AGENT, DETAIL_POOL_SIZE, BROWSER_BLOCK_RESOURCES, BROWSER_CONTEXT_MAX_PAGES, BROWSER_MAX_RSS_MB,
+    BROWSER_MEMORY_CHECK_INTERVAL
+)
+
+# Potrzebujemy tylko HTML-a i adresu miniatury - reszty nie warto pobierać
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com", "doubleclick.net",
+    "facebook.net", "facebook.com", "hotjar.com", "criteo.com", "criteo.net", "adform.net",
+    "gemius.pl", "cookielaw.org", "onetrust.com", "nr-data.net", "newrelic.com", "tiktok.com",
+)
+
+
+def _is_blocked(resource_type, url):
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).hostname or ""
+    return any(host == domain or host.endswith("." + domain) for domain in BLOCKED_DOMAINS)
+
+
+async def _block_heavy_resources(route):
+    request = route.request
+    if _is_blocked(request.resource_type, request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def child_processes_rss_mb(root_pid=None):
+    """Łączne RSS (MB) procesów potomnych, czyli sterownika Playwright i Chromium.
+
+    Czyta /proc, więc działa tylko na Linuksie - gdzie indziej zwraca None.
+    """
+    root_pid = root_pid or os.getpid()
+    try:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # Nazwa procesu może zawierać spacje i nawiasy - pola liczymy od ostatniego ')'
+                    fields = f.read().rsplit(")", 1)[1].split()
+                parents[int(entry)] = int(fields[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return None
+
+    children = {}
+    for pid, ppid in parents.items():
+        children.setdefault(ppid, []).append(pid)
+    stack, total_pages = list(children.get(root_pid, [])), 0
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total_pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class _PooledContext:
+    """Kontekst przeglądarki z pulą ciepłych stron do ponownego użycia."""
+
+    def __init__(self, context, browser, size):
+        self.context = context
+        self.browser = browser
+        self.idle = []
+        self.users = 0
+        self.pages_served = 0
+        self.retiring = False
+        self.available = asyncio.Semaphore(size)
+
+
+class BrowserSession:
+    """Leniwie uruchamiana przeglądarka Playwright z pulą stron i recyklingiem.
+
+    Chromium startuje dopiero przy pierwszym wywołaniu `page()`, więc w trybie
+    HTTP przeglądarka nie zajmuje pamięci, dopóki nie jest potrzebny fallback.
+    Każdy `slot` dostaje własny kontekst (osobne ciasteczka i sesja), a w nim
+    do `pages_per_context` stron używanych ponownie zamiast otwierania nowych.
+    Obrazy, fonty, media i trackery są blokowane.
+
+    Kontekst po `max_pages` obsłużonych stronach, a cała przeglądarka po
+    przekroczeniu `max_rss_mb`, są wymieniane na nowe. Stary kontekst zamyka się
+    dopiero po zwolnieniu ostatniej wypożyczonej strony, więc trwające pobrania
+    kończą się normalnie.
+    """
+
+    def __init__(self, pages_per_context=DETAIL_POOL_SIZE, max_pages=BROWSER_CONTEXT_MAX_PAGES,
+                 max_rss_mb=BROWSER_MAX_RSS_MB, block_resources=BROWSER_BLOCK_RESOURCES):
+        self.pages_per_context = pages_per_context
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.block_resources = block_resources
+        self.recycled_contexts = 0
+        self.recycled_browsers = 0
+        self._playwright = None
+        self._browser = None
+        self._contexts = {}
+        self._retiring = []
+        self._last_memory_check = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def _launch(self):
+        logging.info("Uruchamianie przeglądarki Chromium...")
+        if self._playwright is None:
+            # Playwright jest importowany dopiero, gdy przeglądarka jest naprawdę potrzebna
+            from playwright.async_api import async_playwright
+
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=True, args=["--disable-blink-features=AutomationControlled"]
+        )
+
+    async def _new_context(self):
+        context = await self._browser.new_context(
+            user_agent=USER_AGENT,
+            viewport={"width": 1920, "height": 1080},
+            locale="pl-PL"
+        )
+        await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        if self.block_resources:
+            await context.route("**/*", _block_heavy_resources)
+        return _PooledContext(context, self._browser, self.pages_per_context)
+
+    async def _pooled(self, slot):
+        async with self._lock:
+            if self._browser is None:
+                await self._launch()
+            if slot not in self._contexts:
+                self._contexts[slot] = await self._new_context()
+            pooled = self._contexts[slot]
+            pooled.users += 1
+            return pooled
+
+    @asynccontextmanager
+    async def page(self, slot=0):
+        """Wypożycza ciepłą stronę z puli kontekstu `slot` i oddaje ją po użyciu."""
+        pooled = await self._pooled(slot)
+        try:
+            async with pooled.available:
+                page = pooled.idle.pop() if pooled.idle else await pooled.context.new_page()
+                try:
+                    yield page
+                finally:
+                    pooled.pages_served += 1
+                    if pooled.retiring or page.is_closed():
+                        await self._close_quietly(page)
+                    else:
+                        pooled.idle.append(page)
+        finally:
+            pooled.users -= 1
+            await self._maybe_recycle(slot, pooled)
+
+    def _retire(self, slot, pooled):
+        if pooled.retiring:
+            return
+        pooled.retiring = True
+        if self._contexts.get(slot) is pooled:
+            del self._contexts[slot]
+        self._retiring.append(pooled)
+
+    async def _maybe_recycle(self, slot, pooled):
+        async with self._lock:
+            if pooled.pages_served >= self.max_pages and not pooled.retiring:
+                logging.info(f"Wymiana kontekstu przeglądarki po {pooled.pages_served} stronach (slot {slot})")
+                self._retire(slot, pooled)
+                self.recycled_contexts += 1
+                metrics.inc('browser_recycled_total', kind='context')
+
+            now = time.monotonic()
+            if self._browser is not None and now - self._last_memory_check >= BROWSER_MEMORY_CHECK_INTERVAL:
+                self._last_memory_check = now
+                rss = child_processes_rss_mb()
+                if rss is not None:
+                    metrics.set_gauge('browser_rss_mb', round(rss, 1))
+                    if rss > self.max_rss_mb:
+                        logging.warning(f"Przeglądarka zajmuje {rss:.0f} MB - uruchamianie nowej instancji")
+                        for other_slot, other in list(self._contexts.items()):
+                            self._retire(other_slot, other)
+                        self._browser = None
+                        self.recycled_browsers += 1
+                        metrics.inc('browser_recycled_total', kind='browser')
+
+            await self._close_drained()
+
+    async def _close_drained(self):
+        """Zamyka wycofane konteksty bez użytkowników i przeglądarki bez kontekstów."""
+        drained = [p for p in self._retiring if p.users == 0]
+        self._retiring = [p for p in self._retiring if p.users > 0]
+        for pooled in drained:
+            await self._close_quietly(pooled.context)
+            old_browser = pooled.browser
+            still_used = old_browser is self._browser or any(
+                p.browser is old_browser for p in [*self._retiring, *self._contexts.values()]
+            )
+            if not still_used:
+                await self._close_quietly(old_browser)
+
+    @staticmethod
+    async def _close_quietly(target):
+        try:
+            await target.close()
+        except Exception as e:
+            logging.debug(f"Błąd zamykania przeglądarki: {e}")
+
+    async def close(self):
+        try:
+            for pooled in [*self._retiring, *self._contexts.values()]:
+                if pooled.browser is not self._browser:
+                    await self._close_quietly(pooled.browser)
+            if self._browser:
+                await self._browser.close()
+            if self._playwright:
+                await self._playwright.stop()
+        except Exception as e:
+            logging.debug(f"Błąd zamykania przeglądarki: {e}")
+        finally:
+            self._playwright = None
+            self._browser = None
+            self._contexts = {}
+            self._retiring = []
@@ -0,0 +1,182 @@
+"""Wiersz poleceń bota.
+
+Każda komenda importuje tylko to, czego potrzebuje: Playwright, google-genai
+i requests ładują się dopiero przy skanie, ocenie AI albo wysyłce na
+Discord. `stats`, `rescore` i `notify-test --dry-run` działają bez kluczy API
+i bez przeglądarki.
+
+    python cli.py scan [--worker] [--worker-id ID]   # ciągłe monitorowanie (jak main.py)
+    python cli.py once                               # jeden cykl i koniec, np. z crona
+    python cli.py rescore --days 30 --top 20 [--ai]  # ponowna wycena zapisanych ogłoszeń
+    python cli.py stats                              # stan bazy, kolejek i workerów
+    python cli.py notify-test [--dry-run]            # testowe powiadomienie na Discord
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import argparse
+
+from config import WEBHOOK_URL
+from database import DB_PATH, STAGE_DONE, live_workers
+
+
+def cmd_scan(args):
+    from main import main
+
+    try:
+        asyncio.run(main(worker_mode=args.worker or bool(args.worker_id), worker_id=args.worker_id, once=args.once))
+    except KeyboardInterrupt:
+        logging.info("Otrzymano wciśnięcie (Ctrl+C). Kończenie pracy programu.")
+
+
+def cmd_rescore(args):
+    """Wycenia zapisane ogłoszenia lokalnym modelem, bez pobierania stron."""
+    from database import ListingStore
+    from models import ListingDetails
+    from parsing import listing_features
+    from valuation import PriceModel
+
+    store = ListingStore(args.db)
+    try:
+        model = PriceModel().fit(store.training_rows())
+        pairs = store.stored_listings(since=time.time() - args.days * 86400)
+    finally:
+        store.close()
+    discounts = model.discounts([listing_features(listing, details) for listing, details in pairs])
+    # NaN (brak wyceny) nie trafia do rankingu
+    scored = sorted(
+        ((float(discount), listing, details) for discount, (listing, details) in zip(discounts, pairs)
+         if discount == discount),
+        key=lambda item: item[0], reverse=True
+    )
+    print(f"Wycenione: {len(scored)} z {len(pairs)} ogłoszeń z ostatnich {args.days} dni")
+    scored = scored[:args.top]
+
+    verdicts = {}
+    if args.ai and scored:
+        from analyzer import check_bargains_gemini
+        verdicts = asyncio.run(check_bargains_gemini([(l, d or ListingDetails()) for _, l, d in scored]))
+
+    for discount, listing, _ in scored:
+        verdict = f"  [{verdicts[listing.id][0]}]" if listing.id in verdicts else ""
+        print(f"{discount:+5.0%}  {listing.price_text:>12}  {listing.year_text:>4}  {listing.title}{verdict}  {listing.url}")
+
+
+def _count(conn, query, params=()):
+    try:
+        return conn.execute(query, params).fetchone()[0]
+    except sqlite3.OperationalError:
+        # Tabela jeszcze nie istnieje (np. bot nie wysłał żadnego powiadomienia)
+        return None
+
+
+def _group(conn, query, params=()):
+    try:
+        return dict(conn.execute(query, params).fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def cmd_stats(args):
+    """Stan bazy bez otwierania jej do zapisu."""
+    if not os.path.exists(args.db):
+        sys.exit(f"Brak bazy {args.db} - bot jeszcze nie działał")
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    day_ago = time.time() - 86400
+    try:
+        summary = {
+            "listings": _count(conn, 'SELECT COUNT(*) FROM listings'),
+            "seen_24h": _count(conn, 'SELECT COUNT(*) FROM listings WHERE last_seen >= ?', (day_ago,)),
+            "new_24h": _count(conn, 'SELECT COUNT(*) FROM listings WHERE first_seen >= ?', (day_ago,)),
+            "pending_by_stage": _group(
+                conn, 'SELECT stage, COUNT(*) FROM listings WHERE stage IS NOT NULL AND stage != ? GROUP BY stage',
+                (STAGE_DONE,)
+            ),
+            "verdicts": _group(
+                conn, 'SELECT deal_type, COUNT(*) FROM listings WHERE deal_type IS NOT NULL GROUP BY deal_type'
+            ),
+            "price_changes": _count(conn, 'SELECT COUNT(*) FROM price_history'),
+            "discord_pending": _count(conn, 'SELECT COUNT(*) FROM discord_outbox WHERE delivered_at IS NULL'),
+            "discord_delivered": _count(
+                conn, 'SELECT COUNT(*) FROM discord_outbox WHERE delivered_at IS NOT NULL AND error IS NULL'
+            ),
+            "discord_failed": _count(
+                conn, 'SELECT COUNT(*) FROM discord_outbox WHERE delivered_at IS NOT NULL AND error IS NOT NULL'
+            ),
+            "verdict_cache": _count(conn, 'SELECT COUNT(*) FROM verdict_cache'),
+            "fingerprints": _count(conn, 'SELECT COUNT(*) FROM fingerprints'),
+            "live_workers": live_workers(conn),
+        }
+    finally:
+        conn.close()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+def cmd_notify_test(args):
+    """Wysyła (albo z --dry-run tylko wypisuje) testowy embed z pominięciem kolejki."""
+    from notifier import build_embed, post_webhook
+
+    embed = build_embed(
+        title="Powiadomienie testowe", price="12 345 PLN", year="2020",
+        url="https://www.otomoto.pl/motocykle-i-quady", image_url="", deal_type="GREAT DEAL",
+        analysis="Wiadomość testowa z `python cli.py notify-test` - webhook działa."
+    )
+    if args.dry_run:
+        print(json.dumps(embed, ensure_ascii=False, indent=2))
+        return
+
+    webhook_url = args.webhook or WEBHOOK_URL
+    if not webhook_url or webhook_url == "TWÓJ_WEBHOOK_DISCORD":
+        sys.exit("Brak WEBHOOK_URL w .env (albo podaj --webhook)")
+    import requests
+
+    try:
+        response = post_webhook([embed], webhook_url)
+    except requests.RequestException as e:
+        sys.exit(f"Błąd Discord: {e}")
+    if response.status_code not in (200, 204):
+        sys.exit(f"Discord odrzucił wiadomość: {response.status_code} {response.text[:200]}")
+    print("Wysłano powiadomienie testowe")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitor okazji motocyklowych na Otomoto.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker_options = argparse.ArgumentParser(add_help=False)
+    worker_options.add_argument('--worker', action='store_true',
+                                help="tryb wielu workerów na wspólnej bazie (podział wyszukiwań i dzierżawy ogłoszeń)")
+    worker_options.add_argument('--worker-id', help="stały identyfikator workera (domyślnie WORKER_ID albo host-pid)")
+
+    scan = commands.add_parser('scan', parents=[worker_options], help="ciągłe monitorowanie wyszukiwań")
+    scan.add_argument('--once', action='store_true', help="jeden cykl: skan, przetworzenie i wysyłka, potem koniec")
+    scan.set_defaults(func=cmd_scan)
+    once = commands.add_parser('once', parents=[worker_options], help="jeden cykl i koniec (jak scan --once)")
+    once.set_defaults(func=cmd_scan, once=True)
+
+    rescore = commands.add_parser('rescore', help="ponowna wycena zapisanych ogłoszeń lokalnym modelem")
+    rescore.add_argument('--db', default=DB_PATH, help="baza ogłoszeń (domyślnie %(default)s)")
+    rescore.add_argument('--days', type=int, default=30, help="ogłoszenia widziane w ostatnich N dniach")
+    rescore.add_argument('--top', type=int, default=20, help="ile najtańszych względem wyceny wypisać")
+    rescore.add_argument('--ai', action='store_true', help="oceń wypisane ogłoszenia także przez Gemini")
+    rescore.set_defaults(func=cmd_rescore)
+
+    stats = commands.add_parser('stats', help="stan bazy, kolejek potoku, powiadomień i workerów")
+    stats.add_argument('--db', default=DB_PATH, help="baza ogłoszeń (domyślnie %(default)s)")
+    stats.set_defaults(func=cmd_stats)
+
+    notify_test = commands.add_parser('notify-test', help="testowe powiadomienie na Discord")
+    notify_test.add_argument('--dry-run', action='store_true', help="tylko wypisz embed, nic nie wysyłaj")
+    notify_test.add_argument('--webhook', help="inny webhook niż WEBHOOK_URL")
+    notify_test.set_defaults(func=cmd_notify_test)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import os
 import logging
 from dotenv import load_dotenv
-from google import genai
 
 load_dotenv()
 
@@ -10,13 +9,118 @@ MONITORED_URLS = [
     "https://www.otomoto.pl/motocykle-i-quady/sportowy--typ-naked?search%5Bfilter_float_engine_capacity%3Afrom%5D=300&search%5Bfilter_float_engine_capacity%3Ato%5D=1500&search%5Bfilter_float_mileage%3Afrom%5D=5000&search%5Bfilter_float_mileage%3Ato%5D=50000&search%5Border%5D=created_at_first%3Adesc"
 ]
 
+# --- Skanowanie wielu wyszukiwań ---
+SCAN_CONCURRENCY = 3                 # ile wyszukiwań skanować naraz (każde w osobnym kontekście)
+SCAN_TIMEOUT = 90                    # domyślny limit czasu (s) na skan jednego URL-a
+PAGINATION_MAX_PAGES = 5             # maks. stron wyników na jeden skan
+PAGINATION_STOP_RUN = 3              # tyle kolejnych znanych ogłoszeń kończy skan
+# Opcjonalne ustawienia per URL, np.:
+# URL_SETTINGS = {"https://www.otomoto.pl/...": {"timeout": 120, "interval": (10, 20)}}
+# "interval" to stały zakres minut między skanami tego URL-a (zamiast adaptacyjnego harmonogramu).
+URL_SETTINGS = {}
+
 # --- Klucze i webhooki ---
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# --- Klient Gemini ---
-client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+# --- Gemini (klient tworzony leniwie w analyzer.get_client) ---
 GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_RPM = 10                      # limit zapytań na minutę
+GEMINI_TPM = 250000                  # limit tokenów na minutę
+GEMINI_CONCURRENCY = 3               # maks. równoległych ocen
+GEMINI_MAX_ATTEMPTS = 4
+GEMINI_OUTPUT_TOKENS = 400           # szacowana długość odpowiedzi (do limitu TPM)
+PROMPT_TOKEN_BUDGET = 1200           # maks. tokenów danych ogłoszenia w prompcie (bez instrukcji)
+GEMINI_BATCH_MAX_SIZE = 8            # maks. ogłoszeń w jednym zapytaniu (1 = bez paczek)
+GEMINI_BATCH_TOKEN_BUDGET = 8000     # maks. tokenów danych ogłoszeń w jednym zapytaniu
+
+# --- Tryb pobierania stron ---
+# "http"    - najpierw zwykłe zapytanie HTTP i parsowanie osadzonego JSON-a,
+#             przeglądarka tylko jako fallback (blokada antybotowa / błąd parsowania)
+# "browser" - zawsze pełne renderowanie w Playwright
+FETCH_MODE = os.getenv("FETCH_MODE", "http")
+HTTP_TIMEOUT = 20
+HTTP_POOL_SIZE = 8
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+
+# --- Pobieranie szczegółów ogłoszeń ---
+DETAIL_POOL_SIZE = 4                 # liczba równolegle używanych stron przeglądarki
+DEFAULT_DOMAIN_CONCURRENCY = 2       # maks. równoległych zapytań do jednej domeny
+DOMAIN_CONCURRENCY = {
+    "www.otomoto.pl": 3,
+}
+DETAIL_DELAY_RANGE = (0.5, 1.5)      # losowa przerwa (s) po każdym pobraniu
+
+# --- Przeglądarka (fallback) ---
+BROWSER_BLOCK_RESOURCES = True       # blokuj obrazy, fonty, media i trackery
+BROWSER_CONTEXT_MAX_PAGES = 200      # po tylu stronach kontekst jest wymieniany na nowy
+BROWSER_MAX_RSS_MB = 1500            # powyżej tego RSS (Chromium + sterownik) przeglądarka jest restartowana
+BROWSER_MEMORY_CHECK_INTERVAL = 60   # co ile sekund sprawdzać zużycie pamięci
+
+# --- Archiwum pobranych stron ---
+# Skompresowane strony wyników i szczegółów (adresowane treścią) do ponownego
+# przetworzenia po zmianie parserów: python snapshots.py reprocess
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "0") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_MAX_MB = 2048               # po przekroczeniu usuwane są najdawniej zapisane strony
+SNAPSHOT_COMPRESSION_LEVEL = 6       # poziom kompresji zlib (1-9)
+
+# --- Cache werdyktów Gemini ---
+VERDICT_CACHE_MEMORY_SIZE = 512          # wpisów w pamięci (LRU)
+VERDICT_CACHE_TTL = 14 * 24 * 3600       # ważność werdyktu (s)
+VERDICT_CACHE_MAX_ROWS = 50000           # limit wierszy w SQLite
+
+# --- Lokalna wycena (wstępna selekcja przed Gemini) ---
+VALUATION_ENABLED = True
+VALUATION_MIN_DISCOUNT = 0.10        # do Gemini trafiają oferty min. 10% poniżej wyceny
+VALUATION_MIN_COMPARABLES = 8        # min. ofert danego modelu do własnej regresji
+VALUATION_REFIT_INTERVAL = 3600      # co ile sekund dopasować model ponownie
+
+# --- Potok przetwarzania ---
+PIPELINE_QUEUE_SIZE = 50             # pojemność kolejek między etapami
+DETAIL_STAGE_WORKERS = 2             # równoległe paczki pobierania szczegółów
+
+# --- Wykrywanie repostów ---
+# Odcisk ogłoszenia: dHash miniatury + SimHash tytułu, rocznika i parametrów z listy wyników.
+# Przebieg (i rocznik, jeśli znany) musi się zgadzać dokładnie - odcisk tekstu nie odróżnia egzemplarzy.
+# Repost bez zmiany ceny jest pomijany przed pobraniem szczegółów; z niższą ceną wraca do analizy.
+DEDUP_ENABLED = True
+DEDUP_IMAGE_DISTANCE = 6             # maks. różnica bitów dHash miniatur (0-7)
+DEDUP_TEXT_DISTANCE = 8              # maks. różnica bitów SimHash tekstu przy zgodnej miniaturze
+DEDUP_TEXT_ONLY_DISTANCE = 2         # maks. różnica SimHash, gdy miniatura jest niedostępna (0-3)
+
+# --- Tryb wielu workerów (python main.py --worker) ---
+# Instancje na wspólnej bazie dzielą MONITORED_URLS haszowaniem spójnym,
+# a ogłoszenia przetwarzają na wygasających dzierżawach.
+WORKER_HEARTBEAT = 15                # co ile sekund worker zgłasza, że żyje, i odnawia dzierżawy
+WORKER_TTL = 60                      # worker bez heartbeatu dłużej niż tyle sekund jest uznany za martwy
+LEASE_TTL = 300                      # dzierżawa ogłoszenia (s) - po awarii workera przejmie je inny
+HASH_RING_REPLICAS = 64              # wirtualne węzły workera na pierścieniu haszowania
+
+# --- Powiadomienia Discord ---
+DISCORD_BATCH_WINDOW = 2.0           # ile sekund czekać na kolejne okazje do jednej wiadomości
+DISCORD_MAX_ATTEMPTS = 8             # po tylu nieudanych próbach powiadomienie jest porzucane
+
+# --- Adaptacyjny harmonogram skanów ---
+# Odstępy między skanami są dobierane z historii napływu ogłoszeń każdego wyszukiwania
+# (per godzina doby). Bez historii obowiązuje stały zakres INTERWAL_SPRAWDZANIA_*.
+TARGET_DETECTION_LATENCY = 5         # docelowe średnie opóźnienie wykrycia nowej oferty (minuty)
+POLL_BUDGET_PER_HOUR = 60            # maks. łączna liczba skanów na godzinę (wszystkie URL-e)
+MIN_POLL_INTERVAL = 2                # najkrótszy odstęp między skanami jednego URL-a (minuty)
+MAX_POLL_INTERVAL = 60               # najdłuższy odstęp między skanami jednego URL-a (minuty)
+POLL_JITTER = 0.2                    # losowe odchylenie odstępu (+/- 20%)
+ARRIVAL_WINDOW_DAYS = 14             # z ilu ostatnich dni liczyć natężenie napływu
+ARRIVAL_PRIOR_DAYS = 2               # waga (w dniach) wygładzania w stronę średniej dobowej
+SCHEDULER_REFRESH = 900              # co ile sekund przeliczać harmonogram
+
+# --- Metryki ---
+# Czasy etapów, liczniki i wiek najstarszego nieprzetworzonego ogłoszenia.
+# Endpoint w formacie Prometheusa: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH")   # opcjonalny zrzut JSON
+METRICS_SNAPSHOT_INTERVAL = 15       # co ile sekund odświeżać wskaźniki i zrzut
 
 # --- Interwał sprawdzania (minuty) ---
 INTERWAL_SPRAWDZANIA_MIN = 3
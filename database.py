@@ -1,39 +1,409 @@
+import time
+import json
 import sqlite3
+import logging
+
+import metrics
+from config import WORKER_TTL
+from models import Listing, ListingDetails, UNKNOWN_TITLE
+from parsing import listing_features
 
 DB_PATH = 'otomoto_listings.db'
 
+# Bezpieczny limit parametrów w jednym zapytaniu (starsze SQLite mają 999)
+_MAX_QUERY_PARAMS = 500
 
-def init_db(clean_start=False):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    if clean_start:
-        cursor.execute('DROP TABLE IF EXISTS listings')
+# Kolumny, z których `_listing_from_row` odtwarza Listing i ListingDetails
+_LISTING_FIELDS = 'id, title, url, image_url, price, currency, year, mileage, engine_capacity, power, details'
+
+# Kolumny dodawane do starej tabeli `listings (id)` przy migracji
+LISTING_COLUMNS = {
+    'title': 'TEXT',
+    'url': 'TEXT',
+    'make': 'TEXT',
+    'model': 'TEXT',
+    'price': 'INTEGER',
+    'currency': 'TEXT',
+    'year': 'INTEGER',
+    'mileage': 'INTEGER',
+    'engine_capacity': 'INTEGER',
+    'power': 'INTEGER',
+    'first_seen': 'REAL',
+    'last_seen': 'REAL',
+    'deal_type': 'TEXT',
+    'price_text': 'TEXT',
+    'image_url': 'TEXT',
+    'stage': 'TEXT',
+    'details': 'TEXT',
+    'analysis': 'TEXT',
+    'note': 'TEXT',
+    'source_url': 'TEXT',
+    'lease_owner': 'TEXT',
+    'lease_expires': 'REAL',
+}
+
+# Etapy przetwarzania ogłoszenia zapisywane w kolumnie `stage` (checkpoint potoku).
+# NULL lub STAGE_DONE oznacza ogłoszenie w pełni przetworzone.
+STAGE_DETAILS = 'details'
+STAGE_VALUATION = 'valuation'
+STAGE_ANALYSIS = 'analysis'
+STAGE_NOTIFY = 'notify'
+STAGE_DONE = 'done'
+
+
+class ListingStore:
+    """Długo żyjące połączenie z bazą ogłoszeń (tryb WAL) z operacjami wsadowymi."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS listings (
+                    id TEXT PRIMARY KEY
+                )
+            ''')
+            existing = {row[1] for row in self.conn.execute('PRAGMA table_info(listings)')}
+            for column, column_type in LISTING_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE listings ADD COLUMN {column} {column_type}')
+
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS price_history (
+                    listing_id TEXT NOT NULL,
+                    price INTEGER NOT NULL,
+                    currency TEXT,
+                    seen_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_make_model_year ON listings (make, model, year)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_last_seen ON listings (last_seen)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_price_history_listing ON price_history (listing_id, seen_at)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_stage ON listings (stage)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_source ON listings (source_url, first_seen)')
+
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS url_state (
+                    url TEXT PRIMARY KEY,
+                    watermark INTEGER,
+                    last_scan_at REAL
+                )
+            ''')
+            url_columns = {row[1] for row in self.conn.execute('PRAGMA table_info(url_state)')}
+            if 'first_scan_at' not in url_columns:
+                self.conn.execute('ALTER TABLE url_state ADD COLUMN first_scan_at REAL')
+                # Wyszukiwania skanowane przed migracją nie potrzebują rozgrzewki
+                self.conn.execute('UPDATE url_state SET first_scan_at = last_scan_at WHERE last_scan_at IS NOT NULL')
+
+    def get_watermark(self, url):
+        """Największe numeryczne ID ogłoszenia widziane dla wyszukiwania (albo None)."""
+        row = self.conn.execute('SELECT watermark FROM url_state WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    @metrics.timed('db_seconds', op='update_watermark')
+    def update_watermark(self, url, ids):
+        numeric = [int(i) for i in ids if str(i).isdigit()]
+        watermark = max(numeric, default=None)
+        with self.conn:
+            now = time.time()
+            self.conn.execute(
+                'INSERT INTO url_state (url, watermark, last_scan_at, first_scan_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET watermark = MAX(COALESCE(watermark, 0), COALESCE(excluded.watermark, 0)), '
+                'last_scan_at = excluded.last_scan_at, first_scan_at = COALESCE(first_scan_at, excluded.first_scan_at)',
+                (url, watermark, now, now)
+            )
+
+    def first_scan_at(self, url):
+        """Kiedy zaczęliśmy obserwować wyszukiwanie (albo None)."""
+        row = self.conn.execute('SELECT first_scan_at FROM url_state WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def seen_ids(self, ids):
+        """Zbiór ID, które już są w bazie."""
+        return set(map(str, ids)) - set(self.filter_new(ids))
+
+    @metrics.timed('db_seconds', op='filter_new')
+    def filter_new(self, ids):
+        """Zwraca ID, których jeszcze nie ma w bazie (z zachowaniem kolejności)."""
+        ids = [str(i) for i in ids]
+        seen = set()
+        for start in range(0, len(ids), _MAX_QUERY_PARAMS):
+            chunk = ids[start:start + _MAX_QUERY_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f'SELECT id FROM listings WHERE id IN ({placeholders})', chunk)
+            seen.update(row[0] for row in rows)
+        return [i for i in dict.fromkeys(ids) if i not in seen]
+
+    def is_listing_new(self, listing_id):
+        return bool(self.filter_new([listing_id]))
+
+    @metrics.timed('db_seconds', op='mark_seen')
+    def mark_seen(self, ids):
+        """Zapisuje wiele ID w jednej transakcji."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO listings (id, first_seen, last_seen) VALUES (?, ?, ?)',
+                [(str(i), now, now) for i in ids]
+            )
+
+    @metrics.timed('db_seconds', op='save_listings')
+    def save_listings(self, listings, details_by_url=None, verdicts=None, stage=None, source_url=None):
+        """Zapisuje lub aktualizuje ogłoszenia w jednej transakcji.
+
+        Dla znanych ogłoszeń odświeża `last_seen` i dopisuje zmianę ceny do
+        `price_history`. `stage` ustawia etap potoku nowym ogłoszeniom (znane
+        zachowują swój - inny worker mógł je już przetworzyć), a `source_url` zapisuje wyszukiwanie, w którym nowe ogłoszenie
+        pojawiło się pierwszy raz (dane do harmonogramu skanów).
+        Ceny w bazie są w jednostkach waluty (złotych, euro), nie w groszach.
+        Zwraca listę obniżek: (listing, stara_cena, nowa_cena).
+        """
+        details_by_url = details_by_url or {}
+        verdicts = verdicts or {}
+        now = time.time()
+        drops = []
+        with self.conn:
+            for listing in listings:
+                listing_id = str(listing.id)
+                features = listing_features(listing, details_by_url.get(listing.url))
+                price, currency = features['price'], features['currency']
+
+                row = self.conn.execute(
+                    'SELECT price, currency FROM listings WHERE id = ?', (listing_id,)
+                ).fetchone()
+
+                if row is None:
+                    inserted = self.conn.execute(
+                        'INSERT INTO listings (id, title, url, make, model, price, currency, year, mileage, '
+                        'engine_capacity, power, first_seen, last_seen, deal_type, price_text, image_url, stage, '
+                        'source_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT(id) DO NOTHING',
+                        (listing_id, listing.title, listing.url, features['make'],
+                         features['model'], price, currency, features['year'], features['mileage'],
+                         features['engine_capacity'], features['power'], now, now, verdicts.get(listing_id),
+                         listing.price_text, listing.image_url, stage, source_url)
+                    ).rowcount
+                    if not inserted:
+                        # Inny worker (nakładające się wyszukiwanie) zapisał je między SELECT a INSERT
+                        row = self.conn.execute(
+                            'SELECT price, currency FROM listings WHERE id = ?', (listing_id,)
+                        ).fetchone()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS listings (
-            id TEXT PRIMARY KEY
+                if row is not None:
+                    old_price, old_currency = row
+                    self.conn.execute(
+                        'UPDATE listings SET title = COALESCE(?, title), url = COALESCE(?, url), '
+                        'make = COALESCE(make, ?), model = COALESCE(model, ?), '
+                        'price = COALESCE(?, price), currency = COALESCE(?, currency), '
+                        'year = COALESCE(year, ?), mileage = COALESCE(?, mileage), '
+                        'engine_capacity = COALESCE(?, engine_capacity), power = COALESCE(?, power), '
+                        'first_seen = COALESCE(first_seen, ?), last_seen = ?, '
+                        'deal_type = COALESCE(?, deal_type), price_text = COALESCE(?, price_text), '
+                        'image_url = COALESCE(?, image_url), stage = COALESCE(stage, ?) WHERE id = ?',
+                        (listing.title, listing.url, features['make'], features['model'],
+                         price, currency, features['year'], features['mileage'], features['engine_capacity'],
+                         features['power'], now, now, verdicts.get(listing_id), listing.price_text,
+                         listing.image_url, stage, listing_id)
+                    )
+                    if price is None or price == old_price:
+                        continue
+                    if old_price is not None and currency == old_currency and price < old_price:
+                        drops.append((listing, old_price, price))
+
+                if price is not None:
+                    self.conn.execute(
+                        'INSERT INTO price_history (listing_id, price, currency, seen_at) VALUES (?, ?, ?, ?)',
+                        (listing_id, price, currency, now)
+                    )
+        return drops
+
+    @metrics.timed('db_seconds', op='checkpoint')
+    def checkpoint(self, listing_id, stage, details=None, deal_type=None, analysis=None, note=None):
+        """Zapisuje postęp ogłoszenia w potoku (etap i dotychczasowe wyniki)."""
+        if isinstance(details, ListingDetails):
+            details = details.to_dict()
+        with self.conn:
+            self.conn.execute(
+                'UPDATE listings SET stage = ?, details = COALESCE(?, details), '
+                'deal_type = COALESCE(?, deal_type), analysis = COALESCE(?, analysis), '
+                'note = COALESCE(?, note) WHERE id = ?',
+                (stage, json.dumps(details, ensure_ascii=False) if details is not None else None,
+                 deal_type, analysis, note, str(listing_id))
+            )
+
+    @metrics.timed('db_seconds', op='claim')
+    def claim(self, owner, ttl, ids=None, limit=None, include_done=False):
+        """Atomowo bierze w dzierżawę ogłoszenia w trakcie potoku na `ttl` sekund.
+
+        Udaje się tylko dla ogłoszeń bez właściciela, z wygasłą dzierżawą albo
+        (dla podanych `ids`) już dzierżawionych przez `owner`, więc naraz
+        przetwarza je jeden worker. Bez `ids` przejmuje porzucone ogłoszenia
+        (do `limit`, od najstarszych). `include_done=True` bierze też ogłoszenia
+        zakończone, które wracają do potoku (obniżka ceny). Zwraca listę przejętych ID.
+        """
+        now = time.time()
+        if ids is None:
+            # Własne dzierżawy to ogłoszenia w kolejkach tego workera - nie są porzucone
+            free, params = '(lease_owner IS NULL OR lease_expires < ?)', (now,)
+        else:
+            free, params = '(lease_owner IS NULL OR lease_expires < ? OR lease_owner = ?)', (now, owner)
+        if not include_done:
+            free += ' AND stage IS NOT NULL AND stage != ?'
+            params += (STAGE_DONE,)
+        claimed = []
+        with self.conn:
+            if ids is None:
+                rows = self.conn.execute(
+                    f'UPDATE listings SET lease_owner = ?, lease_expires = ? WHERE id IN ('
+                    f'SELECT id FROM listings WHERE {free} ORDER BY first_seen LIMIT ?) RETURNING id',
+                    (owner, now + ttl, *params, -1 if limit is None else limit)
+                ).fetchall()
+                claimed.extend(row[0] for row in rows)
+            else:
+                ids = [str(i) for i in ids]
+                for start in range(0, len(ids), _MAX_QUERY_PARAMS):
+                    chunk = ids[start:start + _MAX_QUERY_PARAMS]
+                    rows = self.conn.execute(
+                        f"UPDATE listings SET lease_owner = ?, lease_expires = ? "
+                        f"WHERE id IN ({','.join('?' * len(chunk))}) AND {free} RETURNING id",
+                        (owner, now + ttl, *chunk, *params)
+                    ).fetchall()
+                    claimed.extend(row[0] for row in rows)
+        return claimed
+
+    def renew_leases(self, owner, ttl):
+        """Przedłuża dzierżawy ogłoszeń, które worker wciąż przetwarza."""
+        with self.conn:
+            self.conn.execute(
+                'UPDATE listings SET lease_expires = ? WHERE lease_owner = ? AND stage IS NOT NULL AND stage != ?',
+                (time.time() + ttl, owner, STAGE_DONE)
+            )
+
+    def release_leases(self, owner):
+        """Zwalnia dzierżawy workera, żeby inni od razu mogli przejąć jego ogłoszenia."""
+        with self.conn:
+            self.conn.execute(
+                'UPDATE listings SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?', (owner,)
+            )
+
+    @metrics.timed('db_seconds', op='pending_listings')
+    def pending_listings(self, ids=None):
+        """Ogłoszenia przerwane w trakcie potoku (np. po awarii), od najstarszych.
+
+        `ids` zawęża wynik do podanych ogłoszeń (np. właśnie przejętych).
+        Zwraca listę (stage, listing, details, deal_type, analysis, note).
+        """
+        query = (f'SELECT stage, {_LISTING_FIELDS}, deal_type, analysis, note '
+                 'FROM listings WHERE stage IS NOT NULL AND stage != ?')
+        rows = []
+        if ids is None:
+            rows = self.conn.execute(query + ' ORDER BY first_seen', (STAGE_DONE,)).fetchall()
+        else:
+            ids = [str(i) for i in ids]
+            for start in range(0, len(ids), _MAX_QUERY_PARAMS):
+                chunk = ids[start:start + _MAX_QUERY_PARAMS]
+                rows += self.conn.execute(
+                    query + f" AND id IN ({','.join('?' * len(chunk))}) ORDER BY first_seen", (STAGE_DONE, *chunk)
+                ).fetchall()
+        return [(stage, *_listing_from_row(row), deal_type, analysis, note)
+                for stage, *row, deal_type, analysis, note in rows]
+
+    @metrics.timed('db_seconds', op='stored_listings')
+    def stored_listings(self, since=None, currency='PLN'):
+        """Zapisane ogłoszenia z ceną (widziane od `since`), jako pary (listing, details)."""
+        rows = self.conn.execute(
+            f'SELECT {_LISTING_FIELDS} FROM listings WHERE price IS NOT NULL AND currency = ? AND last_seen >= ? '
+            'ORDER BY last_seen DESC',
+            (currency, since or 0)
+        ).fetchall()
+        return [_listing_from_row(row) for row in rows]
+
+    def oldest_pending_at(self):
+        """Czas pierwszego zauważenia najstarszego ogłoszenia, które nie przeszło jeszcze przez potok."""
+        return self.conn.execute(
+            'SELECT MIN(first_seen) FROM listings WHERE stage IS NOT NULL AND stage != ?', (STAGE_DONE,)
+        ).fetchone()[0]
+
+    def arrival_times(self, source_url, since):
+        """Czasy pierwszego zauważenia nowych ogłoszeń z danego wyszukiwania."""
+        rows = self.conn.execute(
+            'SELECT first_seen FROM listings WHERE source_url = ? AND first_seen >= ?',
+            (source_url, since)
         )
-    ''')
-    conn.commit()
-    conn.close()
+        return [row[0] for row in rows]
 
+    def comparable_prices(self, make, model, year_from, year_to, currency='PLN'):
+        """Ceny porównywalnych motocykli (ta sama marka/model, zakres roczników)."""
+        rows = self.conn.execute(
+            'SELECT price FROM listings WHERE make = ? AND model = ? AND year BETWEEN ? AND ? '
+            'AND currency = ? AND price IS NOT NULL',
+            (make, model, year_from, year_to, currency)
+        )
+        return [row[0] for row in rows]
+
+    @metrics.timed('db_seconds', op='training_rows')
+    def training_rows(self, currency='PLN', exclude_ids=()):
+        """Wiersze historii do dopasowania lokalnego modelu cen.
+
+        `exclude_ids` pomija wyceniane właśnie ogłoszenia - własna cena
+        ciągnęłaby wycenę w swoją stronę i zaniżała rabat.
+        """
+        exclude = set(map(str, exclude_ids))
+        rows = self.conn.execute(
+            'SELECT id, make, model, price, year, mileage, engine_capacity FROM listings '
+            'WHERE currency = ? AND price IS NOT NULL AND year IS NOT NULL AND make IS NOT NULL',
+            (currency,)
+        )
+        return [row[1:] for row in rows if row[0] not in exclude]
+
+    def close(self):
+        self.conn.close()
 
-def is_listing_new(listing_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM listings WHERE id = ?', (listing_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is None
 
+def _listing_from_row(row):
+    """(listing, details) z kolumn _LISTING_FIELDS. Cena w bazie jest w jednostkach, w `Listing` w groszach."""
+    listing_id, title, url, image_url, price, currency, year, mileage, engine_capacity, power, details = row
+    listing = Listing(
+        id=listing_id, title=title or UNKNOWN_TITLE, url=url or '', image_url=image_url or '',
+        price=price * 100 if price is not None else None, currency=currency, year=year,
+        mileage=mileage, engine_capacity=engine_capacity, power=power, is_today=True,
+    )
+    return listing, ListingDetails.from_dict(json.loads(details)) if details else None
 
-def save_listing(listing_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT INTO listings (id) VALUES (?)', (listing_id,))
+
+def live_workers(conn, ttl=WORKER_TTL):
+    """ID workerów, które zgłosiły się w ciągu ostatnich `ttl` sekund."""
+    has_registry = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'workers'").fetchone()
+    if not has_registry:
+        return []
+    rows = conn.execute(
+        'SELECT worker_id FROM workers WHERE heartbeat_at >= ? ORDER BY worker_id', (time.time() - ttl,)
+    )
+    return [row[0] for row in rows]
+
+
+def init_db(clean_start=False, path=DB_PATH):
+    """Otwiera bazę ogłoszeń. `clean_start=True` kasuje zapisany stan.
+
+    Czyszczone są ogłoszenia, historia cen i stan skanowania adresów (watermark,
+    rozgrzewka), więc pierwszy skan znów tylko zapamiętuje ogłoszenia. Zostają
+    odciski repostów, cache werdyktów Gemini, kolejka Discorda i archiwum stron.
+    Czyszczenie jest pomijane, gdy z bazy korzystają działające workery.
+    """
+    if clean_start:
+        conn = sqlite3.connect(path)
+        if live_workers(conn):
+            logging.error("Baza jest używana przez działające workery - pominięto czyszczenie stanu")
+            conn.close()
+            return ListingStore(path)
+        conn.execute('DROP TABLE IF EXISTS listings')
+        conn.execute('DROP TABLE IF EXISTS price_history')
+        conn.execute('DROP TABLE IF EXISTS url_state')
         conn.commit()
-    except sqlite3.IntegrityError:
-        pass
-    finally:
         conn.close()
+    return ListingStore(path)
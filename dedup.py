@@ -0,0 +1,214 @@
+import io
+import re
+import time
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import threading
+import unicodedata
+
+try:
+    from PIL import Image
+except ImportError:  # Bez Pillow działa tylko odcisk tekstu
+    Image = None
+
+from config import HTTP_TIMEOUT, DEDUP_IMAGE_DISTANCE, DEDUP_TEXT_DISTANCE, DEDUP_TEXT_ONLY_DISTANCE
+from database import DB_PATH
+from http_fetcher import get_session
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Indeks pasmowy: hash 64-bitowy dzielony na pasma. Dwa hashe różniące się
+# o d bitów mają co najmniej (liczba pasm - d) identycznych pasm.
+IMAGE_BANDS = 8      # 8 pasm po 8 bitów - przy odległości d zgodne co najmniej 8 - d pasm
+TEXT_BANDS = 4       # 4 pasma po 16 bitów - przy odległości d zgodne co najmniej 4 - d pasm
+
+
+def _tokens(text):
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    words = _TOKEN_RE.findall(text.encode('ascii', 'ignore').decode())
+    # Pojedyncze słowa i pary sąsiednich słów (kolejność ma znaczenie, ale słabiej)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def simhash(text, bits=64):
+    """SimHash tekstu: podobne teksty mają hashe różniące się o niewiele bitów."""
+    weights = [0] * bits
+    for token in _tokens(text):
+        value = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big')
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def dhash(image_bytes, size=8):
+    """Perceptual hash (dHash) obrazka: kierunek zmian jasności na miniaturze 9x8."""
+    if Image is None or not image_bytes:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            pixels = list(image.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+    except Exception as e:
+        logging.debug(f"Nie udało się odczytać miniatury: {e}")
+        return None
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left, right = pixels[row * (size + 1) + col], pixels[row * (size + 1) + col + 1]
+            value = value << 1 | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def listing_text(listing):
+    """Tekst odcisku ogłoszenia z danych listy wyników (bez strony szczegółów)."""
+    return f"{listing.title} {listing.year or ''} {listing.summary}"
+
+
+def _download_image_hash(url):
+    try:
+        response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    except Exception as e:
+        logging.debug(f"Błąd pobierania miniatury {url}: {e}")
+        return None
+    return dhash(response.content) if response.status_code == 200 else None
+
+
+async def fetch_image_hash(url):
+    """dHash miniatury ogłoszenia albo None (brak adresu, błąd, brak Pillow)."""
+    if Image is None or not url or not str(url).startswith('http'):
+        return None
+    return await asyncio.to_thread(_download_image_hash, url)
+
+
+def _signed(value):
+    """SQLite przechowuje INTEGER ze znakiem - 64-bitowe hashe trzeba przesunąć."""
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+
+def _unsigned(value):
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+
+def _bands(value, count):
+    width = 64 // count
+    return [(band, value >> (band * width) & ((1 << width) - 1)) for band in range(count)]
+
+
+class DedupIndex:
+    """Indeks odcisków ogłoszeń (SimHash tekstu + dHash miniatury) do wykrywania repostów.
+
+    Wyszukiwanie podobnych odcisków idzie po pasmach hashy z indeksem w SQLite,
+    więc nie wymaga przeglądania całej historii.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    listing_id TEXT PRIMARY KEY,
+                    text_hash INTEGER NOT NULL,
+                    image_hash INTEGER,
+                    price INTEGER,
+                    currency TEXT,
+                    year INTEGER,
+                    mileage INTEGER,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(fingerprints)')}
+            for column in ('year', 'mileage'):
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE fingerprints ADD COLUMN {column} INTEGER')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS fingerprint_bands (
+                    kind TEXT NOT NULL,
+                    band INTEGER NOT NULL,
+                    value INTEGER NOT NULL,
+                    listing_id TEXT NOT NULL
+                )
+            ''')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_fingerprint_bands ON fingerprint_bands (kind, band, value)'
+            )
+
+    def _candidates(self, kind, value, bands, distance, listing_id, year, mileage):
+        """Kandydaci z indeksu pasm razem z odciskami - jedno zapytanie zamiast SELECT-a na kandydata.
+
+        Hashe różniące się o d bitów mają co najmniej `bands - d` identycznych
+        pasm, więc odcisk z mniejszą liczbą trafień nie może być w zasięgu
+        `distance` i odpada już w SQL. Tam też idą warunki przebiegu i rocznika.
+        """
+        query = ', '.join('(?, ?)' for _ in range(bands))
+        rows = self.conn.execute(f'''
+            WITH probe(band, value) AS (VALUES {query})
+            SELECT f.listing_id, f.text_hash, f.image_hash, f.price, f.currency
+            FROM probe
+            JOIN fingerprint_bands b ON b.kind = ? AND b.band = probe.band AND b.value = probe.value
+            JOIN fingerprints f ON f.listing_id = b.listing_id
+            WHERE b.listing_id != ? AND f.mileage IS ? AND (? IS NULL OR f.year IS NULL OR f.year = ?)
+            GROUP BY f.listing_id
+            HAVING COUNT(*) >= ?
+        ''', [
+            *(part for pair in _bands(value, bands) for part in pair),
+            kind, str(listing_id), mileage, year or None, year or None, max(1, bands - distance),
+        ])
+        return [(row[0], _unsigned(row[1]), _unsigned(row[2]), row[3], row[4]) for row in rows]
+
+    def find(self, listing_id, text_hash, image_hash=None, year=None, mileage=None):
+        """Najbliższy wcześniejszy odcisk tego samego motocykla: {listing_id, price, currency} albo None.
+
+        Z miniaturą wystarczy zgodny obrazek i zbliżony tekst; bez miniatury
+        tekst musi być praktycznie identyczny. Przebieg musi się zgadzać, a rocznik
+        tam, gdzie znają go oba ogłoszenia - dwa egzemplarze tego samego modelu
+        z jednego rocznika mają bliskie odciski tekstu.
+        """
+        with self._lock:
+            if image_hash is not None:
+                candidates = self._candidates('image', image_hash, IMAGE_BANDS, DEDUP_IMAGE_DISTANCE,
+                                              listing_id, year, mileage)
+                limit = DEDUP_TEXT_DISTANCE
+            else:
+                candidates = self._candidates('text', text_hash, TEXT_BANDS, DEDUP_TEXT_ONLY_DISTANCE,
+                                              listing_id, year, mileage)
+                limit = DEDUP_TEXT_ONLY_DISTANCE
+            best = None
+            for other_id, other_text, other_image, price, currency in candidates:
+                if image_hash is not None and (other_image is None or hamming(image_hash, other_image) > DEDUP_IMAGE_DISTANCE):
+                    continue
+                distance = hamming(text_hash, other_text)
+                if distance <= limit and (best is None or distance < best[0]):
+                    best = (distance, {'listing_id': other_id, 'price': price, 'currency': currency})
+            return best[1] if best else None
+
+    def add(self, listing_id, text_hash, image_hash=None, price=None, currency=None, year=None, mileage=None):
+        listing_id = str(listing_id)
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM fingerprint_bands WHERE listing_id = ?', (listing_id,))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO fingerprints '
+                '(listing_id, text_hash, image_hash, price, currency, year, mileage, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (listing_id, _signed(text_hash), _signed(image_hash), price, currency, year, mileage, time.time())
+            )
+            bands = [('text', band, value) for band, value in _bands(text_hash, TEXT_BANDS)]
+            if image_hash is not None:
+                bands += [('image', band, value) for band, value in _bands(image_hash, IMAGE_BANDS)]
+            self.conn.executemany(
+                'INSERT INTO fingerprint_bands (kind, band, value, listing_id) VALUES (?, ?, ?, ?)',
+                [(kind, band, value, listing_id) for kind, band, value in bands]
+            )
+
+    def check(self, listing, image_hash=None):
+        """Zapisuje odcisk ogłoszenia i zwraca wcześniejszy odpowiednik (repost) albo None."""
+        text_hash = simhash(listing_text(listing))
+        original = self.find(listing.id, text_hash, image_hash, listing.year, listing.mileage)
+        self.add(listing.id, text_hash, image_hash, listing.price_units, listing.currency, listing.year, listing.mileage)
+        return original
@@ -0,0 +1,251 @@
+import re
+import json
+import html
+import logging
+from datetime import datetime, timezone, timedelta
+
+import metrics
+from config import HTTP_TIMEOUT, HTTP_POOL_SIZE, USER_AGENT
+from models import Listing, ListingDetails, UNKNOWN_TITLE
+from parsing import amount_to_grosze, parse_number, parse_year
+
+NEXT_DATA_RE = re.compile(
+    r'<script[^>]+id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL
+)
+TAG_RE = re.compile(r'<[^>]+>')
+BR_RE = re.compile(r'<br\s*/?>|</p>|</li>', re.IGNORECASE)
+
+# Znaczniki stron antybotowych / challenge zamiast właściwej treści
+ANTIBOT_MARKERS = (
+    'captcha',
+    'cf-challenge',
+    'challenge-platform',
+    'datadome',
+    'px-captcha',
+    'access denied',
+    'request unsuccessful',
+)
+
+_session = None
+
+
+def get_session():
+    """Zwraca współdzieloną sesję HTTP z pulą połączeń."""
+    global _session
+    if _session is None:
+        # requests dopiero przy pierwszym pobraniu - samo parsowanie (archiwum, benchmark) go nie potrzebuje
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'pl-PL,pl;q=0.9,en;q=0.8',
+        })
+        _session = session
+    return _session
+
+
+def is_antibot_page(page_html, status_code=200):
+    """Sprawdza, czy odpowiedź wygląda na blokadę antybotową."""
+    if status_code in (403, 429, 503):
+        return True
+    if '__NEXT_DATA__' in page_html:
+        return False
+    lowered = page_html[:20000].lower()
+    return any(marker in lowered for marker in ANTIBOT_MARKERS)
+
+
+@metrics.timed('http_fetch_seconds')
+def fetch_html(url):
+    """Pobiera HTML strony. Zwraca None przy błędzie lub stronie antybotowej."""
+    import requests
+
+    try:
+        response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        logging.warning(f"Błąd HTTP dla {url}: {e}")
+        return None
+
+    if is_antibot_page(response.text, response.status_code):
+        logging.warning(f"Wykryto stronę antybotową ({response.status_code}) dla {url}")
+        return None
+    if response.status_code != 200:
+        logging.warning(f"Nieoczekiwany status HTTP {response.status_code} dla {url}")
+        return None
+    return response.text
+
+
+def extract_next_data(page_html):
+    """Wyciąga osadzony stan Next.js (__NEXT_DATA__) ze strony."""
+    match = NEXT_DATA_RE.search(page_html or '')
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def _find_key(obj, key):
+    """Przeszukuje zagnieżdżony JSON (także JSON zapisany jako string) w poszukiwaniu klucza."""
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if key in current:
+                return current[key]
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+        elif isinstance(current, str) and key in current and current[:1] in '{[':
+            try:
+                stack.append(json.loads(current))
+            except ValueError:
+                continue
+    return None
+
+
+def _parse_created_at(value):
+    try:
+        created = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created
+
+
+def _node_parameters(node):
+    params = {}
+    for param in node.get('parameters') or []:
+        if isinstance(param, dict) and param.get('key'):
+            params[param['key']] = param.get('value') or param.get('displayValue') or ''
+    return params
+
+
+def _node_to_listing(node, now):
+    listing_id = str(node.get('id') or '')
+    if not listing_id:
+        return None
+
+    title = (node.get('title') or '').strip() or UNKNOWN_TITLE
+
+    price = node.get('price') if isinstance(node.get('price'), dict) else {}
+    amount = price.get('amount') if isinstance(price.get('amount'), dict) else price
+    grosze = amount_to_grosze(amount.get('units', amount.get('value')))
+    currency = (amount.get('currencyCode') or amount.get('currency') or 'PLN') if grosze is not None else None
+
+    params = _node_parameters(node)
+
+    # Otomoto pokazuje "X godzin temu" do 24h od dodania, potem datę
+    created = _parse_created_at(node.get('createdAt'))
+    is_today = bool(created and now - created < timedelta(hours=24))
+
+    thumbnail = node.get('thumbnail')
+    image_url = ''
+    if isinstance(thumbnail, dict):
+        image_url = thumbnail.get('x2') or thumbnail.get('x1') or ''
+
+    return Listing(
+        id=listing_id, title=title, url=node.get('url') or '', image_url=image_url,
+        price=grosze, currency=currency,
+        year=parse_year(params.get('year')) or parse_year(title),
+        mileage=parse_number(params.get('mileage')),
+        engine_capacity=parse_number(params.get('engine_capacity')),
+        power=parse_number(params.get('engine_power')),
+        is_today=is_today, summary=' '.join(str(params[key]) for key in sorted(params)),
+    )
+
+
+@metrics.timed('html_parse_seconds', kind='results')
+def parse_results_html(page_html, now=None):
+    """Parsuje stronę wyników z osadzonego JSON-a.
+
+    Zwraca listę `Listing` jak `extract_from_otomoto` albo None, gdy strona
+    nie zawiera oczekiwanych danych (wtedy trzeba użyć przeglądarki).
+    """
+    data = extract_next_data(page_html)
+    if data is None:
+        return None
+    search = _find_key(data, 'advertSearch')
+    if not isinstance(search, dict) or not isinstance(search.get('edges'), list):
+        return None
+
+    now = now or datetime.now(timezone.utc)
+    listings = []
+    for edge in search['edges']:
+        node = edge.get('node') if isinstance(edge, dict) else None
+        if not isinstance(node, dict):
+            continue
+        listing = _node_to_listing(node, now)
+        if listing:
+            listings.append(listing)
+    return listings
+
+
+def _html_to_text(fragment):
+    text = BR_RE.sub('\n', fragment or '')
+    text = html.unescape(TAG_RE.sub('', text))
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def _param_value(param):
+    values = param.get('values')
+    if isinstance(values, list) and values:
+        return ', '.join(str(v.get('label') or v.get('value') or '') for v in values if isinstance(v, dict))
+    return str(param.get('value') or '')
+
+
+@metrics.timed('html_parse_seconds', kind='details')
+def parse_details_html(page_html):
+    """Parsuje stronę ogłoszenia z osadzonego JSON-a.
+
+    Zwraca `ListingDetails` jak `extract_listing_details` albo None, gdy nie
+    udało się znaleźć danych ogłoszenia.
+    """
+    data = extract_next_data(page_html)
+    if data is None:
+        return None
+    advert = _find_key(data, 'advert')
+    if not isinstance(advert, dict):
+        return None
+
+    description = _html_to_text(advert.get('description'))
+    highlights = "\n".join(str(f) for f in advert.get('mainFeatures') or [] if f)
+
+    params = []
+    year = ''
+    params_dict = advert.get('parametersDict')
+    if isinstance(params_dict, dict) and params_dict:
+        for key, param in params_dict.items():
+            if not isinstance(param, dict):
+                continue
+            value = _param_value(param)
+            if value:
+                params.append(f"{param.get('label') or key}: {value}")
+            if key == 'year':
+                year = value
+    else:
+        for param in advert.get('details') or []:
+            if isinstance(param, dict) and param.get('value'):
+                params.append(f"{param.get('label') or param.get('key')}: {param['value']}")
+                if param.get('key') == 'year':
+                    year = str(param['value'])
+
+    equipment = []
+    for group in advert.get('equipment') or []:
+        if isinstance(group, dict) and _param_value(group):
+            equipment.append(f"{group.get('label', '')}: {_param_value(group)}")
+    if equipment:
+        params.append("--- SZCZEGÓŁY I WYPOSAŻENIE ---")
+        params.extend(equipment)
+
+    parameters = "\n".join(params)
+    if not description and not parameters:
+        return None
+    return ListingDetails.parse(description, parameters, highlights, year=year)
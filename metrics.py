@@ -0,0 +1,249 @@
+"""Lekkie metryki bota: czasy etapów (histogramy), liczniki i wskaźniki.
+
+Dostępne lokalnie w formacie tekstowym Prometheusa (`/metrics`) i opcjonalnie
+jako zrzut JSON do pliku. Przy METRICS_ENABLED=False wszystkie funkcje od razu
+wracają, a `timed` zwraca funkcję bez zmian, więc narzut jest pomijalny.
+"""
+import json
+import os
+import time
+import bisect
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL
+
+PREFIX = "dealfinder_"
+
+# Progi histogramów czasu (s): od parsowania (ms) po wywołania Gemini i ładowanie stron
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+DESCRIPTIONS = {
+    "page_load_seconds": "Czas ładowania strony w przeglądarce",
+    "dom_parse_seconds": "Czas wyciągania danych ze strony w przeglądarce",
+    "http_fetch_seconds": "Czas pobrania strony przez HTTP",
+    "html_parse_seconds": "Czas parsowania osadzonego JSON-a strony",
+    "db_seconds": "Czas operacji na bazie SQLite",
+    "gemini_seconds": "Czas oceny ogłoszenia przez Gemini (z kolejką limitera)",
+    "gemini_batch_seconds": "Czas oceny paczki ogłoszeń przez Gemini",
+    "discord_seconds": "Czas wysłania wiadomości na Discord",
+    "scan_seconds": "Czas skanu jednego wyszukiwania",
+    "listings_seen_total": "Ogłoszenia widziane na stronach wyników",
+    "listings_new_total": "Nowe ogłoszenia skierowane do analizy",
+    "listings_analyzed_total": "Ogłoszenia ocenione przez Gemini",
+    "listings_notified_total": "Okazje skierowane do powiadomienia",
+    "reposts_skipped_total": "Reposty pominięte przed pobraniem szczegółów",
+    "verdict_cache_hits_total": "Trafienia w cache werdyktów",
+    "verdict_cache_misses_total": "Chybienia w cache werdyktów",
+    "gemini_rate_limited_total": "Odpowiedzi 429 z Gemini",
+    "gemini_batch_fallbacks_total": "Ogłoszenia z paczki ocenione ponownie pojedynczo",
+    "gemini_prompt_tokens_total": "Tokeny promptów wysłane do Gemini",
+    "gemini_output_tokens_total": "Tokeny odpowiedzi Gemini",
+    "discord_rate_limited_total": "Odpowiedzi 429 z Discorda",
+    "oldest_pending_age_seconds": "Wiek najstarszego nieprzetworzonego ogłoszenia",
+    "queue_size": "Liczba zadań w kolejce etapu potoku",
+    "browser_rss_mb": "Pamięć (RSS) przeglądarki i sterownika Playwright w MB",
+    "browser_recycled_total": "Wymiany kontekstów i restarty przeglądarki",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Zwiększa licznik."""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Ustawia wartość wskaźnika."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """Dodaje pomiar czasu do histogramu."""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+@contextmanager
+def _timer(name, labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timer(name, **labels):
+    """Kontekst mierzący czas bloku (działa też z `await` w środku)."""
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return _timer(name, labels)
+
+
+def timed(name, **labels):
+    """Dekorator mierzący czas funkcji (zwykłej lub async)."""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _timer(name, labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _timer(name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render():
+    """Metryki w formacie tekstowym Prometheusa."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: {**h, "buckets": list(h["buckets"])} for key, h in _histograms.items()}
+
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {PREFIX}{name} {DESCRIPTIONS.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            cumulative += count
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Metryki jako słownik (do zrzutu JSON)."""
+    def name_of(key):
+        name, labels = key
+        return name + _format_labels(labels)
+
+    with _lock:
+        return {
+            "timestamp": time.time(),
+            "counters": {name_of(k): v for k, v in _counters.items()},
+            "gauges": {name_of(k): v for k, v in _gauges.items()},
+            "histograms": {
+                name_of(k): {
+                    "count": h["count"],
+                    "sum": round(h["sum"], 6),
+                    "mean": round(h["sum"] / h["count"], 6) if h["count"] else None,
+                    "buckets": dict(zip(map(str, BUCKETS), h["buckets"])),
+                }
+                for k, h in _histograms.items()
+            },
+        }
+
+
+def write_snapshot(path=METRICS_SNAPSHOT_PATH):
+    """Zapisuje zrzut metryk do pliku JSON (atomowo)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Uruchamia endpoint `/metrics` w wątku w tle. Zwraca serwer albo None."""
+    if not METRICS_ENABLED:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logging.error(f"Nie udało się uruchomić endpointu metryk na {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metryki dostępne pod http://{host}:{server.server_port}/metrics")
+    return server
+
+
+async def run_exporter(update=None, interval=METRICS_SNAPSHOT_INTERVAL):
+    """Uruchamia endpoint i co `interval` s odświeża wskaźniki (`update()`) oraz zrzut JSON."""
+    if not METRICS_ENABLED:
+        return
+    start_server()
+    while True:
+        try:
+            if update:
+                update()
+            if METRICS_SNAPSHOT_PATH:
+                await asyncio.to_thread(write_snapshot)
+        except Exception as e:
+            logging.error(f"Błąd zapisu metryk: {e}")
+        await asyncio.sleep(interval)
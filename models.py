@@ -0,0 +1,84 @@
+"""Typowane rekordy ogłoszeń przekazywane między etapami potoku.
+
+Teksty ze strony (cena, rocznik, przebieg, pojemność, moc) są zamieniane na
+liczby raz, przy pobraniu - dalsze etapy nie parsują już napisów. Teksty do
+wyświetlenia (`price_text`, `year_text`) są wyliczane z liczb.
+"""
+from dataclasses import dataclass, asdict
+
+from parsing import (
+    format_price, parse_year, parse_detail_year, parse_mileage, parse_engine_capacity, parse_power,
+    parse_make_model
+)
+
+UNKNOWN_TITLE = "Nieznany pojazd (Otomoto)"
+UNKNOWN_PRICE = "Nieznana cena"
+UNKNOWN_YEAR = "Nieznany rocznik"
+
+
+@dataclass(slots=True)
+class Listing:
+    """Ogłoszenie z listy wyników. Cena w groszach (centach dla EUR)."""
+    id: str
+    title: str = UNKNOWN_TITLE
+    url: str = ''
+    image_url: str = ''
+    price: int | None = None
+    currency: str | None = None
+    year: int | None = None
+    mileage: int | None = None
+    engine_capacity: int | None = None
+    power: int | None = None
+    is_today: bool = False
+    summary: str = ''
+
+    @property
+    def price_units(self):
+        """Cena w jednostkach waluty (złotych, euro) albo None."""
+        return self.price // 100 if self.price is not None else None
+
+    @property
+    def price_text(self):
+        return format_price(self.price_units, self.currency) if self.price is not None else UNKNOWN_PRICE
+
+    @property
+    def year_text(self):
+        return str(self.year) if self.year else UNKNOWN_YEAR
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class ListingDetails:
+    """Szczegóły ze strony ogłoszenia: teksty do promptu i liczby do wyceny."""
+    description: str = ''
+    parameters: str = ''
+    highlights: str = ''
+    year: int | None = None
+    mileage: int | None = None
+    engine_capacity: int | None = None
+    power: int | None = None
+    make: str | None = None
+    model: str | None = None
+
+    @classmethod
+    def parse(cls, description='', parameters='', highlights='', year=None):
+        """Buduje szczegóły z tekstów strony. `year` to rocznik z osobnego pola, jeśli strona go podaje."""
+        text = f"{highlights}\n{parameters}"
+        make, model = parse_make_model('', parameters)
+        return cls(
+            description=description, parameters=parameters, highlights=highlights,
+            year=parse_year(year) or parse_detail_year(highlights, parameters),
+            mileage=parse_mileage(text), engine_capacity=parse_engine_capacity(text), power=parse_power(text),
+            make=make, model=model,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Odtwarza szczegóły z zapisu JSON (checkpoint w bazie, archiwum stron)."""
+        return cls.parse(data.get('description') or '', data.get('parameters') or '',
+                         data.get('highlights') or '', data.get('year'))
+
+    def to_dict(self):
+        return asdict(self)
@@ -1,13 +1,40 @@
+import json
+import time
+import random
+import asyncio
+import sqlite3
 import logging
-import requests
-from config import WEBHOOK_URL
 
+import metrics
+from config import WEBHOOK_URL, DISCORD_BATCH_WINDOW, DISCORD_MAX_ATTEMPTS, HTTP_TIMEOUT
+from database import DB_PATH
 
-def send_discord_notification(title, price, year, url, image_url, deal_type="NORMAL DEAL", analysis=""):
-    """Wysyła powiadomienie na Discord przez webhook."""
-    if not WEBHOOK_URL or WEBHOOK_URL == "TWÓJ_WEBHOOK_DISCORD":
-        return
+# Limity Discorda dla jednej wiadomości webhooka
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
 
+# Na tyle sekund wysyłający rezerwuje wpisy kolejki - inne workery ich nie wezmą
+DELIVERY_LEASE = 60
+
+USERNAME = "Monitor AI - OKAZJE"
+
+_session = None
+
+
+def get_session():
+    """Zwraca współdzieloną sesję HTTP do Discorda (keep-alive, pula połączeń)."""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _session = requests.Session()
+        _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+    return _session
+
+
+def build_embed(title, price, year, url, image_url, deal_type="NORMAL DEAL", analysis=""):
+    """Buduje embed Discorda dla jednej okazji."""
     colors = {
         "GREAT DEAL": 0x2ECC71,
         "BARGAIN": 0xBF40BF
@@ -25,12 +52,224 @@ def send_discord_notification(title, price, year, url, image_url, deal_type="NOR
         embed["url"] = url
     if image_url and str(image_url).startswith('http'):
         embed["thumbnail"] = {"url": image_url}
+    return embed
+
+
+def _embed_chars(embed):
+    return len(embed.get("title", "")) + len(embed.get("description", ""))
 
+
+def _retry_after(response):
+    """Czas (s), po którym Discord pozwala ponowić zapytanie po 429."""
+    try:
+        return float(response.json().get("retry_after"))
+    except (ValueError, TypeError, AttributeError):
+        pass
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _bucket_wait(response):
+    """Czas do odnowienia kubełka limitu, jeśli został wyczerpany."""
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        try:
+            return float(response.headers.get("X-RateLimit-Reset-After", 0))
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+@metrics.timed('discord_seconds')
+def post_webhook(embeds, webhook_url=WEBHOOK_URL, session=None):
+    """Wysyła jedną wiadomość z embedami. Zwraca odpowiedź HTTP."""
     data = {
-        "username": "Monitor AI - OKAZJE",
-        "embeds": [embed]
+        "username": USERNAME,
+        "embeds": embeds
     }
-    try:
-        requests.post(WEBHOOK_URL, json=data)
-    except Exception as e:
-        logging.error(f"Błąd Discord: {e}")
+    return (session or get_session()).post(webhook_url, json=data, timeout=HTTP_TIMEOUT)
+
+
+class DiscordNotifier:
+    """Trwała kolejka powiadomień Discorda z pakowaniem embedów i obsługą limitów.
+
+    Okazje trafiają najpierw do tabeli `discord_outbox`, więc nic nie ginie przy
+    błędzie sieci, 429 ani restarcie. `run()` wysyła je paczkami do 10 embedów
+    w jednej wiadomości i respektuje nagłówki limitów Discorda. Pobrane do
+    wysyłki wpisy są rezerwowane, więc kilka workerów na wspólnej bazie nie
+    wyśle tego samego powiadomienia.
+    """
+
+    def __init__(self, webhook_url=WEBHOOK_URL, path=DB_PATH, batch_window=DISCORD_BATCH_WINDOW,
+                 max_attempts=DISCORD_MAX_ATTEMPTS, session=None):
+        self.webhook_url = webhook_url
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        # Sesja (i import requests) powstaje przy pierwszej wysyłce
+        self.session = session
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.rate_limited = 0
+        self._next_send_at = 0.0
+        self._wakeup = asyncio.Event()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS discord_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE,
+                    embed TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    delivered_at REAL,
+                    error TEXT
+                )
+            ''')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_discord_outbox_pending ON discord_outbox (delivered_at, next_attempt_at)'
+            )
+
+    @property
+    def enabled(self):
+        return bool(self.webhook_url) and self.webhook_url != "TWÓJ_WEBHOOK_DISCORD"
+
+    def enqueue(self, embed, key=None):
+        """Zapisuje embed w kolejce. Ten sam `key` nie zostanie wysłany drugi raz."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.conn:
+            # Dostarczone wpisy zostają przez tydzień, żeby ten sam klucz nie poszedł ponownie
+            self.conn.execute(
+                'DELETE FROM discord_outbox WHERE delivered_at < ?', (now - 7 * 24 * 3600,)
+            )
+            self.conn.execute(
+                'INSERT OR IGNORE INTO discord_outbox (key, embed, created_at, next_attempt_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(embed, ensure_ascii=False), now, now)
+            )
+        self._wakeup.set()
+
+    def pending_count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM discord_outbox WHERE delivered_at IS NULL').fetchone()[0]
+
+    def _due_batch(self):
+        now = time.time()
+        with self.conn:
+            rows = self.conn.execute(
+                'UPDATE discord_outbox SET next_attempt_at = ? WHERE id IN ('
+                'SELECT id FROM discord_outbox WHERE delivered_at IS NULL AND next_attempt_at <= ? '
+                'ORDER BY id LIMIT ?) RETURNING id, embed, attempts',
+                (now + DELIVERY_LEASE, now, MAX_EMBEDS_PER_MESSAGE)
+            ).fetchall()
+        batch, chars, left_over = [], 0, []
+        for row_id, embed_json, attempts in sorted(rows):
+            embed = json.loads(embed_json)
+            size = _embed_chars(embed)
+            if left_over or (batch and chars + size > MAX_EMBED_CHARS_PER_MESSAGE):
+                left_over.append(row_id)
+                continue
+            batch.append((row_id, embed, attempts))
+            chars += size
+        if left_over:
+            self._release([(row_id,) for row_id in left_over], now)
+        return batch
+
+    def _release(self, rows, at):
+        """Zwalnia rezerwację wpisów - do ponownej wysyłki od `at`."""
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE discord_outbox SET next_attempt_at = ? WHERE id = ?', [(at, row[0]) for row in rows]
+            )
+
+    def _next_due_in(self):
+        row = self.conn.execute(
+            'SELECT MIN(next_attempt_at) FROM discord_outbox WHERE delivered_at IS NULL'
+        ).fetchone()
+        return max(0.0, row[0] - time.time()) if row and row[0] is not None else None
+
+    def _retry_later(self, batch, error, permanent=False):
+        now = time.time()
+        with self.conn:
+            for row_id, _, attempts in batch:
+                attempts += 1
+                if permanent or attempts >= self.max_attempts:
+                    logging.error(f"Porzucono powiadomienie Discord po {attempts} próbach: {error}")
+                    self.conn.execute(
+                        'UPDATE discord_outbox SET attempts = ?, delivered_at = ?, error = ? WHERE id = ?',
+                        (attempts, now, error, row_id)
+                    )
+                else:
+                    delay = min(300, 5 * 2 ** attempts) * random.uniform(0.8, 1.2)
+                    self.conn.execute(
+                        'UPDATE discord_outbox SET attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?',
+                        (attempts, now + delay, error, row_id)
+                    )
+
+    async def _send(self, batch):
+        import requests
+
+        delay = self._next_send_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        embeds = [embed for _, embed, _ in batch]
+        try:
+            response = await asyncio.to_thread(post_webhook, embeds, self.webhook_url, self.session)
+        except requests.RequestException as e:
+            logging.error(f"Błąd Discord: {e}")
+            self._retry_later(batch, str(e))
+            return
+
+        self._next_send_at = time.time() + _bucket_wait(response)
+
+        if response.status_code == 429:
+            self.rate_limited += 1
+            metrics.inc('discord_rate_limited_total')
+            wait = _retry_after(response)
+            self._next_send_at = max(self._next_send_at, time.time() + wait)
+            # Wpisy od razu wracają do kolejki - `_send` odczeka do `_next_send_at`
+            self._release(batch, time.time())
+            logging.warning(f"Limit Discorda, wstrzymanie wysyłki na {wait:.1f}s")
+        elif response.ok:
+            with self.conn:
+                self.conn.executemany(
+                    'UPDATE discord_outbox SET delivered_at = ?, error = NULL WHERE id = ?',
+                    [(time.time(), row_id) for row_id, _, _ in batch]
+                )
+            self.sent_messages += 1
+            self.sent_embeds += len(batch)
+            logging.info(f"Wysłano na Discord {len(batch)} okazji w jednej wiadomości")
+        else:
+            error = f"{response.status_code} {response.text[:200]}"
+            logging.error(f"Discord odrzucił wiadomość: {error}")
+            # 4xx (poza 429) oznacza błędną treść - ponawianie nic nie da
+            self._retry_later(batch, error, permanent=400 <= response.status_code < 500)
+
+    async def flush(self):
+        """Wysyła wszystko, co jest już gotowe do wysyłki."""
+        while True:
+            batch = self._due_batch()
+            if not batch:
+                return
+            await self._send(batch)
+
+    async def run(self):
+        if not self.enabled:
+            return
+        while True:
+            self._wakeup.clear()
+            batch = self._due_batch()
+            if batch:
+                await self._send(batch)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_due_in())
+            except asyncio.TimeoutError:
+                continue
+            # Krótkie okno, żeby okazje z jednej paczki trafiły do jednej wiadomości
+            await asyncio.sleep(self.batch_window)
@@ -0,0 +1,117 @@
+"""Jedyne miejsce parsowania tekstów Otomoto na liczby (wzorce kompilowane raz)."""
+import re
+
+YEAR_RE = re.compile(r'\b(19\d{2}|20[0-4]\d)\b')
+LABELED_YEAR_RE = re.compile(r'(?:Rok produkcji|Rocznik)[:\s]*(19\d{2}|20[0-4]\d)')
+# Liczba z grupowaniem tysięcy spacjami (także twardymi), np. "45 900". Lewa granica
+# nie pozwala zacząć w środku innej liczby ("2019 125 000 km" to nie 19 125 000 km).
+_NUMBER = r'(?<!\d)(\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)'
+NUMBER_RE = re.compile(_NUMBER)
+PRICE_RE = re.compile(_NUMBER + r'(?:[.,](\d{1,2}))?\s*(PLN|EUR|zł)', re.IGNORECASE)
+MILEAGE_LABEL_RE = re.compile(r'Przebieg[:\s]*' + _NUMBER + r'\s*km', re.IGNORECASE)
+MILEAGE_RE = re.compile(_NUMBER + r'\s*km\b')
+ENGINE_RE = re.compile(_NUMBER + r'\s*cm(?:3|³)', re.IGNORECASE)
+# "KM" wielkimi literami to konie mechaniczne - "km" to kilometry
+POWER_RE = re.compile(_NUMBER + r'\s*KM\b')
+MAKE_RE = re.compile(r'^Marka(?: pojazdu)?[:\s]+(.+)$', re.IGNORECASE | re.MULTILINE)
+MODEL_RE = re.compile(r'^Model(?: pojazdu)?[:\s]+(.+)$', re.IGNORECASE | re.MULTILINE)
+_SPACES_RE = re.compile(r'\s+')
+
+_CURRENCIES = {'pln': 'PLN', 'zł': 'PLN', 'eur': 'EUR'}
+
+
+def _to_int(digits):
+    digits = _SPACES_RE.sub('', digits)
+    return int(digits) if digits.isdigit() else None
+
+
+def parse_price_grosze(text):
+    """'45 900,50 PLN' -> (4590050, 'PLN'): kwota w groszach (centach dla EUR)."""
+    match = PRICE_RE.search(text or '')
+    if not match:
+        return None, None
+    units = _to_int(match.group(1))
+    if units is None:
+        return None, None
+    return units * 100 + int((match.group(2) or '0').ljust(2, '0')), _CURRENCIES[match.group(3).lower()]
+
+
+def amount_to_grosze(value):
+    """Kwota z JSON-a Otomoto (liczba lub tekst, np. '45900.00') w groszach."""
+    try:
+        return round(float(str(value).replace(' ', '').replace(',', '.')) * 100)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_price(units, currency):
+    """Formatuje kwotę tak, jak wyświetla ją Otomoto (np. '45 900 PLN')."""
+    return f"{units:,}".replace(',', ' ') + f" {currency or 'PLN'}"
+
+
+def parse_number(text):
+    """Pierwsza liczba w tekście, np. '12 000 km' -> 12000."""
+    match = NUMBER_RE.search(str(text or ''))
+    return _to_int(match.group(1)) if match else None
+
+
+def parse_year(text):
+    match = YEAR_RE.search(str(text or ''))
+    return int(match.group(1)) if match else None
+
+
+def parse_detail_year(*texts):
+    """Rocznik ze strony ogłoszenia: najpierw "Rok produkcji: ...", potem dowolny rok w tekstach."""
+    for pattern in (LABELED_YEAR_RE, YEAR_RE):
+        for text in texts:
+            match = pattern.search(text or '')
+            if match:
+                return int(match.group(1))
+    return None
+
+
+def parse_mileage(text):
+    """Przebieg w km z tekstu parametrów, np. 'Przebieg: 12 000 km'."""
+    text = text or ''
+    match = MILEAGE_LABEL_RE.search(text) or MILEAGE_RE.search(text)
+    return _to_int(match.group(1)) if match else None
+
+
+def parse_engine_capacity(text):
+    """Pojemność silnika w cm3, np. '689 cm3'."""
+    match = ENGINE_RE.search(text or '')
+    return _to_int(match.group(1)) if match else None
+
+
+def parse_power(text):
+    """Moc w KM, np. 'Moc: 73 KM'."""
+    match = POWER_RE.search(text or '')
+    return _to_int(match.group(1)) if match else None
+
+
+def parse_make_model(title, parameters=''):
+    """Marka i model (małymi literami) z parametrów, a w razie braku z tytułu."""
+    make_match = MAKE_RE.search(parameters or '')
+    model_match = MODEL_RE.search(parameters or '')
+    words = (title or '').split()
+    make = make_match.group(1).strip() if make_match else (words[0] if words else '')
+    model = model_match.group(1).strip() if model_match else (words[1] if len(words) > 1 else '')
+    return make.lower() or None, model.lower() or None
+
+
+def listing_features(listing, details=None):
+    """Cechy do wyceny z już sparsowanych pól `Listing` i `ListingDetails` (cena w jednostkach waluty)."""
+    make, model = parse_make_model(listing.title)
+    if details is not None:
+        make, model = details.make or make, details.model or model
+    return {
+        'make': make,
+        'model': model,
+        'price': listing.price_units,
+        'currency': listing.currency,
+        'year': listing.year or (details.year if details is not None else None),
+        # Strona szczegółów jest dokładniejsza niż etykiety na liście wyników
+        'mileage': (details.mileage if details is not None else None) or listing.mileage,
+        'engine_capacity': (details.engine_capacity if details is not None else None) or listing.engine_capacity,
+        'power': (details.power if details is not None else None) or listing.power,
+    }
@@ -0,0 +1,441 @@
+import time
+import random
+import asyncio
+import logging
+
+from config import (
+    MONITORED_URLS,
+    VALUATION_ENABLED, VALUATION_REFIT_INTERVAL, GEMINI_CONCURRENCY, GEMINI_BATCH_MAX_SIZE,
+    PIPELINE_QUEUE_SIZE, DETAIL_STAGE_WORKERS, DETAIL_POOL_SIZE,
+    SCAN_CONCURRENCY, SCAN_TIMEOUT, URL_SETTINGS, PAGINATION_MAX_PAGES, DEDUP_ENABLED, WORKER_HEARTBEAT
+)
+from database import STAGE_DETAILS, STAGE_VALUATION, STAGE_ANALYSIS, STAGE_NOTIFY, STAGE_DONE
+from scraper import fetch_new_results, fetch_details_batch
+from analyzer import check_bargains_gemini
+from notifier import DiscordNotifier, build_embed
+from valuation import PriceModel, prescreen
+from scheduler import PollScheduler
+from dedup import DedupIndex, fetch_image_hash
+from models import ListingDetails
+import metrics
+
+
+
+def _url_setting(url, key, default):
+    return URL_SETTINGS.get(url, {}).get(key, default)
+
+
+async def _take_batch(queue, max_size):
+    """Czeka na pierwszy element kolejki i dobiera te, które już czekają (do `max_size`)."""
+    batch = [await queue.get()]
+    while len(batch) < max_size:
+        try:
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+
+def _task_done(queue, count):
+    """Oznacza `count` elementów kolejki jako przetworzone (`queue.join()` w trybie --once)."""
+    for _ in range(count):
+        queue.task_done()
+
+
+class Pipeline:
+    """Potok bota: skanowanie → szczegóły → wycena → analiza AI → powiadomienie.
+
+    Etapy działają niezależnie i są połączone ograniczonymi kolejkami, więc
+    wolne wywołanie Gemini czy Discorda nie wstrzymuje skanowania ani innych
+    ogłoszeń, a pełna kolejka spowalnia etap przed nią (backpressure).
+    Po każdym etapie postęp trafia do bazy (`stage`), a przy starcie przerwane
+    ogłoszenia wracają do właściwej kolejki. Powiadomienia trafiają do trwałej
+    kolejki Discorda z kluczem, więc wznowienie nie wyśle ich drugi raz.
+
+    Z `worker` (tryb wielu workerów) potok skanuje tylko swoją część wyszukiwań
+    i przetwarza wyłącznie ogłoszenia, które wziął w dzierżawę.
+
+    `run(once=True)` skanuje każde wyszukiwanie raz, czeka na opróżnienie
+    wszystkich etapów i wysłanie powiadomień, po czym kończy (np. z crona).
+    """
+
+    def __init__(self, store, browser, worker=None):
+        self.store = store
+        self.browser = browser
+        self.worker = worker
+        self.price_model = PriceModel()
+        self.notifier = DiscordNotifier(path=store.path)
+        self.dedup = DedupIndex(path=store.path) if DEDUP_ENABLED else None
+        self.details_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self.valuation_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self.analysis_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self.notify_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        self.queues = {
+            STAGE_DETAILS: self.details_queue,
+            STAGE_VALUATION: self.valuation_queue,
+            STAGE_ANALYSIS: self.analysis_queue,
+            STAGE_NOTIFY: self.notify_queue,
+        }
+
+    async def run(self, once=False):
+        if once:
+            return await self._run_once()
+        workers = [self._resume(), self._scrape_loop(), self._valuation_worker(), self._notify_worker(),
+                   self.notifier.run(), metrics.run_exporter(self._update_gauges)]
+        workers += [self._details_worker() for _ in range(DETAIL_STAGE_WORKERS)]
+        workers += [self._analysis_worker() for _ in range(GEMINI_CONCURRENCY)]
+        if self.worker:
+            workers.append(self._lease_loop())
+        await asyncio.gather(*workers)
+
+    async def _run_once(self):
+        workers = [self._valuation_worker(), self._notify_worker()]
+        workers += [self._details_worker() for _ in range(DETAIL_STAGE_WORKERS)]
+        workers += [self._analysis_worker() for _ in range(GEMINI_CONCURRENCY)]
+        tasks = [asyncio.create_task(worker) for worker in workers]
+        try:
+            if self.worker:
+                await self._claim_orphans()
+            await self._resume()
+            await self._scan_once()
+            # Etapy po kolei: zadanie przechodzi do następnej kolejki, zanim zostanie oznaczone jako gotowe
+            for queue in (self.details_queue, self.valuation_queue, self.analysis_queue, self.notify_queue):
+                await queue.join()
+            if self.notifier.enabled:
+                await self.notifier.flush()
+                unsent = self.notifier.pending_count()
+                if unsent:
+                    logging.warning(f"{unsent} powiadomień czeka na ponowienie - wyślą się przy kolejnym uruchomieniu")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _update_gauges(self):
+        oldest = self.store.oldest_pending_at()
+        metrics.set_gauge('oldest_pending_age_seconds', time.time() - oldest if oldest else 0)
+        for stage, queue in self.queues.items():
+            metrics.set_gauge('queue_size', queue.qsize(), stage=stage)
+
+    async def _resume(self):
+        # Worker przejmuje przerwane ogłoszenia przez dzierżawy w `_lease_loop`
+        if self.worker:
+            return
+        pending = self.store.pending_listings()
+        if pending:
+            logging.info(f"Wznawianie {len(pending)} przerwanych ogłoszeń z poprzedniego uruchomienia")
+        await self._enqueue_pending(pending)
+
+    async def _enqueue_pending(self, pending):
+        for stage, listing, details, deal_type, analysis, note in pending:
+            job = {'listing': listing, 'details': details or ListingDetails(),
+                   'deal_type': deal_type, 'analysis': analysis, 'note': note or ''}
+            await self.queues.get(stage, self.details_queue).put(job)
+
+    async def _lease_loop(self):
+        """Tryb workera: heartbeat, odnawianie dzierżaw i przejmowanie porzuconych ogłoszeń."""
+        while True:
+            try:
+                self.worker.heartbeat()
+                await self._claim_orphans()
+            except Exception as e:
+                logging.error(f"Błąd heartbeatu workera: {e}")
+            await asyncio.sleep(WORKER_HEARTBEAT)
+
+    async def _claim_orphans(self):
+        # Tylko tyle, ile zmieści się w kolejkach - resztę wezmą inne workery
+        room = PIPELINE_QUEUE_SIZE - max(queue.qsize() for queue in self.queues.values())
+        claimed = self.worker.claim_orphans(room) if room > 0 else []
+        if claimed:
+            logging.info(f"Przejęto {len(claimed)} przerwanych ogłoszeń")
+            await self._enqueue_pending(self.store.pending_listings(claimed))
+
+    # --- Etap 1: skanowanie stron wyników ---
+
+    @metrics.timed('scan_seconds')
+    async def _scan_url(self, target_url, slot, warm_up):
+        timeout = _url_setting(target_url, 'timeout', SCAN_TIMEOUT)
+        listings = await asyncio.wait_for(
+            fetch_new_results(
+                self.browser, target_url, self.store.seen_ids, self.store.get_watermark(target_url),
+                slot=slot, timeout=timeout, max_pages=1 if warm_up else PAGINATION_MAX_PAGES
+            ),
+            timeout
+        )
+        # Od tego miejsca nie ma `await` aż do kolejkowania, więc sprawdzenie nowości
+        # i zapis kandydatów są atomowe względem równoległych skanów innych URL-i:
+        # ogłoszenie widoczne w kilku nakładających się wyszukiwaniach trafi dalej raz.
+        listings = list({l.id: l for l in listings}.values())
+        metrics.inc('listings_seen_total', len(listings))
+
+        new_ids = set(self.store.filter_new([l.id for l in listings]))
+        new_listings = [l for l in reversed(listings) if l.id in new_ids]
+        price_drops = self.store.save_listings([l for l in listings if l.id not in new_ids])
+
+        if warm_up:
+            self.store.save_listings(new_listings, stage=STAGE_DONE)
+            self.store.update_watermark(target_url, [l.id for l in listings])
+            return
+
+        candidates = []
+        skipped = []
+        for listing in new_listings:
+            if not listing.is_today:
+                logging.info(f"Pominięto starą ofertę: {listing.title}")
+                skipped.append(listing)
+                continue
+
+            logging.info(f"Pobieranie szczegółów nowej oferty: {listing.title} (Rocznik: {listing.year_text})")
+            candidates.append(listing)
+        self.store.save_listings(skipped, stage=STAGE_DONE)
+        self.store.save_listings(candidates, stage=STAGE_DETAILS, source_url=target_url)
+        # Watermark dopiero po zapisie - inaczej niezapisane ogłoszenia uchodziłyby w kolejnym skanie za stare
+        self.store.update_watermark(target_url, [l.id for l in listings])
+        metrics.inc('listings_new_total', len(candidates))
+
+        if self.worker:
+            # Ogłoszenie widoczne też w wyszukiwaniach innych workerów trafia dalej tylko u tego, kto je przejął;
+            # obniżka ceny zmienia etap dopiero po przejęciu, żeby nie nadpisać cudzego ogłoszenia w potoku
+            claimed = self.worker.claim([l.id for l in candidates])
+            candidates = [l for l in candidates if str(l.id) in claimed]
+            claimed = self.worker.claim([l.id for l, _, _ in price_drops], include_done=True)
+            price_drops = [drop for drop in price_drops if str(drop[0].id) in claimed]
+
+        jobs = [{'listing': l, 'details': ListingDetails(), 'deal_type': None, 'analysis': None, 'note': '',
+                 'is_new': True} for l in candidates]
+
+        # Znane ogłoszenia, którym spadła cena, wracają do analizy
+        for listing, old_price, new_price in price_drops:
+            logging.info(f"Obniżka ceny: {listing.title} {old_price} -> {new_price}")
+            note = f"Obniżka ceny z {old_price} na {new_price}.\n"
+            self.store.checkpoint(listing.id, STAGE_DETAILS, note=note)
+            jobs.append({'listing': listing, 'details': ListingDetails(), 'deal_type': None,
+                         'analysis': None, 'note': note})
+
+        for job in jobs:
+            await self.details_queue.put(job)
+
+    async def _scrape_loop(self):
+        """Skanuje wyszukiwania równolegle, każde według własnego harmonogramu.
+
+        SCAN_CONCURRENCY skanerów pobiera z kolejki URL-e, których termin minął;
+        każdy skaner ma własny kontekst przeglądarki, a błąd lub przekroczenie
+        czasu jednego URL-a nie wpływa na pozostałe.
+        """
+        next_due = {url: 0.0 for url in MONITORED_URLS}
+        scheduled = set()
+        scan_queue = asyncio.Queue()
+        schedule = PollScheduler(self.store, MONITORED_URLS)
+
+        async def scanner(slot):
+            while True:
+                target_url = await scan_queue.get()
+                # Rozgrzewka każdego wyszukiwania, którego jeszcze nigdy nie skanowano (także
+                # dopisanego do istniejącej bazy) - restart nie powtarza skanu początkowego
+                warm_up = self.store.first_scan_at(target_url) is None
+                try:
+                    await self._try_scan(target_url, slot, warm_up)
+                finally:
+                    if warm_up and self.store.first_scan_at(target_url) is not None:
+                        logging.info(f"Skan początkowy gotowy. Zignorowano obecne oferty, od teraz tylko NOWE wrzutki: {target_url}")
+                    if 'interval' in URL_SETTINGS.get(target_url, {}):
+                        low, high = URL_SETTINGS[target_url]['interval']
+                        wait_seconds = random.randint(low * 60, high * 60)
+                    else:
+                        wait_seconds = schedule.next_interval(target_url)
+                    next_due[target_url] = time.time() + wait_seconds
+                    scheduled.discard(target_url)
+                    logging.info(
+                        f"Następne sprawdzenie za {wait_seconds // 60} minut i {wait_seconds % 60} sekund: {target_url}"
+                    )
+
+        scanners = [asyncio.create_task(scanner(slot)) for slot in range(SCAN_CONCURRENCY)]
+        try:
+            while True:
+                now = time.time()
+                # Worker pomija wyszukiwania przypisane innym (podział zmienia się z ich liczbą)
+                owned = [url for url in next_due if not self.worker or self.worker.owns(url)]
+                for target_url in owned:
+                    if next_due[target_url] <= now and target_url not in scheduled:
+                        scheduled.add(target_url)
+                        scan_queue.put_nowait(target_url)
+                waiting = [next_due[url] for url in owned if url not in scheduled]
+                await asyncio.sleep(min(max(min(waiting, default=now + 1) - now, 0.5), 30))
+        finally:
+            for task in scanners:
+                task.cancel()
+
+    async def _try_scan(self, target_url, slot, warm_up):
+        """Skan jednego URL-a; błąd lub limit czasu nie przerywa pozostałych."""
+        try:
+            await self._scan_url(target_url, slot, warm_up)
+        except asyncio.TimeoutError:
+            logging.error(f"Przekroczono limit czasu skanu: {target_url}")
+        except Exception as e:
+            logging.error(f"Problem z pobraniem strony Otomoto ({target_url}): {e}")
+
+    async def _scan_once(self):
+        """Jeden skan każdego (własnego) wyszukiwania, SCAN_CONCURRENCY naraz."""
+        pending = [url for url in MONITORED_URLS if not self.worker or self.worker.owns(url)]
+
+        async def scanner(slot):
+            while pending:
+                target_url = pending.pop(0)
+                warm_up = self.store.first_scan_at(target_url) is None
+                await self._try_scan(target_url, slot, warm_up)
+                if warm_up and self.store.first_scan_at(target_url) is not None:
+                    logging.info(f"Skan początkowy gotowy. Zignorowano obecne oferty - kolejne uruchomienie przeanalizuje NOWE wrzutki: {target_url}")
+
+        await asyncio.gather(*(scanner(slot) for slot in range(min(SCAN_CONCURRENCY, len(pending)))))
+
+    # --- Etap 2: szczegóły ogłoszeń ---
+
+    async def _drop_reposts(self, jobs):
+        """Odsiewa reposty nowych ogłoszeń przed pobraniem szczegółów.
+
+        Repost bez obniżki ceny kończy się od razu; z niższą ceną idzie dalej
+        z notatką, jak obniżka znanego ogłoszenia.
+        """
+        new_jobs = [j for j in jobs if j.get('is_new')]
+        if self.dedup is None or not new_jobs:
+            return jobs
+        image_hashes = await asyncio.gather(*(fetch_image_hash(j['listing'].image_url) for j in new_jobs))
+
+        kept = [j for j in jobs if not j.get('is_new')]
+        for job, image_hash in zip(new_jobs, image_hashes):
+            listing = job['listing']
+            original = self.dedup.check(listing, image_hash)
+            if original is None:
+                kept.append(job)
+                continue
+
+            price = listing.price_units
+            # Obniżka tylko w tej samej walucie - 9 000 EUR to nie mniej niż 30 000 PLN
+            if (price and original['price'] and listing.currency == original['currency']
+                    and price < original['price']):
+                logging.info(
+                    f"Repost z niższą ceną: {listing.title} {original['price']} -> {price} "
+                    f"(wcześniej ogłoszenie {original['listing_id']})"
+                )
+                job['note'] += f"Ponownie wystawione ogłoszenie, cena obniżona z {original['price']} na {price}.\n"
+                self.store.checkpoint(listing.id, STAGE_DETAILS, note=job['note'])
+                kept.append(job)
+            else:
+                logging.info(
+                    f"Pominięto repost: {listing.title} - {listing.price_text} "
+                    f"(wcześniej ogłoszenie {original['listing_id']})"
+                )
+                metrics.inc('reposts_skipped_total')
+                self.store.checkpoint(listing.id, STAGE_DONE)
+        return kept
+
+    async def _details_worker(self):
+        while True:
+            batch = await _take_batch(self.details_queue, DETAIL_POOL_SIZE)
+            try:
+                jobs = await self._drop_reposts(batch)
+                if not jobs:
+                    continue
+                details_by_url = await fetch_details_batch(self.browser, [j['listing'].url for j in jobs])
+                for job in jobs:
+                    listing = job['listing']
+                    job['details'] = details_by_url.get(listing.url) or ListingDetails()
+                    # Aktualizuj rocznik z detali strony, jeśli nie znaleziono na liście
+                    if listing.year is None and job['details'].year:
+                        listing.year = job['details'].year
+                        logging.info(f"Rocznik uzupełniony ze strony szczegółowej: {listing.year}")
+                    self.store.save_listings([listing], {listing.url: job['details']})
+                    self.store.checkpoint(listing.id, STAGE_VALUATION, details=job['details'])
+                    await self.valuation_queue.put(job)
+            except Exception as e:
+                logging.error(f"Błąd etapu szczegółów: {e}")
+            finally:
+                _task_done(self.details_queue, len(batch))
+
+    # --- Etap 3: lokalna wycena ---
+
+    async def _valuation_worker(self):
+        while True:
+            jobs = await _take_batch(self.valuation_queue, PIPELINE_QUEUE_SIZE)
+            try:
+                if not VALUATION_ENABLED:
+                    passed = jobs
+                else:
+                    if time.time() - self.price_model.fitted_at > VALUATION_REFIT_INTERVAL:
+                        self.price_model.fit(self.store.training_rows(exclude_ids=[j['listing'].id for j in jobs]))
+                    by_id = {j['listing'].id: j for j in jobs}
+                    details_by_url = {j['listing'].url: j['details'] for j in jobs}
+                    passed_listings, rejected, discounts = prescreen(
+                        self.price_model, [j['listing'] for j in jobs], details_by_url
+                    )
+                    for listing in rejected:
+                        logging.info(
+                            f"Pominięto po wycenie lokalnej: {listing.title} "
+                            f"(rabat {discounts[listing.id]:.0%}) - {listing.price_text}"
+                        )
+                        self.store.checkpoint(listing.id, STAGE_DONE)
+                    passed = [by_id[l.id] for l in passed_listings]
+
+                for job in passed:
+                    self.store.checkpoint(job['listing'].id, STAGE_ANALYSIS)
+                    await self.analysis_queue.put(job)
+            except Exception as e:
+                logging.error(f"Błąd etapu wyceny: {e}")
+            finally:
+                _task_done(self.valuation_queue, len(jobs))
+
+    # --- Etap 4: analiza AI ---
+
+    async def _analysis_worker(self):
+        while True:
+            # Ogłoszenia, które czekają razem, idą do Gemini jedną paczką
+            jobs = await _take_batch(self.analysis_queue, GEMINI_BATCH_MAX_SIZE)
+            try:
+                await self._analyze(jobs)
+            finally:
+                _task_done(self.analysis_queue, len(jobs))
+
+    async def _analyze(self, jobs):
+        try:
+            verdicts = await check_bargains_gemini([(j['listing'], j['details']) for j in jobs])
+        except Exception as e:
+            logging.error(f"Błąd etapu analizy ({len(jobs)} ogłoszeń): {e}")
+            return
+
+        for job in jobs:
+            listing = job['listing']
+            try:
+                deal_type, analysis = verdicts[str(listing.id)]
+                job['deal_type'], job['analysis'] = deal_type, analysis
+                metrics.inc('listings_analyzed_total')
+
+                if deal_type in ["GREAT DEAL", "BARGAIN"]:
+                    self.store.checkpoint(listing.id, STAGE_NOTIFY, deal_type=deal_type, analysis=analysis)
+                    await self.notify_queue.put(job)
+                else:
+                    logging.info(f"Pominięto słabą ofertę: {listing.title} [{deal_type}] - {listing.price_text}")
+                    self.store.checkpoint(listing.id, STAGE_DONE, deal_type=deal_type, analysis=analysis)
+            except Exception as e:
+                logging.error(f"Błąd etapu analizy dla {listing.title}: {e}")
+
+    # --- Etap 5: powiadomienia ---
+
+    async def _notify_worker(self):
+        while True:
+            job = await self.notify_queue.get()
+            listing = job['listing']
+            try:
+                logging.info(f"ZNALEZIONO OKAZJĘ! Wysyłam na Discord: {listing.title} [{job['deal_type']}] - {listing.price_text}")
+                embed = build_embed(
+                    title=listing.title, price=listing.price_text, year=listing.year_text,
+                    url=listing.url, image_url=listing.image_url,
+                    deal_type=job['deal_type'], analysis=job['note'] + job['analysis']
+                )
+                # Klucz chroni przed podwójnym powiadomieniem po wznowieniu; obniżka ceny ma nowy klucz
+                self.notifier.enqueue(embed, key=f"{listing.id}:{listing.price_text}")
+                metrics.inc('listings_notified_total')
+                self.store.checkpoint(listing.id, STAGE_DONE)
+            except Exception as e:
+                logging.error(f"Błąd etapu powiadomień dla {listing.title}: {e}")
+            finally:
+                self.notify_queue.task_done()
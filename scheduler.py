@@ -0,0 +1,103 @@
+import time
+import random
+import logging
+
+import numpy as np
+
+from config import (
+    INTERWAL_SPRAWDZANIA_MIN, INTERWAL_SPRAWDZANIA_MAX, TARGET_DETECTION_LATENCY, POLL_BUDGET_PER_HOUR,
+    MIN_POLL_INTERVAL, MAX_POLL_INTERVAL, POLL_JITTER, ARRIVAL_WINDOW_DAYS, ARRIVAL_PRIOR_DAYS,
+    SCHEDULER_REFRESH
+)
+
+DAY = 24 * 3600
+
+
+def hourly_rates(timestamps, now, observed_since=None, window_days=ARRIVAL_WINDOW_DAYS,
+                 prior_days=ARRIVAL_PRIOR_DAYS):
+    """Szacuje natężenie napływu ogłoszeń (na godzinę) dla każdej godziny doby.
+
+    Estymator Poissona liczony osobno dla 24 godzin czasu lokalnego, ściągnięty
+    w stronę średniej dobowej (prior o wadze `prior_days` dni), żeby godziny
+    z małą liczbą obserwacji nie dawały zerowych ani skrajnych wartości.
+    """
+    start = now - window_days * DAY
+    if observed_since is not None:
+        start = max(start, observed_since)
+    days = max((now - start) / DAY, 1 / 24)
+
+    ts = np.asarray(timestamps, dtype=float)
+    ts = ts[(ts >= start) & (ts <= now)]
+    offset = time.localtime(now).tm_gmtoff
+    hours = ((ts + offset) // 3600 % 24).astype(int)
+    counts = np.bincount(hours, minlength=24).astype(float)
+
+    overall = counts.sum() / (24 * days)
+    return (counts + prior_days * overall) / (days + prior_days)
+
+
+def allocate_intervals(rates, budget_per_hour=POLL_BUDGET_PER_HOUR, target_latency=TARGET_DETECTION_LATENCY * 60,
+                       min_interval=MIN_POLL_INTERVAL * 60, max_interval=MAX_POLL_INTERVAL * 60):
+    """Dobiera odstępy między skanami (s) dla wyszukiwań o natężeniach `rates` (na godzinę).
+
+    Przy skanie co T sekund ogłoszenie czeka średnio T/2. Minimalizacja średniego
+    opóźnienia ważonego liczbą ogłoszeń przy stałej liczbie skanów B daje
+    T_i ∝ 1/sqrt(λ_i). Liczba skanów jest tak dobrana, żeby średnie opóźnienie
+    wyniosło `target_latency`, ale nie przekracza budżetu `budget_per_hour`.
+    """
+    rates = np.maximum(np.asarray(rates, dtype=float), 1e-6)
+    sqrt_rates = np.sqrt(rates)
+    total_sqrt = sqrt_rates.sum()
+    needed = total_sqrt ** 2 / (2 * (target_latency / 3600) * rates.sum())
+    polls_per_hour = min(budget_per_hour, needed)
+    intervals = total_sqrt / (polls_per_hour * sqrt_rates) * 3600
+    return np.clip(intervals, min_interval, max_interval)
+
+
+class PollScheduler:
+    """Adaptacyjny harmonogram skanów wyszukiwań na podstawie historii napływu ogłoszeń.
+
+    Gorące wyszukiwania (i godziny) są skanowane częściej, martwe rzadziej,
+    a łączna liczba skanów mieści się w POLL_BUDGET_PER_HOUR. Do każdego
+    odstępu dodawany jest losowy jitter (ochrona przed wykryciem bota).
+    """
+
+    def __init__(self, store, urls):
+        self.store = store
+        self.urls = list(urls)
+        self.intervals = {}
+        self.refreshed_at = 0.0
+
+    def refresh(self, now=None):
+        now = now or time.time()
+        since = now - ARRIVAL_WINDOW_DAYS * DAY
+        hour = time.localtime(now).tm_hour
+        rates = []
+        observed = 0
+        for url in self.urls:
+            timestamps = self.store.arrival_times(url, since)
+            observed += len(timestamps)
+            # Ogłoszenia sprzed zapisu stanu URL-a też się liczą do okresu obserwacji
+            observed_since = min([t for t in [self.store.first_scan_at(url), *timestamps] if t is not None],
+                                 default=None)
+            rates.append(hourly_rates(timestamps, now, observed_since)[hour])
+
+        self.refreshed_at = now
+        if not observed:
+            self.intervals = {}
+            return
+
+        intervals = allocate_intervals(rates)
+        self.intervals = dict(zip(self.urls, intervals))
+        for url, rate, interval in zip(self.urls, rates, intervals):
+            logging.info(f"Harmonogram: {rate:.2f} ogł./h o {hour}:00 -> skan co {interval / 60:.1f} min: {url}")
+
+    def next_interval(self, url):
+        """Liczba sekund do następnego skanu wyszukiwania."""
+        if time.time() - self.refreshed_at > SCHEDULER_REFRESH:
+            self.refresh()
+        interval = self.intervals.get(url)
+        if interval is None:
+            # Brak historii - stały losowy odstęp jak dotychczas
+            return random.randint(INTERWAL_SPRAWDZANIA_MIN * 60, INTERWAL_SPRAWDZANIA_MAX * 60)
+        return int(interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
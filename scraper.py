@@ -1,124 +1,161 @@
 import time
 import re
+import random
+import asyncio
 import logging
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 
+from config import (
+    FETCH_MODE, DETAIL_POOL_SIZE, DOMAIN_CONCURRENCY, DEFAULT_DOMAIN_CONCURRENCY, DETAIL_DELAY_RANGE,
+    PAGINATION_MAX_PAGES, PAGINATION_STOP_RUN
+)
+import metrics
+import snapshots
+from http_fetcher import fetch_html, parse_results_html, parse_details_html
+from models import Listing, ListingDetails, UNKNOWN_TITLE
+from parsing import parse_year, parse_price_grosze, parse_mileage, parse_engine_capacity, parse_power
 
-def extract_from_otomoto(page):
+
+# Regex obsługuje wszystkie polskie formy odmiany:
+# minuta/minuty/minut temu, godzina/godziny/godzin temu, sekunda/sekundy/sekund temu
+TODAY_RE = re.compile(
+    r'dzisiaj|'
+    r'\d+\s+minut[ay]?\s+temu|'
+    r'\d+\s+godzin[ya]?\s+temu|'
+    r'\d+\s+sekund[ay]?\s+temu'
+)
+
+ARTICLE_SELECTOR = 'article[data-testid="listing-ad"], article[data-id]'
+
+# Strona szczegółów jest gotowa, gdy pojawi się którakolwiek z sekcji z danymi
+DETAIL_READY_SELECTOR = (
+    '[data-testid="main-details-section"], '
+    'div[data-cy="ad_description"], '
+    'div[data-testid="content-description-section"], '
+    '[data-testid="content-highlight-details-section"]'
+)
+DETAIL_READY_TIMEOUT_MS = 10000
+
+# Jeden skrypt w przeglądarce zbiera surowe dane wszystkich ogłoszeń naraz,
+# zamiast kilkudziesięciu wywołań locatorów na każdy artykuł.
+_ARTICLES_JS = """
+(selector) => {
+    const text = (el) => (el && el.innerText ? el.innerText.trim() : "");
+    const labelSelectors = [
+        '[data-testid="ad-labels"]',
+        '[data-id="ad-labels"]',
+        '.ad-labels',
+        '[data-testid="listing-ad-labels"]',
+    ];
+    return Array.from(document.querySelectorAll(selector)).map((article) => {
+        const h3s = Array.from(article.querySelectorAll("h3"));
+        const spans = Array.from(article.querySelectorAll("span"));
+        const hasText = (el, needle) => text(el).toLowerCase().includes(needle);
+        const priceElem =
+            h3s.find((el) => hasText(el, "pln")) ||
+            h3s.find((el) => hasText(el, "eur")) ||
+            spans.find((el) => hasText(el, "pln")) ||
+            h3s[0];
+        const link = article.querySelector("a");
+        const img = article.querySelector("img");
+        return {
+            id: article.getAttribute("data-id") || article.getAttribute("id") || "",
+            text: article.innerText || "",
+            title: text(article.querySelector("h1 a, h2 a, h6 a, h2")),
+            has_title: !!article.querySelector("h1 a, h2 a, h6 a, h2"),
+            url: link ? (link.getAttribute("href") || "") : "",
+            price: text(priceElem),
+            labels: Array.from(article.querySelectorAll(labelSelectors[0])).map(text),
+            label_containers: labelSelectors.map((sel) => text(article.querySelector(sel))),
+            image_url: img ? (img.getAttribute("src") || img.getAttribute("data-src") || "") : "",
+        };
+    });
+}
+"""
+
+
+def parse_raw_article(raw):
+    """Zamienia surowe dane artykułu z przeglądarki na `Listing`."""
+    listing_id = raw.get('id')
+    if not listing_id:
+        return None
+
+    is_today = bool(TODAY_RE.search((raw.get('text') or '').lower()))
+
+    title = raw.get('title', '') if raw.get('has_title') else UNKNOWN_TITLE
+    price, currency = parse_price_grosze(raw.get('price'))
+
+    year = None
+    # Strategia 1: pojedyncze etykiety, strategia 2: kontenery etykiet,
+    # strategia 3: fallback - rok w tytule ogłoszenia
+    for text in [*raw.get('labels', []), *raw.get('label_containers', []), title]:
+        year = parse_year(text)
+        if year:
+            break
+
+    # Etykiety rozdzielone nową linią - spacja skleiłaby np. "2019" i "125 000 km" w jedną liczbę
+    labels = '\n'.join(raw.get('labels', []))
+    return Listing(
+        id=listing_id, title=title, url=raw.get('url', ''), image_url=raw.get('image_url', ''),
+        price=price, currency=currency, year=year,
+        mileage=parse_mileage(labels), engine_capacity=parse_engine_capacity(labels), power=parse_power(labels),
+        is_today=is_today, summary=' '.join(raw.get('labels', [])),
+    )
+
+
+async def extract_from_otomoto(page):
     """Pobiera listę ogłoszeń z bieżącej strony Otomoto."""
     listings = []
     try:
-        page.wait_for_selector('article[data-testid="listing-ad"], article[data-id]', timeout=15000)
+        await page.wait_for_selector(ARTICLE_SELECTOR, timeout=15000)
     except KeyboardInterrupt:
         raise
     except Exception:
         logging.warning("Nie znaleziono ogłoszeń Otomoto w zadanym czasie. Możliwa kontrola antybotowa.")
         return listings
 
-    articles = page.locator('article[data-testid="listing-ad"], article[data-id]').all()
-    for article in articles:
+    started = time.perf_counter()
+    raw_articles = await page.evaluate(_ARTICLES_JS, ARTICLE_SELECTOR)
+    for raw in raw_articles:
         try:
-            listing_id = article.get_attribute('data-id') or article.get_attribute('id')
-            if not listing_id:
-                continue
-
-            is_today = False
-            article_text = article.inner_text().lower()
-            # Regex obsługuje wszystkie polskie formy odmiany:
-            # minuta/minuty/minut temu, godzina/godziny/godzin temu, sekunda/sekundy/sekund temu
-            if re.search(
-                r'dzisiaj|'
-                r'\d+\s+minut[ay]?\s+temu|'
-                r'\d+\s+godzin[ya]?\s+temu|'
-                r'\d+\s+sekund[ay]?\s+temu',
-                article_text
-            ):
-                is_today = True
-
-            title_elem = article.locator('h1 a, h2 a, h6 a, h2').first
-            title = title_elem.inner_text().strip() if title_elem.count() > 0 else "Nieznany pojazd (Otomoto)"
-
-            url_elem = article.locator('a').first
-            url = url_elem.get_attribute('href') if url_elem.count() > 0 else ""
-
-            price_text = "Nieznana cena"
-            for loc in [
-                article.locator("h3:has-text('PLN')").first,
-                article.locator("h3:has-text('EUR')").first,
-                article.locator("span:has-text('PLN')").first,
-                article.locator("h3").first,
-            ]:
-                if loc.count() > 0:
-                    p = loc.inner_text().strip()
-                    if p:
-                        price_text = p
-                        break
-
-            year = "Nieznany rocznik"
-
-            # Strategia 1: indywidualne elementy [data-testid="ad-label"] (liczba pojedyncza)
-            label_items = article.locator('[data-testid="ad-labels"]').all()
-            for item in label_items:
-                try:
-                    item_text = item.inner_text().strip()
-                    match = re.search(r'\b(19\d{2}|20[0-4]\d)\b', item_text)
-                    if match:
-                        year = match.group(1)
-                        break
-                except Exception:
-                    continue
-
-            # Strategia 2: kontener ad-labels (jeśli strategia 1 nie znalazła)
-            if year == "Nieznany rocznik":
-                labels_selectors = [
-                    '[data-testid="ad-labels"]',
-                    '[data-id="ad-labels"]',
-                    '.ad-labels',
-                    '[data-testid="listing-ad-labels"]',
-                ]
-                for sel in labels_selectors:
-                    labels_elem = article.locator(sel).first
-                    if labels_elem.count() > 0:
-                        labels_text = labels_elem.inner_text().strip()
-                        match = re.search(r'\b(19\d{2}|20[0-4]\d)\b', labels_text)
-                        if match:
-                            year = match.group(1)
-                            break
-
-            # Strategia 3: fallback - szukaj roku w tytule ogłoszenia
-            if year == "Nieznany rocznik":
-                match = re.search(r'\b(19\d{2}|20[0-4]\d)\b', title)
-                if match:
-                    year = match.group(1)
-
-            image_url = ""
-            img_elem = article.locator('img').first
-            if img_elem.count() > 0:
-                image_url = img_elem.get_attribute('src') or img_elem.get_attribute('data-src') or ""
-
-            listings.append({
-                'id': listing_id, 'title': title, 'price': price_text,
-                'url': url, 'image_url': image_url, 'is_today': is_today,
-                'year': year
-            })
+            listing = parse_raw_article(raw)
+            if listing:
+                listings.append(listing)
         except KeyboardInterrupt:
             raise
         except Exception as e:
             logging.debug(f"Błąd parsowania elementu Otomoto: {e}")
 
+    elapsed = time.perf_counter() - started
+    metrics.observe('dom_parse_seconds', elapsed, kind='results')
+    await snapshots.archive_json(snapshots.KIND_RESULTS_JSON, page.url, raw_articles)
+    logging.debug(f"Sparsowano {len(listings)} ogłoszeń w {elapsed * 1000:.0f} ms")
     return listings
 
 
-def extract_listing_details(context, url):
-    """Otwiera stronę ogłoszenia i wyciąga szczegółowe parametry."""
-    details = {"description": "", "parameters": "", "highlights": "", "year": ""}
+async def extract_listing_details(context, url, page=None):
+    """Otwiera stronę ogłoszenia i wyciąga szczegółowe parametry.
+
+    Jeśli podano `page`, strona jest użyta ponownie i nie zostaje zamknięta.
+    """
+    texts = {"description": "", "parameters": "", "highlights": ""}
+    details = None
     if not url or not str(url).startswith('http'):
-        return details
+        return ListingDetails()
 
-    page = None
+    own_page = page is None
     try:
-        page = context.new_page()
-        page.goto(url, wait_until="domcontentloaded", timeout=30000)
-        time.sleep(2)
+        if own_page:
+            page = await context.new_page()
+        with metrics.timer('page_load_seconds', kind='details'):
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            try:
+                await page.wait_for_selector(DETAIL_READY_SELECTOR, timeout=DETAIL_READY_TIMEOUT_MS)
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                logging.debug(f"Sekcje szczegółów nie pojawiły się w czasie: {url}")
+        parse_started = time.perf_counter()
 
         # --- 1. Opis ---
         desc_locators = [
@@ -128,8 +165,8 @@ def extract_listing_details(context, url):
         ]
         for loc in desc_locators:
             elem = page.locator(loc).first
-            if elem.count() > 0:
-                details['description'] = elem.inner_text().strip()
+            if await elem.count() > 0:
+                texts['description'] = (await elem.inner_text()).strip()
                 break
 
         # --- 2. Highlights ---
@@ -140,33 +177,26 @@ def extract_listing_details(context, url):
         ]
         for sel in highlight_selectors:
             highlight_section = page.locator(sel).first
-            if highlight_section.count() > 0:
-                highlight_text = highlight_section.inner_text().strip()
+            if await highlight_section.count() > 0:
+                highlight_text = (await highlight_section.inner_text()).strip()
                 if highlight_text:
                     highlight_params.append(highlight_text)
                 break
 
         if highlight_params:
-            details['highlights'] = "\n".join(highlight_params)
+            texts['highlights'] = "\n".join(highlight_params)
 
         # --- 3. Main Details ---
         technical_params = []
-        try:
-            page.wait_for_selector('[data-testid="main-details-section"]', timeout=5000)
-        except KeyboardInterrupt:
-            raise
-        except Exception:
-            pass
-
         detail_section = page.locator('[data-testid="main-details-section"]').first
-        if detail_section.count() > 0:
-            details_list = detail_section.locator('[data-testid="detail"]').all()
+        if await detail_section.count() > 0:
+            details_list = await detail_section.locator('[data-testid="detail"]').all()
             for d in details_list:
-                label = d.get_attribute('aria-label')
+                label = await d.get_attribute('aria-label')
                 if label:
                     technical_params.append(label)
                 else:
-                    txt = d.inner_text().strip()
+                    txt = (await d.inner_text()).strip()
                     if txt and len(txt) < 200:
                         technical_params.append(txt)
 
@@ -178,8 +208,8 @@ def extract_listing_details(context, url):
         ]
         for sel in extra_selectors:
             extra_section = page.locator(sel).first
-            if extra_section.count() > 0:
-                extra_text = extra_section.inner_text().strip()
+            if await extra_section.count() > 0:
+                extra_text = (await extra_section.inner_text()).strip()
                 if extra_text:
                     extra_params.append(extra_text)
                 break
@@ -192,8 +222,8 @@ def extract_listing_details(context, url):
         ]
         for sel in combined_selectors:
             combined_section = page.locator(sel).first
-            if combined_section.count() > 0:
-                combined_text = combined_section.inner_text().strip()
+            if await combined_section.count() > 0:
+                combined_text = (await combined_section.inner_text()).strip()
                 if combined_text:
                     extra_params.append("--- SZCZEGÓŁY I WYPOSAŻENIE ---")
                     extra_params.append(combined_text)
@@ -201,14 +231,14 @@ def extract_listing_details(context, url):
 
         # --- 6. Fallback (keywords) ---
         if not technical_params and not highlight_params:
-            param_candidates = page.locator(
+            param_candidates = await page.locator(
                 '[class*="ooa-1y1j4sq"], [class*="e1kkw2jt0"], '
                 '.offer-params__item, '
                 'ul[data-testid="accordion-details-list"] li'
             ).all()
             for item in param_candidates:
                 try:
-                    text = item.inner_text().strip()
+                    text = (await item.inner_text()).strip()
                     if not text or len(text) > 150:
                         continue
                     if any(text in p for p in technical_params) or any(p in text for p in technical_params):
@@ -232,7 +262,7 @@ def extract_listing_details(context, url):
             all_params.extend(extra_params)
 
         if all_params:
-            details['parameters'] = "\n".join(all_params)
+            texts['parameters'] = "\n".join(all_params)
         else:
             param_locators = [
                 'ul[data-testid="accordion-details-list"]',
@@ -240,34 +270,19 @@ def extract_listing_details(context, url):
             ]
             for loc in param_locators:
                 elem = page.locator(loc).first
-                if elem.count() > 0:
-                    details['parameters'] = elem.inner_text().strip()
+                if await elem.count() > 0:
+                    texts['parameters'] = (await elem.inner_text()).strip()
                     break
 
-        # --- Ekstrakcja rocznika ze strony szczegółowej ---
-        extracted_year = ""
-        # Szukaj w highlights i parametrach
-        for text_source in [details['highlights'], details['parameters']]:
-            if text_source:
-                year_match = re.search(r'(?:Rok produkcji|Rocznik)[:\s]*(19\d{2}|20[0-4]\d)', text_source)
-                if year_match:
-                    extracted_year = year_match.group(1)
-                    break
-        # Fallback: szukaj dowolnego roku w parametrach
-        if not extracted_year:
-            for text_source in [details['highlights'], details['parameters']]:
-                if text_source:
-                    year_match = re.search(r'\b(19\d{2}|20[0-4]\d)\b', text_source)
-                    if year_match:
-                        extracted_year = year_match.group(1)
-                        break
-        details['year'] = extracted_year
+        # Rocznik, przebieg, pojemność i moc są parsowane raz, tutaj
+        details = ListingDetails.parse(**texts)
+        metrics.observe('dom_parse_seconds', time.perf_counter() - parse_started, kind='details')
 
         logging.info(
-            f"Pobrano szczegóły - Opis: {len(details['description'])} zn., "
-            f"Highlights: {len(details['highlights'])} zn., "
-            f"Parametry: {len(details['parameters'])} zn., "
-            f"Rocznik: {details['year'] or 'nie znaleziono'}"
+            f"Pobrano szczegóły - Opis: {len(details.description)} zn., "
+            f"Highlights: {len(details.highlights)} zn., "
+            f"Parametry: {len(details.parameters)} zn., "
+            f"Rocznik: {details.year or 'nie znaleziono'}"
         )
 
     except KeyboardInterrupt:
@@ -275,10 +290,157 @@ def extract_listing_details(context, url):
     except Exception as e:
         logging.error(f"Błąd podczas pobierania detali ogłoszenia {url}: {e}")
     finally:
-        if page and not page.is_closed():
+        if own_page and page and not page.is_closed():
             try:
-                page.close()
+                await page.close()
             except Exception:
                 pass
 
-    return details
+    # Po błędzie zwracamy to, co udało się zebrać
+    return details if details is not None else ListingDetails.parse(**texts)
+
+
+_domain_semaphores = {}
+
+
+def _fetch_page(kind, url):
+    """Pobiera HTML przez HTTP i zapisuje go w archiwum stron (jeśli włączone)."""
+    page_html = fetch_html(url)
+    snapshots.archive(kind, url, page_html)
+    return page_html
+
+
+def _domain_semaphore(url):
+    """Zwraca semafor ograniczający liczbę równoległych zapytań do domeny."""
+    domain = urlparse(url).netloc
+    if domain not in _domain_semaphores:
+        limit = DOMAIN_CONCURRENCY.get(domain, DEFAULT_DOMAIN_CONCURRENCY)
+        _domain_semaphores[domain] = asyncio.Semaphore(limit)
+    return _domain_semaphores[domain]
+
+
+async def fetch_results(browser, url, slot=0, timeout=60):
+    """Pobiera listę ogłoszeń ze strony wyników.
+
+    W trybie HTTP parsuje osadzony JSON, a przeglądarki używa tylko wtedy,
+    gdy parsowanie się nie powiedzie lub trafimy na stronę antybotową.
+    `slot` wybiera izolowany kontekst przeglądarki dla równoległych skanów.
+    """
+    if FETCH_MODE == "http":
+        async with _domain_semaphore(url):
+            page_html = await asyncio.to_thread(_fetch_page, snapshots.KIND_RESULTS, url)
+        listings = parse_results_html(page_html) if page_html else None
+        if listings is not None:
+            return listings
+        logging.info(f"Fallback do przeglądarki dla strony wyników: {url}")
+
+    async with browser.page(slot) as page:
+        with metrics.timer('page_load_seconds', kind='results'):
+            await page.goto(url, wait_until="domcontentloaded", timeout=timeout * 1000)
+        return await extract_from_otomoto(page)
+
+
+def page_url(url, page):
+    """Adres podanej strony wyników (parametr `page`, strona 1 bez parametru)."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != 'page']
+    if page > 1:
+        query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _is_old(listing_id, seen, watermark):
+    if listing_id in seen:
+        return True
+    # ID Otomoto rosną z czasem - ID nie większe od watermarku to ogłoszenie sprzed ostatniego skanu
+    return watermark is not None and listing_id.isdigit() and int(listing_id) <= watermark
+
+
+async def fetch_new_results(browser, url, seen_ids, watermark=None, slot=0, timeout=60,
+                            max_pages=PAGINATION_MAX_PAGES):
+    """Pobiera kolejne strony wyników (od najnowszych), aż trafi na serię znanych ogłoszeń.
+
+    `seen_ids(ids)` zwraca zbiór ID już zapisanych w bazie, a `watermark` to
+    największe ID widziane wcześniej dla tego wyszukiwania. Zwraca wszystkie
+    ogłoszenia z każdej pobranej strony (znane też - odświeżenie `last_seen`
+    i obniżki cen). Kolejna strona jest pobierana tylko, jeśli strona nie
+    kończy się serią PAGINATION_STOP_RUN starych ogłoszeń - wyróżnione
+    (starsze) ogłoszenia na górze strony nie przerywają więc skanu.
+    """
+    collected = []
+    run = 0
+    for page in range(1, max_pages + 1):
+        listings = await fetch_results(browser, page_url(url, page), slot=slot, timeout=timeout)
+        if not listings:
+            return collected
+        collected.extend(listings)
+        seen = seen_ids([l.id for l in listings])
+        for listing in listings:
+            run = run + 1 if _is_old(listing.id, seen, watermark) else 0
+        if run >= PAGINATION_STOP_RUN:
+            if page > 1:
+                logging.info(f"Przejrzano {page} stron wyników: {url}")
+            return collected
+
+    if max_pages > 1:
+        logging.warning(f"Osiągnięto limit {max_pages} stron bez znanych ogłoszeń - część mogła zostać pominięta: {url}")
+    return collected
+
+
+async def _fetch_details_http(url):
+    if not url or not str(url).startswith('http'):
+        return ListingDetails()
+    async with _domain_semaphore(url):
+        page_html = await asyncio.to_thread(_fetch_page, snapshots.KIND_DETAILS, url)
+        await asyncio.sleep(random.uniform(*DETAIL_DELAY_RANGE))
+    return parse_details_html(page_html) if page_html else None
+
+
+async def _fetch_details_browser(browser, urls, pool_size, results):
+    queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    async def worker():
+        while True:
+            try:
+                url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # Strona z puli na każde ogłoszenie - między ogłoszeniami kontekst może zostać wymieniony
+            async with _domain_semaphore(url), browser.page() as page:
+                results[url] = await extract_listing_details(None, url, page=page)
+                await snapshots.archive_json(snapshots.KIND_DETAILS_JSON, url, results[url].to_dict())
+                await asyncio.sleep(random.uniform(*DETAIL_DELAY_RANGE))
+
+    await asyncio.gather(*(worker() for _ in range(min(pool_size, len(urls)))))
+
+
+async def fetch_details_batch(browser, urls, pool_size=DETAIL_POOL_SIZE):
+    """Pobiera równolegle szczegóły wielu ogłoszeń.
+
+    Zwraca słownik {url: details}. W trybie HTTP strony są pobierane przez
+    współdzieloną sesję, a te, których nie udało się sparsować, trafiają do
+    ograniczonej puli stron przeglądarki. Limit na domenę pilnuje, żeby nie
+    zasypać serwisu zapytaniami.
+    """
+    results = {}
+    pending = list(dict.fromkeys(urls))
+    if not pending:
+        return results
+
+    started = time.perf_counter()
+    if FETCH_MODE == "http":
+        fetched = await asyncio.gather(*(_fetch_details_http(url) for url in pending))
+        for url, details in zip(pending, fetched):
+            if details is not None:
+                results[url] = details
+        pending = [url for url in pending if url not in results]
+        if pending:
+            logging.info(f"Fallback do przeglądarki dla {len(pending)} stron szczegółów")
+
+    if pending:
+        await _fetch_details_browser(browser, pending, pool_size, results)
+
+    logging.info(f"Pobrano szczegóły {len(results)} ogłoszeń w {time.perf_counter() - started:.1f}s")
+    return results
@@ -0,0 +1,136 @@
+"""Symulacja harmonogramu skanów na historycznych danych.
+
+Odtwarza momenty pojawienia się ogłoszeń (kolumny `source_url`/`first_seen`
+w bazie albo plik CSV `url,timestamp`) i porównuje stały losowy interwał
+z adaptacyjnym harmonogramem: średnie i p95 opóźnienie wykrycia oraz liczbę
+zapytań. Natężenia są szacowane na pierwszej połowie danych, a oceniane na drugiej.
+
+    python simulate.py --db otomoto_listings.db --days 14
+    python simulate.py --log arrivals.csv
+"""
+import csv
+import time
+import random
+import sqlite3
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from config import (
+    INTERWAL_SPRAWDZANIA_MIN, INTERWAL_SPRAWDZANIA_MAX, POLL_JITTER, SCHEDULER_REFRESH,
+    TARGET_DETECTION_LATENCY, POLL_BUDGET_PER_HOUR
+)
+from database import DB_PATH
+from scheduler import hourly_rates, allocate_intervals
+
+
+def load_arrivals_db(path, since):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    arrivals = defaultdict(list)
+    try:
+        rows = conn.execute(
+            'SELECT source_url, first_seen FROM listings WHERE source_url IS NOT NULL AND first_seen >= ?', (since,)
+        )
+        for url, ts in rows:
+            arrivals[url].append(ts)
+    finally:
+        conn.close()
+    return {url: sorted(ts) for url, ts in arrivals.items()}
+
+
+def load_arrivals_csv(path):
+    arrivals = defaultdict(list)
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[1].replace('.', '', 1).isdigit():
+                arrivals[row[0]].append(float(row[1]))
+    return {url: sorted(ts) for url, ts in arrivals.items()}
+
+
+def fixed_policy(url, now):
+    return random.randint(INTERWAL_SPRAWDZANIA_MIN * 60, INTERWAL_SPRAWDZANIA_MAX * 60)
+
+
+def adaptive_policy(training, urls, trained_until, target_latency, budget_per_hour):
+    """Polityka adaptacyjna: profile godzinowe z danych treningowych, przeliczane co SCHEDULER_REFRESH."""
+    profiles = [hourly_rates(training[u], trained_until, observed_since=min(training[u], default=None))
+                for u in urls]
+    cache = {}
+
+    def policy(url, now):
+        slot = int(now // SCHEDULER_REFRESH)
+        if slot not in cache:
+            cache.clear()
+            hour = time.localtime(now).tm_hour
+            cache[slot] = dict(zip(urls, allocate_intervals(
+                [p[hour] for p in profiles], budget_per_hour, target_latency
+            )))
+        return cache[slot][url] * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    return policy
+
+
+def simulate(arrivals, start, end, policy):
+    """Zwraca (opóźnienia wykrycia w sekundach, liczba skanów) dla danej polityki."""
+    latencies = []
+    polls = 0
+    for url, timestamps in arrivals.items():
+        ts = np.asarray([t for t in timestamps if start <= t < end])
+        # Skany zaczynają się w losowym momencie, jak po starcie bota
+        poll_times = []
+        t = start + random.uniform(0, fixed_policy(url, start))
+        while t < end:
+            poll_times.append(t)
+            t += policy(url, t)
+        polls += len(poll_times)
+        poll_times.append(float('inf'))
+        detected = np.asarray(poll_times)[np.searchsorted(poll_times, ts)]
+        found = np.isfinite(detected)
+        latencies.extend((detected[found] - ts[found]).tolist())
+    return np.asarray(latencies), polls
+
+
+def report(name, latencies, polls, hours):
+    if len(latencies):
+        print(f"{name:<12} średnio {latencies.mean() / 60:6.2f} min | p95 {np.percentile(latencies, 95) / 60:6.2f} min"
+              f" | skanów {polls} ({polls / hours:.1f}/h)")
+    else:
+        print(f"{name:<12} brak ogłoszeń w okresie testowym | skanów {polls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Porównanie harmonogramów skanów na historycznych danych.")
+    parser.add_argument('--db', default=DB_PATH, help="baza z ogłoszeniami (domyślnie %(default)s)")
+    parser.add_argument('--log', help="plik CSV url,timestamp zamiast bazy")
+    parser.add_argument('--days', type=float, default=14, help="ile ostatnich dni odtworzyć")
+    parser.add_argument('--target', type=float, default=TARGET_DETECTION_LATENCY,
+                        help="docelowe średnie opóźnienie wykrycia w minutach (domyślnie %(default)s)")
+    parser.add_argument('--budget', type=float, default=POLL_BUDGET_PER_HOUR,
+                        help="maks. liczba skanów na godzinę (domyślnie %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.log:
+        arrivals = load_arrivals_csv(args.log)
+    else:
+        arrivals = load_arrivals_db(args.db, time.time() - args.days * 24 * 3600)
+    if not arrivals:
+        print("Brak danych o napływie ogłoszeń (kolumna source_url jest pusta).")
+        return
+
+    everything = [t for ts in arrivals.values() for t in ts]
+    start, end = min(everything), max(everything)
+    split = start + (end - start) / 2
+    training = {url: [t for t in ts if t < split] for url, ts in arrivals.items()}
+    hours = (end - split) / 3600
+    print(f"{len(arrivals)} wyszukiwań, {len(everything)} ogłoszeń; ocena na ostatnich {hours:.1f} h")
+
+    report("stały", *simulate(arrivals, split, end, fixed_policy), hours)
+    adaptive = adaptive_policy(training, list(arrivals), split, args.target * 60, args.budget)
+    report("adaptacyjny", *simulate(arrivals, split, end, adaptive), hours)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Archiwum pobranych stron i ponowne przetwarzanie bez odpytywania Otomoto.
+
+Strony wyników i szczegółów (HTML z trybu HTTP albo dane wyciągnięte przez
+przeglądarkę jako JSON) są kompresowane zlib i zapisywane pod skrótem SHA-256
+treści, więc ta sama strona pobrana wiele razy zajmuje miejsce raz. Indeks
+(kind, url, digest, czas pobrania) leży w SQLite obok plików. Po przekroczeniu
+SNAPSHOT_MAX_MB usuwane są najdawniej zapisane treści.
+
+    python snapshots.py stats
+    python snapshots.py reprocess --workers 8 --output reprocessed.jsonl
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+
+from config import SNAPSHOT_ENABLED, SNAPSHOT_DIR, SNAPSHOT_MAX_MB, SNAPSHOT_COMPRESSION_LEVEL
+from models import ListingDetails
+
+# Rodzaje zapisów: HTML z trybu HTTP albo JSON z przeglądarki
+KIND_RESULTS = "results"
+KIND_DETAILS = "details"
+KIND_RESULTS_JSON = "results_json"
+KIND_DETAILS_JSON = "details_json"
+RESULT_KINDS = (KIND_RESULTS, KIND_RESULTS_JSON)
+
+
+def _blob_path(root, digest):
+    return os.path.join(root, "objects", digest[:2], digest[2:] + ".zz")
+
+
+def read_blob(root, digest):
+    with open(_blob_path(root, digest), "rb") as f:
+        return zlib.decompress(f.read()).decode("utf-8")
+
+
+class SnapshotStore:
+    """Skompresowane, adresowane treścią archiwum stron z limitem rozmiaru."""
+
+    def __init__(self, root=SNAPSHOT_DIR, max_bytes=SNAPSHOT_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    kind TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_stored_at ON blobs (stored_at)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_digest ON snapshots (digest)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def put(self, kind, url, content):
+        """Zapisuje treść strony i zwraca jej skrót."""
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            known = self.conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            size = 0
+            if not known:
+                path = _blob_path(self.root, digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                compressed = zlib.compress(data, SNAPSHOT_COMPRESSION_LEVEL)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+                size = len(compressed)
+            with self.conn:
+                # Ponownie pobrana treść odświeża czas zapisu, więc nie wypadnie jako pierwsza
+                self.conn.execute(
+                    'INSERT INTO blobs (digest, size, stored_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(digest) DO UPDATE SET stored_at = excluded.stored_at',
+                    (digest, size, now)
+                )
+                self.conn.execute(
+                    'INSERT INTO snapshots (kind, url, digest, fetched_at) VALUES (?, ?, ?, ?)',
+                    (kind, url, digest, now)
+                )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return digest
+
+    def get(self, digest):
+        return read_blob(self.root, digest)
+
+    def _evict(self):
+        """Usuwa najdawniej zapisane treści, aż archiwum zejdzie do 90% limitu."""
+        target = self.max_bytes * 0.9
+        removed = 0
+        while self.total_bytes > target:
+            rows = self.conn.execute('SELECT digest, size FROM blobs ORDER BY stored_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            evicted = []
+            for digest, size in rows:
+                if self.total_bytes <= target:
+                    break
+                try:
+                    os.remove(_blob_path(self.root, digest))
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+                evicted.append((digest,))
+            with self.conn:
+                self.conn.executemany('DELETE FROM snapshots WHERE digest = ?', evicted)
+                self.conn.executemany('DELETE FROM blobs WHERE digest = ?', evicted)
+            removed += len(evicted)
+        logging.info(f"Archiwum stron: usunięto {removed} najstarszych zapisów ({self.total_bytes / 2**20:.0f} MB)")
+
+    def entries(self, kinds=None):
+        """Zapisy archiwum (kind, url, digest, fetched_at) od najstarszych."""
+        query = 'SELECT kind, url, digest, fetched_at FROM snapshots'
+        params = ()
+        if kinds:
+            query += f" WHERE kind IN ({','.join('?' * len(kinds))})"
+            params = tuple(kinds)
+        return self.conn.execute(query + ' ORDER BY fetched_at', params).fetchall()
+
+    def stats(self):
+        by_kind = dict(self.conn.execute('SELECT kind, COUNT(*) FROM snapshots GROUP BY kind').fetchall())
+        blobs = self.conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        return {"snapshots": by_kind, "blobs": blobs, "size_mb": round(self.total_bytes / 2**20, 1)}
+
+    def close(self):
+        self.conn.close()
+
+
+_store = None
+
+
+def get_store():
+    """Współdzielone archiwum albo None, gdy SNAPSHOT_ENABLED jest wyłączone."""
+    global _store
+    if SNAPSHOT_ENABLED and _store is None:
+        _store = SnapshotStore()
+    return _store
+
+
+def archive(kind, url, content):
+    """Zapisuje stronę w archiwum, jeśli jest włączone. Błąd archiwum nie przerywa skanu."""
+    if not SNAPSHOT_ENABLED or not content:
+        return
+    try:
+        get_store().put(kind, url, content)
+    except Exception as e:
+        logging.error(f"Błąd zapisu strony do archiwum ({url}): {e}")
+
+
+async def archive_json(kind, url, data):
+    """Zapisuje w archiwum dane wyciągnięte przez przeglądarkę (w wątku, bez blokowania pętli)."""
+    if SNAPSHOT_ENABLED and data:
+        await asyncio.to_thread(archive, kind, url, json.dumps(data, ensure_ascii=False))
+
+
+# --- Ponowne przetwarzanie archiwum ---
+
+_worker_root = None
+
+
+def _init_worker(root):
+    global _worker_root
+    _worker_root = root
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _parse_entry(entry):
+    """Parsuje jeden zapis archiwum w procesie roboczym: (kind, url, fetched_at, wynik)."""
+    from http_fetcher import parse_results_html, parse_details_html
+
+    kind, url, digest, fetched_at = entry
+    try:
+        content = read_blob(_worker_root, digest)
+    except (OSError, zlib.error):
+        return kind, url, fetched_at, None
+    if kind == KIND_RESULTS:
+        return kind, url, fetched_at, parse_results_html(content, now=datetime.fromtimestamp(fetched_at, timezone.utc))
+    if kind == KIND_DETAILS:
+        return kind, url, fetched_at, parse_details_html(content)
+    if kind == KIND_RESULTS_JSON:
+        from scraper import parse_raw_article
+        return kind, url, fetched_at, [l for l in map(parse_raw_article, json.loads(content)) if l]
+    return kind, url, fetched_at, ListingDetails.from_dict(json.loads(content))
+
+
+def reprocess(store, db_path=None, workers=None, output=None, chunksize=64):
+    """Parsuje ponownie całe archiwum w puli procesów i wycenia ogłoszenia lokalnym modelem.
+
+    Każde ogłoszenie bierze najnowszy zapis z listy wyników i najnowsze
+    szczegóły. Model jest dopasowany do historii z bazy `db_path`, a bez
+    niej do samego archiwum. Zwraca podsumowanie (liczniki i przepustowość).
+    """
+    from database import ListingStore
+    from parsing import listing_features
+    from valuation import PriceModel
+
+    started = time.perf_counter()
+    entries = store.entries()
+    listings, details = {}, {}
+    failed = 0
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(store.root,)) as pool:
+        # Kolejność wyników nie ma znaczenia - liczy się czas pobrania zapisany w zapisie
+        for kind, url, fetched_at, parsed in pool.imap_unordered(_parse_entry, entries, chunksize):
+            if parsed is None:
+                failed += 1
+            elif kind in RESULT_KINDS:
+                for listing in parsed:
+                    if listing.id not in listings or listings[listing.id][0] <= fetched_at:
+                        listings[listing.id] = (fetched_at, listing)
+            elif url not in details or details[url][0] <= fetched_at:
+                details[url] = (fetched_at, parsed)
+    parsed_at = time.perf_counter()
+
+    records = []
+    for _, listing in listings.values():
+        detail = details.get(listing.url, (None, None))[1]
+        features = listing_features(listing, detail)
+        if features['currency'] != 'PLN':
+            features['price'] = None
+        records.append({**listing.to_dict(), 'details': detail.to_dict() if detail else None, 'features': features})
+
+    model = PriceModel()
+    rows = []
+    if db_path and os.path.exists(db_path):
+        history = ListingStore(db_path)
+        rows = history.training_rows()
+        history.close()
+    if not rows:
+        rows = [(f['make'], f['model'], f['price'], f['year'], f['mileage'], f['engine_capacity'])
+                for f in (r['features'] for r in records) if f['price'] and f['year'] and f['make']]
+    model.fit(rows)
+    discounts = model.discounts([r['features'] for r in records])
+    for record, discount in zip(records, discounts):
+        record['discount'] = None if discount != discount else round(float(discount), 4)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "entries": len(entries),
+        "failed": failed,
+        "listings": len(records),
+        "with_details": sum(1 for r in records if r['details']),
+        "valued": sum(1 for r in records if r['discount'] is not None),
+        "parse_seconds": round(parsed_at - started, 3),
+        "total_seconds": round(elapsed, 3),
+        "entries_per_second": round(len(entries) / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    from database import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Archiwum pobranych stron Otomoto.")
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help="katalog archiwum (domyślnie %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="rozmiar i liczba zapisów archiwum")
+    reprocess_parser = commands.add_parser('reprocess', help="ponowne parsowanie i wycena całego archiwum")
+    reprocess_parser.add_argument('--db', default=DB_PATH, help="baza z historią do modelu wyceny (domyślnie %(default)s)")
+    reprocess_parser.add_argument('--workers', type=int, default=None, help="liczba procesów (domyślnie liczba CPU)")
+    reprocess_parser.add_argument('--output', help="plik JSONL z wynikami dla każdego ogłoszenia")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        sys.exit(f"Brak archiwum w katalogu {args.dir} (włącz SNAPSHOT_ENABLED=1)")
+    store = SnapshotStore(args.dir)
+    try:
+        if args.command == 'stats':
+            summary = store.stats()
+        else:
+            summary = reprocess(store, db_path=args.db, workers=args.workers, output=args.output)
+    finally:
+        store.close()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
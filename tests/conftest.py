@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# Moduły projektu leżą płasko w katalogu głównym repozytorium
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+FIXTURES_DIR = ROOT / "benchmark_fixtures"
@@ -0,0 +1,16 @@
+"""Kompaktowanie danych ogłoszenia do promptu."""
+from analyzer import _compact_parameters
+from models import ListingDetails
+
+
+def test_compact_parameters_drops_exact_repeats_only():
+    details = ListingDetails(
+        parameters="Rok produkcji: 2016\nKolor: Czarny matowy\nABS: Tak\n"
+                   "--- SZCZEGÓŁY I WYPOSAŻENIE ---\nABS przedni\nABS\nABS przedni",
+        highlights="2016\nCzarny\nCzarny matowy\nrok  produkcji:2016",
+    )
+    params, equipment = _compact_parameters(details)
+
+    # "Czarny" i "ABS" tylko zawierają się w innych wpisach - nie są powtórzeniami
+    assert params == ["Rok produkcji: 2016", "Kolor: Czarny matowy", "ABS: Tak", "Czarny"]
+    assert equipment == ["ABS przedni", "ABS"]
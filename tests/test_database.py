@@ -0,0 +1,31 @@
+"""Stan bazy ogłoszeń w `ListingStore`/`init_db`."""
+from database import init_db
+from models import Listing, ListingDetails
+
+SEARCH_URL = "https://www.otomoto.pl/motocykle-i-quady/motocykle"
+
+
+def test_clean_start_resets_scan_state(tmp_path):
+    path = tmp_path / "listings.db"
+    store = init_db(path=path)
+    store.save_listings([Listing(id="6120000900", title="KTM Duke 390", url=f"{SEARCH_URL}/1", price=4840000)])
+    store.update_watermark(SEARCH_URL, ["6120000900"])
+    store.close()
+
+    store = init_db(clean_start=True, path=path)
+    assert store.get_watermark(SEARCH_URL) is None
+    assert store.first_scan_at(SEARCH_URL) is None
+    assert store.filter_new(["6120000900"]) == ["6120000900"]
+    store.close()
+
+
+def test_training_rows_exclude_scored_listings(tmp_path):
+    store = init_db(path=tmp_path / "listings.db")
+    details = ListingDetails(make="honda", model="cbr 600rr")
+    listings = [Listing(id=str(i), title="Honda CBR 600RR", url=f"{SEARCH_URL}/{i}", price=3000000 + i * 100,
+                        currency="PLN", year=2016) for i in range(3)]
+    store.save_listings(listings, details_by_url={listing.url: details for listing in listings})
+
+    assert len(store.training_rows()) == 3
+    assert sorted(row[2] for row in store.training_rows(exclude_ids=["1"])) == [30000, 30002]
+    store.close()
@@ -0,0 +1,49 @@
+"""Wyszukiwanie repostów w `DedupIndex`."""
+import random
+
+import pytest
+
+from config import DEDUP_IMAGE_DISTANCE, DEDUP_TEXT_ONLY_DISTANCE
+from dedup import DedupIndex
+
+
+def flip(value, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DedupIndex(path=tmp_path / "dedup.db")
+    rng = random.Random(0)
+    for i in range(200):
+        index.add(str(i), rng.getrandbits(64), rng.getrandbits(64), 1000, 'PLN', 2010 + i % 10, 1000 * (i % 20))
+    yield index, rng
+    index.conn.close()
+
+
+def test_find_repost_by_image(index):
+    index, rng = index
+    text_hash, image_hash = rng.getrandbits(64), rng.getrandbits(64)
+    index.add('original', text_hash, image_hash, 1500, 'PLN', 2015, 12000)
+
+    repost_text, repost_image = flip(text_hash, 5, rng), flip(image_hash, DEDUP_IMAGE_DISTANCE, rng)
+    assert index.find('repost', repost_text, repost_image, 2015, 12000) == {
+        'listing_id': 'original', 'price': 1500, 'currency': 'PLN'
+    }
+    # Rocznik nieznany po jednej stronie nie wyklucza dopasowania
+    assert index.find('repost', repost_text, repost_image, None, 12000)['listing_id'] == 'original'
+    assert index.find('repost', repost_text, repost_image, 2016, 12000) is None
+    assert index.find('repost', repost_text, repost_image, 2015, 13000) is None
+    assert index.find('repost', repost_text, flip(image_hash, DEDUP_IMAGE_DISTANCE + 1, rng), 2015, 12000) is None
+    assert index.find('original', text_hash, image_hash, 2015, 12000) is None
+
+
+def test_find_repost_by_text_only(index):
+    index, rng = index
+    text_hash = rng.getrandbits(64)
+    index.add('original', text_hash, None, 1500, 'PLN', None, None)
+
+    assert index.find('repost', flip(text_hash, DEDUP_TEXT_ONLY_DISTANCE, rng))['listing_id'] == 'original'
+    assert index.find('repost', flip(text_hash, DEDUP_TEXT_ONLY_DISTANCE + 1, rng)) is None
@@ -0,0 +1,171 @@
+"""Parsowanie `__NEXT_DATA__` na nagranych stronach i ścieżki fallbacku."""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scraper
+from conftest import FIXTURES_DIR
+from http_fetcher import fetch_html, is_antibot_page, parse_details_html, parse_results_html
+from models import Listing
+
+RESULTS_HTML = (FIXTURES_DIR / "results.html").read_text(encoding="utf-8")
+DETAIL_HTML = (FIXTURES_DIR / "detail_1.html").read_text(encoding="utf-8")
+CAPTCHA_HTML = "<html><body><div class='g-recaptcha'>Potwierdź, że nie jesteś robotem (captcha)</div></body></html>"
+NO_NEXT_DATA_HTML = "<html><body><article>KTM Duke 390</article></body></html>"
+
+
+def next_data_page(props):
+    return (f'<html><body><script id="__NEXT_DATA__" type="application/json">'
+            f'{{"props": {props}}}</script></body></html>')
+
+
+@pytest.fixture
+def http_server():
+    """Lokalny serwer zwracający (status, body) z `routes` dla danej ścieżki."""
+    routes = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            status, body = routes.get(self.path, (404, ""))
+            payload = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", routes
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_results_page_listings():
+    now = datetime(2026, 10, 18, 13, 0, tzinfo=timezone.utc)
+    listings = parse_results_html(RESULTS_HTML, now=now)
+
+    assert len(listings) == 32
+    assert len({listing.id for listing in listings}) == 32
+    first = listings[0]
+    assert first.id == "6120000900"
+    assert first.title == "KTM Duke 390"
+    assert first.url == "https://www.otomoto.pl/motocykle-i-quady/oferta/ktm-duke-390-ID6120000900.html"
+    assert first.image_url.startswith("https://ireland.apollo.olxcdn.com/")
+    assert first.price == 4840000
+    assert first.currency == "PLN"
+    assert first.year == 2008
+    assert first.mileage == 86000
+    assert first.engine_capacity == 390
+    assert first.is_today
+
+
+def test_results_page_is_today_uses_created_at():
+    # Pierwsze ogłoszenie dodano 2026-10-18T12:00:00Z - po 24h już nie jest "dzisiejsze"
+    later = datetime(2026, 10, 19, 12, 30, tzinfo=timezone.utc)
+    assert not parse_results_html(RESULTS_HTML, now=later)[0].is_today
+
+
+def test_details_page():
+    details = parse_details_html(DETAIL_HTML)
+
+    assert details.year == 2016
+    assert details.mileage == 12000
+    assert details.engine_capacity == 689
+    assert details.power == 80
+    assert details.make == "honda"
+    assert details.model == "cbr 600rr"
+    lines = details.parameters.split("\n")
+    assert lines[:6] == [
+        "Marka pojazdu: Honda",
+        "Model pojazdu: CBR 600RR",
+        "Rok produkcji: 2016",
+        "Przebieg: 12000 km",
+        "Pojemność skokowa: 689 cm3",
+        "Moc: 80 KM",
+    ]
+    assert "--- SZCZEGÓŁY I WYPOSAŻENIE ---" in lines
+    assert details.highlights == "2016\n12000 km\n689 cm3\n80 KM"
+    assert details.description.startswith("Motocykl w bardzo dobrym stanie technicznym i wizualnym.")
+
+
+def test_missing_next_data_returns_none():
+    assert parse_results_html(NO_NEXT_DATA_HTML) is None
+    assert parse_details_html(NO_NEXT_DATA_HTML) is None
+
+
+def test_next_data_without_expected_keys_returns_none():
+    page = next_data_page('{"pageProps": {"somethingElse": {}}}')
+    assert parse_results_html(page) is None
+    assert parse_details_html(page) is None
+    assert parse_results_html(next_data_page('{"advertSearch": {"edges": null}}')) is None
+
+
+def test_is_antibot_page():
+    assert is_antibot_page(CAPTCHA_HTML)
+    assert is_antibot_page(RESULTS_HTML, status_code=403)
+    assert is_antibot_page("", status_code=429)
+    assert not is_antibot_page(RESULTS_HTML)
+    assert not is_antibot_page(NO_NEXT_DATA_HTML)
+
+
+def test_fetch_html_rejects_antibot_and_errors(http_server):
+    base_url, routes = http_server
+    routes["/ok"] = (200, RESULTS_HTML)
+    routes["/captcha"] = (200, CAPTCHA_HTML)
+    routes["/blocked"] = (403, RESULTS_HTML)
+    routes["/error"] = (500, "<html></html>")
+
+    assert fetch_html(f"{base_url}/ok") == RESULTS_HTML
+    assert fetch_html(f"{base_url}/captcha") is None
+    assert fetch_html(f"{base_url}/blocked") is None
+    assert fetch_html(f"{base_url}/error") is None
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.pages = 0
+
+    @asynccontextmanager
+    async def page(self, slot=0):
+        self.pages += 1
+        yield self
+
+    async def goto(self, url, **kwargs):
+        pass
+
+
+@pytest.mark.parametrize("page_html", [None, NO_NEXT_DATA_HTML])
+def test_fetch_results_falls_back_to_browser(monkeypatch, page_html):
+    fallback = [Listing(id="1", title="Honda CBR 600RR", url="https://www.otomoto.pl/1")]
+
+    async def extract(page):
+        return fallback
+
+    monkeypatch.setattr(scraper, "FETCH_MODE", "http")
+    monkeypatch.setattr(scraper, "_fetch_page", lambda kind, url: page_html)
+    monkeypatch.setattr(scraper, "extract_from_otomoto", extract)
+    browser = FakeBrowser()
+
+    assert asyncio.run(scraper.fetch_results(browser, "https://www.otomoto.pl/motocykle-i-quady")) == fallback
+    assert browser.pages == 1
+
+
+def test_fetch_results_http_skips_browser(monkeypatch):
+    monkeypatch.setattr(scraper, "FETCH_MODE", "http")
+    monkeypatch.setattr(scraper, "_fetch_page", lambda kind, url: RESULTS_HTML)
+    browser = FakeBrowser()
+
+    listings = asyncio.run(scraper.fetch_results(browser, "https://www.otomoto.pl/motocykle-i-quady"))
+    assert len(listings) == 32
+    assert browser.pages == 0
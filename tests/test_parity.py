@@ -0,0 +1,68 @@
+"""Zgodność ekstrakcji z przeglądarki (`_ARTICLES_JS` + `parse_raw_article`) ze ścieżką HTTP."""
+import asyncio
+import html
+import re
+
+import pytest
+
+from benchmark import PARITY_FIELDS, FixtureServer, check_parity, parity_mismatches
+from conftest import FIXTURES_DIR
+from http_fetcher import parse_results_html
+from scraper import parse_raw_article
+
+RESULTS_HTML = (FIXTURES_DIR / "results.html").read_text(encoding="utf-8")
+ARTICLE_RE = re.compile(r'<article data-id="(\d+)".*?</article>', re.S)
+TITLE_RE = re.compile(r'<h2><a href="([^"]*)"[^>]*>(.*?)</a></h2>', re.S)
+PRICE_RE = re.compile(r'<h3>(.*?)</h3>', re.S)
+LABEL_RE = re.compile(r'<li data-testid="ad-labels">(.*?)</li>', re.S)
+
+
+def static_articles(page_html):
+    """Surowe artykuły w formacie `_ARTICLES_JS`, zebrane z HTML bez przeglądarki.
+
+    Nie zastępuje `check_parity` (nie wykonuje JS), ale sprawdza parsowanie
+    etykiet ze strony wyników na każdym ogłoszeniu z fixtures.
+    """
+    articles = []
+    for match in ARTICLE_RE.finditer(page_html):
+        block = match.group(0)
+        title = TITLE_RE.search(block)
+        price = PRICE_RE.search(block)
+        labels = [html.unescape(label).strip() for label in LABEL_RE.findall(block)]
+        articles.append({
+            "id": match.group(1),
+            "text": html.unescape(re.sub(r'<[^>]+>', '\n', block)),
+            "title": html.unescape(title.group(2)).strip() if title else "",
+            "has_title": bool(title),
+            "url": title.group(1) if title else "",
+            "price": html.unescape(price.group(1)) if price else "",
+            "labels": labels,
+            "label_containers": [" ".join(labels)],
+            "image_url": "",
+        })
+    return articles
+
+
+def test_labels_match_next_data():
+    listings = [listing for listing in map(parse_raw_article, static_articles(RESULTS_HTML)) if listing]
+    http_listings = parse_results_html(RESULTS_HTML)
+
+    assert len(listings) == len(http_listings) == 32
+    assert parity_mismatches(listings, http_listings, PARITY_FIELDS, "HTTP") == []
+
+
+def test_browser_extraction_matches_http():
+    """`_ARTICLES_JS` vs locatory vs `__NEXT_DATA__` w prawdziwym Chromium.
+
+    Pomijany, gdy Chromium nie da się uruchomić (brak `playwright install`
+    albo bibliotek systemowych).
+    """
+    pytest.importorskip("playwright")
+    with FixtureServer() as server:
+        try:
+            mismatches = asyncio.run(check_parity(server))
+        except Exception as e:
+            if "launch" not in str(e).lower():
+                raise
+            pytest.skip(f"Chromium niedostępny: {str(e).splitlines()[0]}")
+    assert mismatches == []
@@ -0,0 +1,9 @@
+"""Lokalny model cen."""
+from valuation import PriceModel
+
+
+def test_empty_fit_counts_as_fitted():
+    model = PriceModel()
+    model.fit([])
+    assert model.fitted_at > 0
+    assert model.global_coef is None
@@ -0,0 +1,154 @@
+import time
+import logging
+from datetime import date
+
+import numpy as np
+
+from config import VALUATION_MIN_COMPARABLES, VALUATION_MIN_DISCOUNT
+from parsing import listing_features
+
+# Przebieg przyjmowany, gdy ogłoszenie go nie podaje
+_DEFAULT_MILEAGE = 20000
+
+
+def _design(age, mileage, engine=None):
+    columns = [np.ones_like(age), age, np.log1p(mileage)]
+    if engine is not None:
+        columns.append(np.log(engine))
+    return np.column_stack(columns)
+
+
+def huber_regression(X, y, delta=1.345, iterations=25):
+    """Odporna regresja liniowa (Huber, IRLS) - pojedyncze przebitki cenowe nie psują wyniku."""
+    beta = np.linalg.lstsq(X, y, rcond=None)[0]
+    for _ in range(iterations):
+        residuals = y - X @ beta
+        scale = np.median(np.abs(residuals - np.median(residuals))) / 0.6745
+        if scale < 1e-9:
+            break
+        u = np.abs(residuals) / (delta * scale)
+        weights = np.sqrt(np.where(u <= 1, 1.0, 1.0 / u))
+        new_beta = np.linalg.lstsq(X * weights[:, None], y * weights, rcond=None)[0]
+        if np.allclose(new_beta, beta, atol=1e-6):
+            beta = new_beta
+            break
+        beta = new_beta
+    return beta
+
+
+class PriceModel:
+    """Lokalny model cen: regresja log(ceny) od wieku i przebiegu per marka/model.
+
+    Modele bez wystarczającej liczby porównywalnych ofert korzystają z modelu
+    globalnego, który dodatkowo uwzględnia pojemność silnika.
+    """
+
+    def __init__(self, min_comparables=VALUATION_MIN_COMPARABLES):
+        self.min_comparables = min_comparables
+        self.group_index = {}
+        self.group_coef = np.empty((0, 3))
+        self.global_coef = None
+        self.fitted_at = 0.0
+
+    def fit(self, rows, current_year=None):
+        """Dopasowuje model do wierszy (make, model, price, year, mileage, engine_capacity)."""
+        current_year = current_year or date.today().year
+        # Także pusta historia liczy się jako dopasowanie - inaczej każda partia próbowałaby od nowa
+        self.fitted_at = time.time()
+        if not rows:
+            return self
+
+        makes, models, price, year, mileage, engine = zip(*rows)
+        price = np.asarray(price, dtype=float)
+        age = current_year - np.asarray(year, dtype=float)
+        mileage = np.asarray([m if m is not None else np.nan for m in mileage], dtype=float)
+        mileage = np.where(np.isnan(mileage), _DEFAULT_MILEAGE, mileage)
+        engine = np.asarray([e if e else np.nan for e in engine], dtype=float)
+        valid = (price > 0) & (age >= 0)
+        y = np.log(np.where(valid, price, 1.0))
+
+        keys = np.array([f"{mk}|{md}" for mk, md in zip(makes, models)])
+        unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+        group_index = {}
+        coefs = []
+        X_group = _design(age, mileage)
+        # Sortowanie po grupie pozwala wyciąć wiersze każdego modelu bez maskowania całej tablicy
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        for g in np.flatnonzero(counts >= self.min_comparables):
+            rows_g = order[bounds[g]:bounds[g + 1]]
+            rows_g = rows_g[valid[rows_g]]
+            if len(rows_g) < self.min_comparables:
+                continue
+            group_index[unique[g]] = len(coefs)
+            coefs.append(huber_regression(X_group[rows_g], y[rows_g]))
+
+        self.group_index = group_index
+        self.group_coef = np.array(coefs) if coefs else np.empty((0, 3))
+
+        has_engine = valid & ~np.isnan(engine)
+        if has_engine.sum() >= self.min_comparables:
+            X_global = _design(age[has_engine], mileage[has_engine], engine[has_engine])
+            self.global_coef = huber_regression(X_global, y[has_engine])
+
+        logging.info(
+            f"Model wyceny: {len(group_index)} modeli motocykli, "
+            f"model globalny: {'tak' if self.global_coef is not None else 'nie'}, wierszy: {len(rows)}"
+        )
+        return self
+
+    def predict(self, features, current_year=None):
+        """Oczekiwane ceny dla listy słowników cech (NaN, gdy nie da się wycenić)."""
+        current_year = current_year or date.today().year
+        n = len(features)
+        if not n:
+            return np.empty(0)
+
+        age = np.array([current_year - (f['year'] or np.nan) for f in features], dtype=float)
+        mileage = np.array([f['mileage'] if f['mileage'] is not None else _DEFAULT_MILEAGE for f in features],
+                           dtype=float)
+        engine = np.array([f['engine_capacity'] or np.nan for f in features], dtype=float)
+        group = np.array([self.group_index.get(f"{f['make']}|{f['model']}", -1) for f in features])
+
+        predicted = np.full(n, np.nan)
+        in_group = group >= 0
+        if in_group.any():
+            X = _design(age[in_group], mileage[in_group])
+            predicted[in_group] = np.exp(np.einsum('ij,ij->i', X, self.group_coef[group[in_group]]))
+
+        if self.global_coef is not None:
+            rest = ~in_group & ~np.isnan(engine)
+            if rest.any():
+                X = _design(age[rest], mileage[rest], engine[rest])
+                predicted[rest] = np.exp(X @ self.global_coef)
+        return predicted
+
+    def discounts(self, features, current_year=None):
+        """Rabat względem wyceny: 0.2 oznacza cenę o 20% niższą od oczekiwanej."""
+        predicted = self.predict(features, current_year)
+        price = np.array([f['price'] if f['price'] else np.nan for f in features], dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 1.0 - price / predicted
+
+
+def prescreen(model, listings, details_by_url, min_discount=VALUATION_MIN_DISCOUNT):
+    """Dzieli kandydatów na warte analizy AI i odrzucone przez lokalną wycenę.
+
+    Ogłoszenia, których nie da się wycenić (brak danych lub modelu), przechodzą dalej.
+    Zwraca (do_analizy, odrzucone, rabaty) - rabaty jako słownik {id: rabat}.
+    """
+    features = [listing_features(l, details_by_url.get(l.url)) for l in listings]
+    for f in features:
+        if f['currency'] != 'PLN':
+            f['price'] = None
+    discounts = model.discounts(features)
+
+    passed, rejected, by_id = [], [], {}
+    for listing, discount in zip(listings, discounts):
+        if np.isnan(discount):
+            passed.append(listing)
+            continue
+        by_id[listing.id] = float(discount)
+        (passed if discount >= min_discount else rejected).append(listing)
+    return passed, rejected, by_id
@@ -0,0 +1,113 @@
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from config import VERDICT_CACHE_MEMORY_SIZE, VERDICT_CACHE_TTL, VERDICT_CACHE_MAX_ROWS
+from database import DB_PATH
+
+_NON_WORD_RE = re.compile(r'[^\w]+')
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    return _NON_WORD_RE.sub(' ', text).strip()
+
+
+def verdict_key(title, price, year, details):
+    """Hash treści ogłoszenia niezależny od ID, wielkości liter, interpunkcji i kolejności parametrów."""
+    def lines(text):
+        return sorted({_normalize(line) for line in str(text or '').splitlines()} - {''})
+
+    parts = [
+        _normalize(title),
+        _normalize(price),
+        _normalize(year),
+        '\n'.join(lines(details.highlights)),
+        '\n'.join(lines(details.parameters)),
+        _normalize(details.description[:2500]),
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class VerdictCache:
+    """Cache werdyktów Gemini: LRU w pamięci przed trwałym magazynem SQLite (TTL + limit wierszy)."""
+
+    def __init__(self, path=DB_PATH, memory_size=VERDICT_CACHE_MEMORY_SIZE,
+                 ttl=VERDICT_CACHE_TTL, max_rows=VERDICT_CACHE_MAX_ROWS):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS verdict_cache (
+                    key TEXT PRIMARY KEY,
+                    deal_type TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_verdict_cache_last_used ON verdict_cache (last_used)')
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Zwraca (deal_type, analysis) albo None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[2] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+
+            row = self.conn.execute(
+                'SELECT deal_type, analysis, created_at FROM verdict_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row and now - row[2] < self.ttl:
+                with self.conn:
+                    self.conn.execute('UPDATE verdict_cache SET last_used = ? WHERE key = ?', (now, key))
+                self._remember(key, row)
+                self.hits += 1
+                return row[0], row[1]
+
+            self._memory.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, deal_type, analysis):
+        now = time.time()
+        with self._lock:
+            self._remember(key, (deal_type, analysis, now))
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO verdict_cache (key, deal_type, analysis, created_at, last_used) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, deal_type, analysis, now, now)
+                )
+                self.conn.execute('DELETE FROM verdict_cache WHERE created_at < ?', (now - self.ttl,))
+                self.conn.execute(
+                    'DELETE FROM verdict_cache WHERE key IN ('
+                    'SELECT key FROM verdict_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_rows,)
+                )
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        logging.info(f"Cache werdyktów: trafienia {self.hits}, pudła {self.misses} ({ratio:.0f}% trafień)")
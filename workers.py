@@ -0,0 +1,143 @@
+"""Tryb wielu workerów na wspólnej bazie SQLite (WAL).
+
+Każda instancja (np. z innym IP) rejestruje się w tabeli `workers` i co
+WORKER_HEARTBEAT sekund zgłasza, że żyje. Wyszukiwania z MONITORED_URLS są
+dzielone między żyjące workery haszowaniem spójnym, więc dołączenie albo
+awaria jednego przesuwa tylko jego część URL-i. Ogłoszenia w potoku są brane
+w dzierżawę (`ListingStore.claim`); dzierżawy martwego workera wygasają po
+LEASE_TTL i przejmują je pozostali.
+
+    python main.py --worker --worker-id wroclaw-1
+    python workers.py                   # żyjące workery i podział wyszukiwań
+"""
+import os
+import time
+import bisect
+import socket
+import sqlite3
+import hashlib
+import logging
+
+from config import MONITORED_URLS, LEASE_TTL, HASH_RING_REPLICAS
+from database import DB_PATH, STAGE_DONE, live_workers
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Pierścień haszowania spójnego z wirtualnymi węzłami."""
+
+    def __init__(self, nodes, replicas=HASH_RING_REPLICAS):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+def default_worker_id():
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                host TEXT,
+                pid INTEGER,
+                started_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+    return conn
+
+
+class Worker:
+    """Jedna instancja bota w trybie wielu workerów."""
+
+    def __init__(self, store, worker_id=None, urls=MONITORED_URLS):
+        self.store = store
+        self.id = worker_id or default_worker_id()
+        self.urls = list(urls)
+        self.owned = set()
+        self.conn = _connect(store.path)
+
+    def register(self):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO workers (worker_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)',
+                (self.id, socket.gethostname(), os.getpid(), now, now)
+            )
+        # Dzierżawy z poprzedniego uruchomienia pod tym samym ID nikt już nie przetwarza
+        self.store.release_leases(self.id)
+        logging.info(f"Zarejestrowano workera {self.id}")
+        self.refresh()
+
+    def heartbeat(self):
+        """Zgłasza, że worker żyje, odnawia jego dzierżawy i przelicza podział wyszukiwań."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute('UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?', (now, self.id))
+            # Wpisy dawno martwych workerów nie są już potrzebne
+            self.conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (now - 24 * 3600,))
+        self.store.renew_leases(self.id, LEASE_TTL)
+        self.refresh()
+
+    def refresh(self):
+        ring = HashRing([*live_workers(self.conn), self.id])
+        owned = {url for url in self.urls if ring.node_for(url) == self.id}
+        if owned != self.owned:
+            logging.info(f"Worker {self.id} obsługuje {len(owned)} z {len(self.urls)} wyszukiwań")
+        self.owned = owned
+
+    def owns(self, url):
+        return url in self.owned
+
+    def claim(self, ids, include_done=False):
+        """Bierze w dzierżawę podane ogłoszenia. Zwraca zbiór przejętych ID."""
+        return set(self.store.claim(self.id, LEASE_TTL, ids=ids, include_done=include_done))
+
+    def claim_orphans(self, limit):
+        """Przejmuje ogłoszenia porzucone przez martwe workery (wygasłe dzierżawy)."""
+        return self.store.claim(self.id, LEASE_TTL, limit=limit)
+
+    def unregister(self):
+        try:
+            with self.conn:
+                self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.id,))
+            self.store.release_leases(self.id)
+        except sqlite3.Error as e:
+            logging.error(f"Błąd wyrejestrowania workera {self.id}: {e}")
+        finally:
+            self.conn.close()
+
+
+def main():
+    conn = _connect(DB_PATH)
+    workers = live_workers(conn)
+    ring = HashRing(workers)
+    now = time.time()
+    print(f"Żyjące workery: {len(workers)}")
+    for worker_id in workers:
+        leases = conn.execute(
+            'SELECT COUNT(*) FROM listings WHERE lease_owner = ? AND lease_expires >= ? AND stage != ?',
+            (worker_id, now, STAGE_DONE)
+        ).fetchone()[0]
+        urls = [url for url in MONITORED_URLS if ring.node_for(url) == worker_id]
+        print(f"- {worker_id}: {len(urls)} wyszukiwań, {leases} ogłoszeń w dzierżawie")
+        for url in urls:
+            print(f"    {url}")
+
+
+if __name__ == "__main__":
+    main()